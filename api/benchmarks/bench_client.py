@@ -0,0 +1,337 @@
+#!/usr/bin/env python3
+"""
+End-to-end benchmark of TagMachineAPI against the local stand-in server.
+
+Starts standin_server.py in a subprocess with synthetic data, then measures:
+  search     search latency and throughput for each select and output mode (including stream and partitioned), plus the parse-only share of it
+  reads      get_image_metadata and read_image requests per second at each concurrency level,
+             and get_images_metadata for the same images with each concurrency level of workers, per image and through search
+  mutations  tag_image / untag_image requests per second at each concurrency level
+  async      the same tag_image / untag_image requests through AsyncTagMachineAPI at each concurrency level
+  image_cache  prefetch_images into an empty ImageCache, then read_image from it and from a local store
+  bulk       the same tag_image / untag_image requests through a BulkWriter with each concurrency level of workers
+  adaptive   the bulk benchmark again with an AdaptiveLimit, up to each concurrency level (best with --latency and --capacity)
+
+Example:
+	python bench_client.py --images 100000 --concurrency 1,4,16 --output client.json
+"""
+import argparse
+import asyncio
+import concurrent.futures
+import json
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import requests
+
+from tag_machine_api import HAS_NATIVE_PARSER, AdaptiveLimit, ImageCache, SearchResultImage, TagMachineAPI, parse_search_response
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--port', type=int, default=1421)
+parser.add_argument('--images', type=int, default=100_000)
+parser.add_argument('--tags', type=int, default=20_000)
+parser.add_argument('--selects', type=str, default='id;hash;id,hash,tags,attributes', help='Semicolon separated select lists')
+parser.add_argument('--modes', type=str, default='objects,columns,lazy,stream,partitioned')
+parser.add_argument('--partition-size', type=int, default=8192, help='Images per partition for the partitioned search mode')
+parser.add_argument('--query', type=str, default='', help='Query for the search benchmarks (default: all images)')
+parser.add_argument('--repeats', type=int, default=3)
+parser.add_argument('--concurrency', type=str, default='1,4,16')
+parser.add_argument('--requests', type=int, default=1000, help='Requests per concurrency level for reads and mutations')
+parser.add_argument('--benchmarks', type=str, default='search,reads,mutations,async,bulk,image_cache,adaptive')
+parser.add_argument('--seed', type=int, default=42)
+parser.add_argument('--latency', type=float, default=0.0, help='Seconds the stand-in server adds to every request, to simulate a remote server')
+parser.add_argument('--capacity', type=int, default=None, help='Requests the stand-in server handles at once')
+parser.add_argument('--max-queue', type=int, default=None, help='Requests allowed to wait for capacity before the stand-in server answers 503')
+parser.add_argument('--output', type=str, default=None)
+
+TOKEN = 'bench'
+
+
+def wait_for_server(url: str, process: subprocess.Popen, timeout: float = 600):
+	deadline = time.time() + timeout
+	while time.time() < deadline:
+		if process.poll() is not None:
+			raise RuntimeError(f'Server exited with code {process.returncode}')
+		try:
+			requests.get(f'{url}/api/tags', headers={'Authorization': f'Bearer {TOKEN}'}, timeout=1)
+			return
+		except requests.RequestException:
+			time.sleep(0.5)
+
+	raise TimeoutError('Server did not start in time')
+
+
+def run_search(api: TagMachineAPI, query: str, select: list[str], mode: str, partition_size: int) -> int:
+	if mode == 'stream':
+		# Image responses yield each image, ID and hash responses yield arrays
+		return sum(1 if isinstance(item, SearchResultImage) else len(item) for item in api.search_stream(query, select))
+	if mode == 'partitioned':
+		# search_partitioned takes a /api/search_images operator rather than a query; only tag queries translate
+		operator = {'and': [{'tag': tag} for tag in query.split()]} if query.strip() else None
+		return sum(1 for _ in api.search_partitioned(operator, select, partition_size=partition_size))
+	return len(api.search(query, select, columnar=mode == 'columns', lazy=mode == 'lazy'))
+
+
+def bench_search(args, url: str) -> list[dict]:
+	api = TagMachineAPI(token=TOKEN, url=url)
+	results = []
+
+	for select in [s.split(',') for s in args.selects.split(';')]:
+		params = {'select': ','.join(select), 'query': args.query}
+		raw = requests.get(f'{url}/api/search/images', params=params, headers={'Authorization': f'Bearer {TOKEN}'}).content
+
+		for mode in args.modes.split(','):
+			timings, parse_timings = [], []
+			for _ in range(args.repeats):
+				start = time.perf_counter()
+				num_images = run_search(api, args.query, select, mode, args.partition_size)
+				timings.append(time.perf_counter() - start)
+
+				if mode not in ('stream', 'partitioned'):
+					start = time.perf_counter()
+					parse_search_response(raw, columnar=mode == 'columns', lazy=mode == 'lazy')
+					parse_timings.append(time.perf_counter() - start)
+
+			best = min(timings)
+			result = {
+				'benchmark': 'search',
+				'select': ','.join(select),
+				'mode': mode,
+				'images': num_images,
+				'payload_mb': len(raw) / 1e6,
+				'best_s': best,
+				'images_per_s': num_images / best,
+				'mb_per_s': len(raw) / 1e6 / best,
+			}
+			if parse_timings:
+				result['parse_best_s'] = min(parse_timings)
+			results.append(result)
+			print(json.dumps(result), file=sys.stderr)
+
+	return results
+
+
+def bench_requests(name: str, url: str, concurrency: int, num_requests: int, request) -> dict:
+	"""Issue num_requests calls of request(api, i) from `concurrency` threads, each with its own client"""
+	clients = [TagMachineAPI(token=TOKEN, url=url) for _ in range(concurrency)]
+	counter = iter(range(num_requests))
+	latencies = []
+
+	def worker(api: TagMachineAPI):
+		for i in counter:
+			start = time.perf_counter()
+			request(api, i)
+			latencies.append(time.perf_counter() - start)
+
+	start = time.perf_counter()
+	with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as pool:
+		list(pool.map(worker, clients))
+	elapsed = time.perf_counter() - start
+
+	p = np.percentile(np.array(latencies), [50, 95, 99]) * 1000
+	result = {
+		'benchmark': name,
+		'concurrency': concurrency,
+		'requests': num_requests,
+		'elapsed_s': elapsed,
+		'rps': num_requests / elapsed,
+		'p50_ms': float(p[0]),
+		'p95_ms': float(p[1]),
+		'p99_ms': float(p[2]),
+	}
+	print(json.dumps(result), file=sys.stderr)
+	return result
+
+
+async def bench_async_requests(name: str, url: str, concurrency: int, num_requests: int, request) -> dict:
+	"""Issue num_requests calls of request(api, i) at once from one AsyncTagMachineAPI limited to `concurrency` in flight"""
+	from tag_machine_api.aio import AsyncTagMachineAPI
+
+	latencies = []
+
+	async def timed(api: AsyncTagMachineAPI, i: int):
+		start = time.perf_counter()
+		await request(api, i)
+		latencies.append(time.perf_counter() - start)
+
+	async with AsyncTagMachineAPI(token=TOKEN, url=url, concurrency=concurrency) as api:
+		start = time.perf_counter()
+		await asyncio.gather(*(timed(api, i) for i in range(num_requests)))
+		elapsed = time.perf_counter() - start
+
+	# Latencies include the time spent waiting for a slot
+	p = np.percentile(np.array(latencies), [50, 95, 99]) * 1000
+	result = {
+		'benchmark': name,
+		'concurrency': concurrency,
+		'requests': num_requests,
+		'elapsed_s': elapsed,
+		'rps': num_requests / elapsed,
+		'p50_ms': float(p[0]),
+		'p95_ms': float(p[1]),
+		'p99_ms': float(p[2]),
+	}
+	print(json.dumps(result), file=sys.stderr)
+	return result
+
+
+def standin_images_query(ids: list[bytes | int]) -> str:
+	"""The stand-in's id and hash filter syntax, for get_images_metadata through search"""
+	if isinstance(ids[0], bytes):
+		return 'hash=' + ','.join(id.hex() for id in ids)
+	return 'id=' + ','.join(str(id) for id in ids)
+
+
+def bench_images_metadata(url: str, workers: int, image_ids: list[int], through_search: bool) -> dict:
+	api = TagMachineAPI(token=TOKEN, url=url)
+	start = time.perf_counter()
+	images = api.get_images_metadata(image_ids, workers=workers, images_query=standin_images_query if through_search else None)
+	elapsed = time.perf_counter() - start
+
+	result = {
+		'benchmark': 'get_images_metadata_search' if through_search else 'get_images_metadata',
+		'concurrency': workers,
+		'images': len(images),
+		'missing': sum(image is None for image in images),
+		'elapsed_s': elapsed,
+		'images_per_s': len(images) / elapsed,
+	}
+	print(json.dumps(result), file=sys.stderr)
+	return result
+
+
+def bench_image_cache(url: str, workers: int, image_ids: list[int]) -> dict:
+	hashes = [bytes.fromhex(image.hash) for image in TagMachineAPI(token=TOKEN, url=url).get_images_metadata(image_ids)]
+	with tempfile.TemporaryDirectory() as root:
+		api = TagMachineAPI(token=TOKEN, url=url, image_cache=ImageCache(root))
+
+		start = time.perf_counter()
+		failed = api.prefetch_images(hashes, workers=workers)
+		prefetch_elapsed = time.perf_counter() - start
+
+		start = time.perf_counter()
+		for hash in hashes:
+			api.read_image(hash)
+		read_elapsed = time.perf_counter() - start
+
+		# The cache has the same layout as the server's image store, so it can stand in for one
+		local = TagMachineAPI(token=TOKEN, url=url, local_store=root)
+		start = time.perf_counter()
+		for hash in hashes:
+			local.read_image(hash)
+		local_elapsed = time.perf_counter() - start
+
+	result = {
+		'benchmark': 'image_cache',
+		'concurrency': workers,
+		'images': len(hashes),
+		'failed': len(failed),
+		'prefetch_images_per_s': len(hashes) / prefetch_elapsed,
+		'cached_read_images_per_s': len(hashes) / read_elapsed,
+		'local_store_read_images_per_s': len(hashes) / local_elapsed,
+	}
+	print(json.dumps(result), file=sys.stderr)
+	return result
+
+
+def bench_bulk(url: str, workers: int, image_ids: list[int], tag_ids: list[int], adaptive: bool = False) -> dict:
+	limit = AdaptiveLimit(max_limit=workers) if adaptive else None
+	api = TagMachineAPI(token=TOKEN, url=url, concurrency_limit=limit)
+	with api.bulk_writer(workers=workers) as writer:
+		for image_id, tag_id in zip(image_ids, tag_ids):
+			writer.tag_image(image_id, tag_id)
+		writer.flush()
+		for image_id, tag_id in zip(image_ids, tag_ids):
+			writer.untag_image(image_id, tag_id)
+
+	result = {
+		'benchmark': 'bulk_writer_adaptive' if adaptive else 'bulk_writer',
+		'concurrency': workers,
+		'requests': writer.result.sent,
+		'coalesced': writer.result.coalesced,
+		'failures': len(writer.result.failures),
+		'retries': api.retry_policy.retries,
+		'elapsed_s': writer.result.elapsed,
+		'rps': writer.result.ops_per_second,
+	}
+	if limit is not None:
+		result['final_limit'] = limit.limit
+		result['limit_decreases'] = limit.decreases
+	print(json.dumps(result), file=sys.stderr)
+	return result
+
+
+def main():
+	args = parser.parse_args()
+	url = f'http://127.0.0.1:{args.port}'
+	benchmarks = args.benchmarks.split(',')
+	concurrency_levels = [int(c) for c in args.concurrency.split(',')]
+	rng = random.Random(args.seed)
+	image_ids = [rng.randint(1, args.images) for _ in range(args.requests)]
+	tag_ids = [rng.randint(1, args.tags - 1) for _ in range(args.requests)]
+
+	server_args = [
+		'--port', str(args.port), '--images', str(args.images), '--tags', str(args.tags), '--seed', str(args.seed), '--latency', str(args.latency),
+	]
+	if args.capacity is not None:
+		server_args += ['--capacity', str(args.capacity)]
+	if args.max_queue is not None:
+		server_args += ['--max-queue', str(args.max_queue)]
+	server = subprocess.Popen([sys.executable, str(Path(__file__).parent / 'standin_server.py')] + server_args, stdout=subprocess.DEVNULL)
+	try:
+		wait_for_server(url, server)
+		results = []
+
+		if 'search' in benchmarks:
+			results.extend(bench_search(args, url))
+
+		for concurrency in concurrency_levels:
+			if 'reads' in benchmarks:
+				results.append(bench_requests('get_image_metadata', url, concurrency, args.requests, lambda api, i: api.get_image_metadata(image_ids[i])))
+				results.append(bench_requests('read_image', url, concurrency, args.requests, lambda api, i: api.read_image(image_ids[i])))
+				results.append(bench_images_metadata(url, concurrency, image_ids, through_search=False))
+				results.append(bench_images_metadata(url, concurrency, image_ids, through_search=True))
+
+			if 'mutations' in benchmarks:
+				results.append(bench_requests('tag_image', url, concurrency, args.requests, lambda api, i: api.tag_image(image_ids[i], tag_ids[i])))
+				results.append(bench_requests('untag_image', url, concurrency, args.requests, lambda api, i: api.untag_image(image_ids[i], tag_ids[i])))
+
+			if 'async' in benchmarks:
+				tag = lambda api, i: api.tag_image(image_ids[i], tag_ids[i])
+				results.append(asyncio.run(bench_async_requests('async_tag_image', url, concurrency, args.requests, tag)))
+				untag = lambda api, i: api.untag_image(image_ids[i], tag_ids[i])
+				results.append(asyncio.run(bench_async_requests('async_untag_image', url, concurrency, args.requests, untag)))
+
+			if 'image_cache' in benchmarks:
+				results.append(bench_image_cache(url, concurrency, image_ids))
+
+			if 'bulk' in benchmarks:
+				results.append(bench_bulk(url, concurrency, image_ids, tag_ids))
+
+			if 'adaptive' in benchmarks:
+				results.append(bench_bulk(url, concurrency, image_ids, tag_ids, adaptive=True))
+	finally:
+		server.terminate()
+		server.wait()
+
+	report = {
+		'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+		'native_parser': HAS_NATIVE_PARSER,
+		'config': {k: v for k, v in vars(args).items() if k != 'output'},
+		'results': results,
+	}
+	report_json = json.dumps(report, indent=2)
+
+	if args.output is not None:
+		Path(args.output).write_text(report_json)
+	else:
+		print(report_json)
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Measure the memory used per image by search results.
+
+  legacy   the old representation: a plain class with a __dict__, tags as a dict and a fresh str per attribute
+  compact  SearchResultImage as the parser builds it: __slots__, packed tags and interned attribute strings
+  parsed   SearchResultImages returned by parse_search_response on a synthetic payload
+
+Memory is measured with tracemalloc, which NumPy and the parser's Python objects are both visible to.
+
+Example:
+	python bench_image_memory.py --num-images 100000
+"""
+import argparse
+import dataclasses
+import gc
+import json
+import random
+import struct
+import tracemalloc
+
+from bench_parse import make_payload
+from standin_server import random_image
+from tag_machine_api import DBImage, SearchResultImage, parse_search_response
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--num-images', type=int, default=100_000)
+parser.add_argument('--modes', type=str, default='legacy,compact,parsed,dbimage_legacy,dbimage')
+parser.add_argument('--seed', type=int, default=42)
+
+
+class LegacySearchResultImage:
+	id: int | None
+	hash: bytes | None
+	tags: dict[int, int] | None
+	attributes: dict[str, dict[str, int]] | None
+
+
+@dataclasses.dataclass(frozen=True)
+class LegacyDBImage:
+	id: int
+	hash: str
+	active: bool
+	tags: dict[int, int]
+	attributes: dict[str, dict[str, int]]
+
+
+def build(mode: str, num_images: int, seed: int) -> list:
+	rng = random.Random(seed)
+
+	if mode == 'parsed':
+		return parse_search_response(make_payload(num_images, {'id', 'hash', 'tags', 'attributes'}, seed))
+
+	images = []
+	strings: dict[str, str] = {}
+	for i in range(num_images):
+		image = random_image(rng, i, 20000)
+		id, hash, tags, attributes = image.id, image.hash, image.tags, image.attributes
+
+		if mode == 'legacy':
+			# A str per occurrence, as the old parser created them
+			image = LegacySearchResultImage()
+			image.id, image.hash, image.tags = id, hash, tags
+			image.attributes = {''.join(k): {''.join(v): u for v, u in vs.items()} for k, vs in attributes.items()}
+		elif mode == 'compact':
+			attributes = {strings.setdefault(k, k): {strings.setdefault(v, v): u for v, u in vs.items()} for k, vs in attributes.items()}
+			packed_tags = b''.join(struct.pack('<QQ', tag, user) for tag, user in tags.items())
+			image = SearchResultImage(id, hash, packed_tags, attributes)
+		elif mode == 'dbimage_legacy':
+			image = LegacyDBImage(id, hash.hex(), True, tags, attributes)
+		elif mode == 'dbimage':
+			image = DBImage(id, hash.hex(), True, tags, attributes)
+		else:
+			raise ValueError(f'Unknown mode: {mode}')
+
+		images.append(image)
+
+	return images
+
+
+def main():
+	args = parser.parse_args()
+	results = []
+
+	for mode in args.modes.split(','):
+		gc.collect()
+		tracemalloc.start()
+		images = build(mode, args.num_images, args.seed)
+		gc.collect()
+		current, _ = tracemalloc.get_traced_memory()
+		tracemalloc.stop()
+		assert len(images) == args.num_images
+		del images
+
+		results.append({'mode': mode, 'num_images': args.num_images, 'total_mb': current / 2**20, 'bytes_per_image': current / args.num_images})
+		print(json.dumps(results[-1]))
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Measure how long `import tag_machine_api` takes, with `python -X importtime` in fresh interpreters.
+
+Also checks that requests, pydantic, numpy and PIL are not loaded by the import itself (the client imports them when
+they're first needed). Exits non-zero if any of them are, or if the best import time is above --max-ms.
+tests/test_import_time.py checks the same on every test run.
+
+Example:
+	python bench_import.py --runs 10 --max-ms 100
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--module', type=str, default='tag_machine_api')
+parser.add_argument('--runs', type=int, default=10)
+parser.add_argument('--max-ms', type=float, default=100.0, help='Fail if the best import time is above this')
+parser.add_argument('--top', type=int, default=10, help='Number of slowest imports to list')
+parser.add_argument('--output', type=str, default=None)
+
+DEFERRED = ['requests', 'pydantic', 'numpy', 'PIL']
+
+
+def import_times(module: str) -> dict[str, tuple[int, int]]:
+	"""
+	module -> (self, cumulative) microseconds, for `module` and everything it imported in a fresh interpreter
+	(but not what the interpreter loads at startup)
+	"""
+	result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'], capture_output=True, text=True, check=True)
+	times = {}
+	for line in result.stderr.splitlines():
+		if not line.startswith('import time:') or 'self [us]' in line:
+			continue
+		self_us, cumulative_us, name = line.removeprefix('import time:').split('|')
+		if not name.startswith('  '):
+			# A top level import; anything nested before it was imported by it, and belongs to something else unless it's module
+			if name.strip() == module:
+				times[module] = (int(self_us), int(cumulative_us))
+				return times
+			times.clear()
+			continue
+		times[name.strip()] = (int(self_us), int(cumulative_us))
+	raise ValueError(f'{module} not found in the -X importtime output')
+
+
+def loaded_modules(module: str, names: list[str]) -> list[str]:
+	code = f'import sys, {module}; print(",".join(name for name in {names!r} if name in sys.modules))'
+	output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True).stdout.strip()
+	return output.split(',') if output else []
+
+
+def main():
+	args = parser.parse_args()
+
+	# The first run may include compiling the module to bytecode
+	import_times(args.module)
+	runs = [import_times(args.module) for _ in range(args.runs)]
+	totals = [times[args.module][1] / 1000 for times in runs]
+
+	best_run = runs[totals.index(min(totals))]
+	slowest = sorted(((cumulative, name) for name, (_, cumulative) in best_run.items() if name != args.module), reverse=True)[:args.top]
+	loaded = loaded_modules(args.module, DEFERRED)
+
+	report = {
+		'module': args.module,
+		'python': sys.version.split()[0],
+		'runs': args.runs,
+		'best_ms': min(totals),
+		'median_ms': statistics.median(totals),
+		'slowest_imports_ms': {name: cumulative / 1000 for cumulative, name in slowest},
+		'deferred_modules_loaded': loaded,
+	}
+	report_json = json.dumps(report, indent=2)
+	if args.output is not None:
+		Path(args.output).write_text(report_json)
+	print(report_json)
+
+	failed = False
+	if loaded:
+		print(f'FAIL: importing {args.module} loaded {", ".join(loaded)}', file=sys.stderr)
+		failed = True
+	if min(totals) > args.max_ms:
+		print(f'FAIL: best import time {min(totals):.1f}ms is above {args.max_ms:.1f}ms', file=sys.stderr)
+		failed = True
+	sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+	main()
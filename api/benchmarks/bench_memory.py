@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Measure the peak memory of fetching a large ID search response.
+
+Serves a synthetic TMS ID response from a local HTTP server and fetches it in a fresh subprocess per mode:
+  content   the old path: r.content, then np.frombuffer(r.content[4:])
+  readinto  TagMachineAPI.search, which reads into a pre-sized buffer and returns a view of it
+
+Example:
+	python bench_memory.py --num-ids 100000000
+"""
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import numpy as np
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--num-ids', type=int, default=100_000_000)
+parser.add_argument('--modes', type=str, default='content,readinto')
+parser.add_argument('--port', type=int, default=8188)
+parser.add_argument('--output', type=str, default=None)
+parser.add_argument('--client', type=str, default=None, help=argparse.SUPPRESS)
+
+CHUNK_IDS = 1 << 20
+
+
+def make_handler(num_ids: int):
+	class Handler(BaseHTTPRequestHandler):
+		def do_GET(self):
+			self.send_response(200)
+			self.send_header('Content-Type', 'application/octet-stream')
+			self.send_header('Content-Length', str(4 + 4 * num_ids))
+			self.end_headers()
+			self.wfile.write(b'TMS\x08')
+			for start in range(0, num_ids, CHUNK_IDS):
+				self.wfile.write(np.arange(start, min(start + CHUNK_IDS, num_ids), dtype=np.uint32).tobytes())
+
+		def log_message(self, format, *args):
+			pass
+
+	return Handler
+
+
+def max_rss_mb() -> float:
+	return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def client(args):
+	import requests
+
+	from tag_machine_api import TagMachineAPI
+
+	url = f'http://127.0.0.1:{args.port}'
+	baseline = max_rss_mb()
+	start = time.perf_counter()
+
+	if args.client == 'content':
+		r = requests.get(f'{url}/api/search/images', params={'select': 'id', 'query': ''}, timeout=600)
+		ids = np.frombuffer(r.content[4:], dtype=np.uint32)
+	elif args.client == 'readinto':
+		ids = TagMachineAPI(token='bench', url=url).search('', ['id'])
+	else:
+		raise ValueError(f'Unknown mode: {args.client}')
+
+	elapsed = time.perf_counter() - start
+	assert len(ids) == args.num_ids and (args.num_ids == 0 or ids[-1] == args.num_ids - 1)
+
+	print(json.dumps({
+		'mode': args.client,
+		'num_ids': args.num_ids,
+		'payload_mb': (4 + 4 * args.num_ids) / 2**20,
+		'peak_rss_increase_mb': max_rss_mb() - baseline,
+		'elapsed_s': elapsed,
+	}))
+
+
+def main():
+	args = parser.parse_args()
+
+	if args.client is not None:
+		client(args)
+		return
+
+	server = ThreadingHTTPServer(('127.0.0.1', args.port), make_handler(args.num_ids))
+	threading.Thread(target=server.serve_forever, daemon=True).start()
+
+	results = []
+	try:
+		for mode in args.modes.split(','):
+			command = [sys.executable, str(Path(__file__).absolute()), '--client', mode, '--num-ids', str(args.num_ids), '--port', str(args.port)]
+			out = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+			results.append(json.loads(out))
+			print(out.strip())
+	finally:
+		server.shutdown()
+
+	if args.output is not None:
+		Path(args.output).write_text(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+	main()
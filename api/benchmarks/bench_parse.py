@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Benchmark parsing of image search responses.
+
+Builds synthetic TMS payloads of increasing size and times parse_search_response in object, columnar and lazy mode.
+Lazy mode only indexes the records, so its time is the cost of getting a result before any image is touched.
+The Rust parser decodes on all cores; run with RAYON_NUM_THREADS=1 to compare against a single thread,
+or with TAG_MACHINE_PURE_PYTHON=1 to benchmark the pure Python fallback decoder.
+
+Example:
+	python bench_parse.py --sizes 10000,100000,1000000,10000000 --select id,hash,tags,attributes
+"""
+import argparse
+import gc
+import json
+import random
+import time
+
+import numpy as np
+
+from standin_server import random_image
+from tag_machine_api import parse_search_response
+from tag_machine_api.encode import encode_record, encode_search_response, flags_for_select
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--sizes', type=str, default='10000,100000,1000000,10000000', help='Comma separated image counts')
+parser.add_argument('--select', type=str, default='id,hash,tags,attributes')
+parser.add_argument('--modes', type=str, default='objects,columns', help='Comma separated: objects, columns, lazy')
+parser.add_argument('--attribute-keys', type=str, default=None, help='Comma separated attribute keys to keep (default: all)')
+parser.add_argument('--repeats', type=int, default=3)
+parser.add_argument('--seed', type=int, default=42)
+parser.add_argument('--output', type=str, default=None)
+
+
+def make_payload(num_images: int, select: set[str], seed: int) -> bytes:
+	"""A TMS image response built by sampling from a pool of random records."""
+	rng = random.Random(seed)
+	flags = flags_for_select(select)
+	pool = []
+	for i in range(min(num_images, 4096)):
+		image = random_image(rng, i, 20000)
+		pool.append(encode_record(flags, image.id, image.hash, image.tags, image.attributes))
+	indices = np.random.default_rng(seed).integers(0, len(pool), size=num_images)
+	return encode_search_response(flags, [pool[i] for i in indices])
+
+
+def main():
+	args = parser.parse_args()
+	select = set(args.select.split(','))
+	attribute_keys = args.attribute_keys.split(',') if args.attribute_keys is not None else None
+	modes = args.modes.split(',')
+	results = []
+
+	for num_images in [int(s) for s in args.sizes.split(',')]:
+		payload = make_payload(num_images, select, args.seed)
+
+		for mode in modes:
+			timings = []
+			for _ in range(args.repeats):
+				gc.collect()
+				start = time.perf_counter()
+				result = parse_search_response(payload, columnar=mode == 'columns', lazy=mode == 'lazy', attribute_keys=attribute_keys)
+				timings.append(time.perf_counter() - start)
+				assert len(result) == num_images, f'Expected {num_images} images, got {len(result)}'
+				del result
+
+			best = min(timings)
+			results.append({
+				'images': num_images,
+				'payload_mb': len(payload) / 1e6,
+				'mode': mode,
+				'best_s': best,
+				'mean_s': sum(timings) / len(timings),
+				'images_per_s': num_images / best,
+				'mb_per_s': len(payload) / 1e6 / best,
+			})
+			print(json.dumps(results[-1]))
+
+		del payload
+
+	if args.output is not None:
+		with open(args.output, 'w') as f:
+			json.dump({'select': args.select, 'attribute_keys': args.attribute_keys, 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+	main()
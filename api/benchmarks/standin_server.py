@@ -0,0 +1,386 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the tag machine API, serving synthetic data, so that the client can be exercised and benchmarked
+without the real server.
+
+Implements the endpoints TagMachineAPI uses:
+  GET    /api/search/images?select=...&query=...   TMS encoded search results
+  POST   /api/search_images                        JSON {operator, order_by, limit, select}, as DatabaseData.search_images_batched uses it
+  GET    /api/images/{id or hash}                  image data
+  GET    /api/images/{id or hash}/metadata         JSON metadata
+  POST   /api/images/{hash}                        add an image (409 if it exists)
+  POST   /api/images/{id or hash}/tags/{tag}       tag an image (tag name or id)
+  DELETE /api/images/{id or hash}/tags/{tag}
+  POST   /api/images/{id or hash}/attributes       JSON {key, value, singular} (409 if it exists)
+  DELETE /api/images/{id or hash}/attributes       JSON {key, value}
+  GET    /api/tags
+
+Search queries are a simplified stand-in for the real query language: whitespace separated terms that must all match.
+A term is a tag name, key=value for an attribute, id<N / id<=N / id>N / id>=N, id=N[,N...], or hash=<hex>[,<hex>...].
+Prefix a term with - to negate it. An empty query matches every image. Results are ordered by id.
+Operators for /api/search_images are {'and': [...]} and {'minid': N}, as in search_images_batched, plus {'or': [...]},
+{'not': operator} and {'tag': name}. Results are always ordered by id.
+
+Example:
+	python standin_server.py --images 100000 --port 1421
+"""
+import argparse
+import dataclasses
+import json
+import random
+import re
+import threading
+import time
+from hashlib import sha256
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from tag_machine_api.encode import encode_record, encode_search_response, flags_for_select
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--host', type=str, default='127.0.0.1')
+parser.add_argument('--port', type=int, default=1421)
+parser.add_argument('--images', type=int, default=100_000, help='Number of synthetic images')
+parser.add_argument('--tags', type=int, default=20_000, help='Number of synthetic tags')
+parser.add_argument('--image-bytes', type=int, default=1024, help='Size of each synthetic image file')
+parser.add_argument('--seed', type=int, default=42)
+parser.add_argument('--latency', type=float, default=0.0, help='Seconds added to every request, to simulate a remote server')
+parser.add_argument('--capacity', type=int, default=None, help='Requests handled at once (with --latency, simulates a server that slows down under load)')
+parser.add_argument('--max-queue', type=int, default=None, help='Requests allowed to wait for capacity before the server answers 503')
+
+WRITE_SIZE = 1 << 20
+SOURCES = ['danbooru', 'e621', 'upload', 'scrape']
+ID_TERM = re.compile(r'^id(<=|>=|<|>)(\d+)$')
+
+
+@dataclasses.dataclass
+class StandInImage:
+	id: int
+	hash: bytes
+	active: bool
+	tags: dict[int, int]  # tag -> user_id
+	attributes: dict[str, dict[str, int]]  # key -> {value -> user_id}
+
+
+def random_image(rng: random.Random, id: int, num_tags: int, hash: bytes | None = None) -> StandInImage:
+	"""An image with a realistic number of tags and the attributes every image has"""
+	tags = {tag: rng.randint(1, 40) for tag in rng.sample(range(1, num_tags), rng.randint(0, min(60, num_tags - 1)))}
+	attributes = {
+		'image_width': {str(rng.randint(256, 4096)): rng.randint(1, 40)},
+		'image_height': {str(rng.randint(256, 4096)): rng.randint(1, 40)},
+	}
+	if rng.random() < 0.3:
+		attributes['source'] = {rng.choice(SOURCES): rng.randint(1, 40)}
+	return StandInImage(id=id, hash=hash if hash is not None else rng.randbytes(32), active=True, tags=tags, attributes=attributes)
+
+
+def image_data(id: int, size: int) -> bytes:
+	return random.Random(id).randbytes(size)
+
+
+class Dataset:
+	"""Synthetic images and tags, with the encoded records of each image cached per select"""
+	def __init__(self, num_images: int, num_tags: int, image_bytes: int, seed: int):
+		rng = random.Random(seed)
+		self.image_bytes = image_bytes
+		self.tag_names = [f'tag_{i}' for i in range(num_tags)]
+		self.tag_ids = {name: i for i, name in enumerate(self.tag_names)}
+		self.images: list[StandInImage] = []
+		self.by_hash: dict[bytes, StandInImage] = {}
+		self.records: dict[tuple[bool, bool, bool, bool], dict[int, bytes]] = {}
+		self.lock = threading.Lock()
+
+		for id in range(1, num_images + 1):
+			self.add(random_image(rng, id, num_tags, sha256(image_data(id, image_bytes)).digest()))
+
+	def add(self, image: StandInImage):
+		self.images.append(image)
+		self.by_hash[image.hash] = image
+
+	def get(self, id_or_hash: str) -> StandInImage | None:
+		if len(id_or_hash) != 64 and id_or_hash.isdigit():
+			id = int(id_or_hash)
+			return self.images[id - 1] if 0 < id <= len(self.images) else None
+		try:
+			return self.by_hash.get(bytes.fromhex(id_or_hash))
+		except ValueError:
+			return None
+
+	def changed(self, image: StandInImage):
+		for records in self.records.values():
+			records.pop(image.id, None)
+
+	def record(self, flags: tuple[bool, bool, bool, bool], image: StandInImage) -> bytes:
+		records = self.records.setdefault(flags, {})
+		record = records.get(image.id)
+		if record is None:
+			record = records[image.id] = encode_record(flags, image.id, image.hash, image.tags, image.attributes)
+		return record
+
+	def matcher(self, query: str):
+		"""A predicate for the images matching a query (see the module docstring)"""
+		predicates = []
+		for term in query.split():
+			negate = term.startswith('-')
+			term = term.removeprefix('-')
+
+			if (match := ID_TERM.match(term)) is not None:
+				op, value = match.group(1), int(match.group(2))
+				predicate = {
+					'<': lambda image, v=value: image.id < v,
+					'<=': lambda image, v=value: image.id <= v,
+					'>': lambda image, v=value: image.id > v,
+					'>=': lambda image, v=value: image.id >= v,
+				}[op]
+			elif term.startswith('id='):
+				ids = {int(id) for id in term.removeprefix('id=').split(',')}
+				predicate = lambda image, i=ids: image.id in i
+			elif term.startswith('hash='):
+				hashes = {bytes.fromhex(hash) for hash in term.removeprefix('hash=').split(',')}
+				predicate = lambda image, h=hashes: image.hash in h
+			elif '=' in term:
+				key, value = term.split('=', 1)
+				predicate = lambda image, k=key, v=value: v in image.attributes.get(k, {})
+			else:
+				tag = self.tag_ids.get(term, -1)
+				predicate = lambda image, t=tag: t in image.tags
+
+			predicates.append((lambda image, p=predicate: not p(image)) if negate else predicate)
+
+		return lambda image: image.active and all(p(image) for p in predicates)
+
+	def search(self, query: str, select: list[str]) -> bytes:
+		flags = flags_for_select(select)
+		matches = self.matcher(query)
+		with self.lock:
+			return encode_search_response(flags, [self.record(flags, image) for image in self.candidates(query) if matches(image)])
+
+	def operator_matcher(self, operator: dict):
+		"""A predicate for the images matching a /api/search_images operator (see the module docstring)"""
+		(kind, value), = operator.items()
+		if kind == 'and':
+			predicates = [self.operator_matcher(op) for op in value]
+			return lambda image: all(p(image) for p in predicates)
+		if kind == 'or':
+			predicates = [self.operator_matcher(op) for op in value]
+			return lambda image: any(p(image) for p in predicates)
+		if kind == 'not':
+			predicate = self.operator_matcher(value)
+			return lambda image: not predicate(image)
+		if kind == 'minid':
+			return lambda image: image.id >= value
+		if kind == 'tag':
+			tag = self.tag_ids.get(value, -1)
+			return lambda image: tag in image.tags
+		raise ValueError(f'Unknown operator {kind!r}')
+
+	def search_json(self, operator: dict, limit: int | None, select: list[str]) -> list[dict]:
+		matches = self.operator_matcher(operator)
+		fields = {
+			'id': lambda image: image.id,
+			'hash': lambda image: image.hash.hex(),
+			'active': lambda image: image.active,
+			'tags': lambda image: sorted(image.tags),
+			'attributes': lambda image: image.attributes,
+		}
+		for field in select:
+			if field not in fields:
+				raise ValueError(f'Unknown field {field!r}')
+
+		# Images are stored in id order, so a minid (on its own or in a top level 'and') skips straight to it
+		terms = operator.get('and', [operator])
+		start = max([term['minid'] for term in terms if 'minid' in term], default=1)
+
+		results = []
+		with self.lock:
+			for image in self.images[max(start, 1) - 1:]:
+				if limit is not None and len(results) >= limit:
+					break
+				if image.active and matches(image):
+					results.append({field: fields[field](image) for field in select})
+		return results
+
+	def candidates(self, query: str) -> list[StandInImage]:
+		"""
+		Images that might match a query, looking up lone id= and hash= terms directly and narrowing id ranges
+		(images are stored in id order) instead of scanning everything
+		"""
+		terms = query.split()
+		if len(terms) == 1 and terms[0].startswith(('id=', 'hash=')):
+			images = {image.id: image for image in map(self.get, terms[0].split('=', 1)[1].split(',')) if image is not None}
+			return sorted(images.values(), key=lambda image: image.id)
+
+		lo, hi = 1, len(self.images)
+		for term in terms:
+			if (match := ID_TERM.match(term)) is not None:
+				op, value = match.group(1), int(match.group(2))
+				if op == '<':
+					hi = min(hi, value - 1)
+				elif op == '<=':
+					hi = min(hi, value)
+				elif op == '>':
+					lo = max(lo, value + 1)
+				else:
+					lo = max(lo, value)
+		return self.images[lo - 1:max(hi, lo - 1)]
+
+
+class Handler(BaseHTTPRequestHandler):
+	protocol_version = 'HTTP/1.1'
+	# Headers and body are written separately, which otherwise stalls on delayed ACKs
+	disable_nagle_algorithm = True
+	server: 'StandInServer'
+
+	def log_message(self, format, *args):
+		pass
+
+	def send(self, status: int, body: bytes = b'', content_type: str = 'application/octet-stream'):
+		self.send_response(status)
+		self.send_header('Content-Type', content_type)
+		self.send_header('Content-Length', str(len(body)))
+		self.end_headers()
+		for i in range(0, len(body), WRITE_SIZE):
+			self.wfile.write(body[i:i + WRITE_SIZE])
+
+	def send_json(self, value, status: int = 200):
+		self.send(status, json.dumps(value).encode(), 'application/json')
+
+	def read_json(self):
+		length = int(self.headers.get('Content-Length', 0))
+		return json.loads(self.rfile.read(length)) if length > 0 else None
+
+	def handle_method(self, method: str):
+		server = self.server
+		if server.capacity is None:
+			return self.route(method)
+
+		with server.queue_lock:
+			overloaded = server.max_queue is not None and server.waiting >= server.max_queue
+			if not overloaded:
+				server.waiting += 1
+
+		if overloaded:
+			# Drain the body so that the connection can be reused
+			self.rfile.read(int(self.headers.get('Content-Length', 0)))
+			return self.send(503, b'Overloaded')
+
+		with server.capacity:
+			with server.queue_lock:
+				server.waiting -= 1
+			self.route(method)
+
+	def route(self, method: str):
+		if self.server.latency > 0:
+			time.sleep(self.server.latency)
+
+		if not self.headers.get('Authorization', '').startswith('Bearer '):
+			return self.send(401, b'Missing token')
+
+		url = urlparse(self.path)
+		parts = url.path.strip('/').split('/')
+		dataset = self.server.dataset
+
+		if method == 'GET' and parts == ['api', 'tags']:
+			return self.send_json([{'id': i, 'name': name, 'active': True} for i, name in enumerate(dataset.tag_names)])
+
+		if method == 'GET' and parts == ['api', 'search', 'images']:
+			params = parse_qs(url.query)
+			select = params.get('select', [''])[0].split(',')
+			try:
+				return self.send(200, dataset.search(params.get('query', [''])[0], select))
+			except ValueError as e:
+				return self.send(400, str(e).encode())
+
+		if method == 'POST' and parts == ['api', 'search_images']:
+			body = self.read_json()
+			try:
+				return self.send_json({'images': dataset.search_json(body['operator'], body.get('limit'), body['select'])})
+			except (KeyError, ValueError) as e:
+				return self.send(400, str(e).encode())
+
+		if len(parts) < 3 or parts[:2] != ['api', 'images']:
+			return self.send(404, b'Not found')
+
+		with dataset.lock:
+			image = dataset.get(parts[2])
+
+			if len(parts) == 3 and method == 'POST':
+				if image is not None:
+					return self.send(409, b'Image already exists')
+				image = StandInImage(id=len(dataset.images) + 1, hash=bytes.fromhex(parts[2]), active=True, tags={}, attributes={})
+				dataset.add(image)
+				return self.send(200)
+
+			if image is None:
+				return self.send(404, b'Image not found')
+
+			if len(parts) == 3 and method == 'GET':
+				return self.send(200, image_data(image.id, dataset.image_bytes))
+
+			if parts[3:] == ['metadata'] and method == 'GET':
+				return self.send_json({'id': image.id, 'hash': image.hash.hex(), 'active': image.active, 'tags': image.tags, 'attributes': image.attributes})
+
+			if len(parts) == 5 and parts[3] == 'tags' and method in ('POST', 'DELETE'):
+				tag = int(parts[4]) if parts[4].isdigit() else dataset.tag_ids.get(parts[4])
+				if tag is None:
+					return self.send(404, b'Tag not found')
+				if method == 'POST':
+					image.tags[tag] = 0
+				else:
+					image.tags.pop(tag, None)
+				dataset.changed(image)
+				return self.send(200)
+
+			if parts[3:] == ['attributes'] and method in ('POST', 'DELETE'):
+				body = self.read_json()
+				key, value = str(body['key']), str(body['value'])
+				values = image.attributes.setdefault(key, {})
+				if method == 'POST':
+					if value in values:
+						return self.send(409, b'Attribute already exists')
+					if body.get('singular'):
+						values.clear()
+					values[value] = 0
+				else:
+					values.pop(value, None)
+				if not values:
+					del image.attributes[key]
+				dataset.changed(image)
+				return self.send(200)
+
+		return self.send(404, b'Not found')
+
+	def do_GET(self):
+		self.handle_method('GET')
+
+	def do_POST(self):
+		self.handle_method('POST')
+
+	def do_DELETE(self):
+		self.handle_method('DELETE')
+
+
+class StandInServer(ThreadingHTTPServer):
+	daemon_threads = True
+
+	def __init__(self, address: tuple[str, int], dataset: Dataset, latency: float = 0.0, capacity: int | None = None, max_queue: int | None = None):
+		super().__init__(address, Handler)
+		self.dataset = dataset
+		self.latency = latency
+		self.capacity = threading.Semaphore(capacity) if capacity is not None else None
+		self.max_queue = max_queue
+		self.waiting = 0
+		self.queue_lock = threading.Lock()
+
+
+def main():
+	args = parser.parse_args()
+	print(f'Generating {args.images} images...')
+	dataset = Dataset(args.images, args.tags, args.image_bytes, args.seed)
+	server = StandInServer((args.host, args.port), dataset, args.latency, args.capacity, args.max_queue)
+	print(f'Serving on http://{args.host}:{args.port}')
+	server.serve_forever()
+
+
+if __name__ == '__main__':
+	main()
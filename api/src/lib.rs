@@ -1,105 +1,782 @@
 use byteorder::{LittleEndian, ReadBytesExt};
+use numpy::{IntoPyArray, PyArrayMethods};
 use pyo3::{
+	buffer::PyBuffer,
+	exceptions::{PyIndexError, PyValueError},
 	intern,
 	prelude::*,
-	types::{PyBytes, PyDict},
+	sync::GILOnceCell,
+	types::{PyBytes, PyDict, PySlice, PyString},
 };
+use rayon::prelude::*;
+use std::collections::{HashMap, HashSet};
 use std::io::{Cursor, Read};
+use std::sync::{Arc, Mutex};
 
 #[pymodule]
 fn parse(m: &Bound<'_, PyModule>) -> PyResult<()> {
 	m.add_function(wrap_pyfunction!(parse_search_response_images, m)?)?;
-	//m.add_class::<SearchResultImage>()?;
+	m.add_function(wrap_pyfunction!(parse_search_response_columns, m)?)?;
+	m.add_function(wrap_pyfunction!(parse_search_response_lazy, m)?)?;
+	m.add_function(wrap_pyfunction!(scan_complete_records, m)?)?;
+	m.add_class::<LazySearchResults>()?;
+	m.add_class::<LazySearchResultImage>()?;
 	Ok(())
 }
 
-// #[pyclass]
-// struct SearchResultImage {
-// 	#[pyo3(get)]
-// 	id: Option<Py<PyInt>>,
-// 	#[pyo3(get)]
-// 	hash: Option<Py<PyBytes>>,
-// 	#[pyo3(get)]
-// 	tags: Option<Vec<(u64, u64)>>,
-// 	#[pyo3(get)]
-// 	attributes: Option<Py<PyDict>>,
-// }
+/// Number of records decoded per parallel batch before they are materialized as Python objects.
+/// Bounds the memory held in intermediate Rust structures.
+const DECODE_BATCH_SIZE: usize = 1 << 16;
 
+/// Below this many records a batch is decoded on the calling thread.
+const PARALLEL_THRESHOLD: usize = 4096;
+
+/// Attribute values up to this many bytes are interned. Longer values (URLs, captions, ...) rarely repeat.
+const MAX_INTERNED_VALUE_LEN: usize = 32;
+
+/// Cap on the number of distinct strings interned per response.
+const MAX_INTERNED_STRINGS: usize = 1 << 16;
+
+
+/// Which fields each record in an image response has.
+#[derive(Clone, Copy)]
+struct Flags {
+	has_ids: bool,
+	has_hashes: bool,
+	has_tags: bool,
+	has_attributes: bool,
+}
+
+
+/// key -> [(value, user_id)], borrowed from the response.
+type Attributes<'a> = Vec<(&'a str, Vec<(&'a str, u64)>)>;
+
+
+/// A record decoded from the response, without any Python objects.
+struct DecodedImage<'a> {
+	id: Option<u32>,
+	hash: Option<&'a [u8]>,
+	/// Packed as by pack_tags
+	tags: Option<Vec<u8>>,
+	attributes: Option<Attributes<'a>>,
+}
+
+
+/// Python strings for the attribute keys and values seen so far in a response, so that repeats share one object.
+/// Keys are always interned, values only if they're short.
+#[derive(Default)]
+struct StringTable {
+	strings: HashMap<Box<str>, Py<PyString>>,
+}
+
+
+impl StringTable {
+	fn get<'py>(&mut self, py: Python<'py>, s: &str, is_key: bool) -> Bound<'py, PyString> {
+		if let Some(string) = self.strings.get(s) {
+			return string.bind(py).clone();
+		}
+
+		let string = PyString::new(py, s);
+		if self.strings.len() < MAX_INTERNED_STRINGS && (is_key || s.len() <= MAX_INTERNED_VALUE_LEN) {
+			self.strings.insert(s.into(), string.clone().unbind());
+		}
+		string
+	}
+}
+
+
+/// Decode the records in data[start..end] into SearchResultImage objects.
+/// `data` can be any contiguous buffer (bytes, bytearray, memoryview, ...).
+/// If `attribute_keys` is given, other attributes are skipped over without being decoded.
 #[pyfunction]
+#[pyo3(signature = (has_ids, has_hashes, has_tags, has_attributes, data, start=0, end=None, attribute_keys=None))]
 fn parse_search_response_images(
 	py: Python,
 	has_ids: bool,
 	has_hashes: bool,
 	has_tags: bool,
 	has_attributes: bool,
-	data: &Bound<'_, PyBytes>,
+	data: PyBuffer<u8>,
+	start: usize,
+	end: Option<usize>,
+	attribute_keys: Option<HashSet<String>>,
 ) -> PyResult<Vec<PyObject>> {
 	let api_mod = py.import("tag_machine_api")?;
 	let py_class = api_mod.getattr("SearchResultImage")?;
-	let mut cursor = Cursor::new(data.as_bytes());
-	let mut images = Vec::new();
-	let data_len = data.as_bytes().len() as u64;
-
-	while cursor.position() < data_len {
-		let image = py_class.call0()?;
-		/*let mut image = SearchResultImage {
-			id: None,
-			hash: None,
-			tags: None,
-			attributes: None,
-		};*/
+	let flags = Flags { has_ids, has_hashes, has_tags, has_attributes };
+	let data = buffer_slice(&data, start, end)?;
+
+	// Decoding only touches the (immutable) bytes, so it runs without the GIL and in parallel.
+	// Only building the Python objects needs the interpreter.
+	let offsets = py.allow_threads(|| index_records(flags, data))?;
+	let windows: Vec<&[usize]> = offsets.windows(2).collect();
+	let mut images = Vec::with_capacity(windows.len());
+	let mut strings = StringTable::default();
+
+	for batch in windows.chunks(DECODE_BATCH_SIZE) {
+		let decoded = py.allow_threads(|| decode_records(flags, data, batch, attribute_keys.as_ref()))?;
+
+		for image in decoded {
+			images.push(materialize_image(py, &py_class, image, &mut strings)?);
+		}
+	}
+
+	Ok(images)
+}
+
+
+/// Find where each record starts. The final offset is the end of the last record.
+/// Records are skipped over without allocating, which makes this pass much cheaper than decoding.
+fn index_records(flags: Flags, data: &[u8]) -> Result<Vec<usize>, std::io::Error> {
+	if !(flags.has_ids || flags.has_hashes || flags.has_tags || flags.has_attributes) && !data.is_empty() {
+		return Err(std::io::Error::new(std::io::ErrorKind::InvalidData, "Response has data but no fields"));
+	}
+
+	let mut cursor = Cursor::new(data);
+	let mut offsets = vec![0];
+
+	while (cursor.position() as usize) < data.len() {
+		skip_record(flags, &mut cursor)?;
+		offsets.push(cursor.position() as usize);
+	}
+
+	Ok(offsets)
+}
+
+
+/// Count the complete records at the start of `data`, stopping after `max_records`.
+/// Returns the number of records and the number of bytes they span.
+/// Used when streaming a response, where the data may end partway through a record.
+#[pyfunction]
+fn scan_complete_records(
+	py: Python,
+	has_ids: bool,
+	has_hashes: bool,
+	has_tags: bool,
+	has_attributes: bool,
+	data: PyBuffer<u8>,
+	max_records: usize,
+) -> PyResult<(usize, usize)> {
+	let flags = Flags { has_ids, has_hashes, has_tags, has_attributes };
+	let data = buffer_slice(&data, 0, None)?;
+
+	if !(has_ids || has_hashes || has_tags || has_attributes) && !data.is_empty() {
+		return Err(std::io::Error::new(std::io::ErrorKind::InvalidData, "Response has data but no fields").into());
+	}
+
+	let result = py.allow_threads(|| -> Result<(usize, usize), std::io::Error> {
+		let mut cursor = Cursor::new(data);
+		let mut num_records = 0;
+		let mut end = 0;
+
+		while num_records < max_records && end < data.len() {
+			match skip_record(flags, &mut cursor) {
+				Ok(()) => {
+					num_records += 1;
+					end = cursor.position() as usize;
+				},
+				Err(e) if e.kind() == std::io::ErrorKind::UnexpectedEof => break,
+				Err(e) => return Err(e),
+			}
+		}
+
+		Ok((num_records, end))
+	})?;
+
+	Ok(result)
+}
+
+
+fn skip_record(flags: Flags, cursor: &mut Cursor<&[u8]>) -> Result<(), std::io::Error> {
+	if flags.has_ids {
+		skip_bytes(cursor, 4)?;
+	}
+
+	if flags.has_hashes {
+		skip_bytes(cursor, 32)?;
+	}
+
+	if flags.has_tags {
+		skip_tags(cursor)?;
+	}
+
+	if flags.has_attributes {
+		let num_keys = read_vli(&mut *cursor)?;
+		for _ in 0..num_keys {
+			let key_len = read_vli(&mut *cursor)?;
+			skip_bytes(cursor, key_len)?;
+			let num_values = read_vli(&mut *cursor)?;
+			for _ in 0..num_values {
+				let value_len = read_vli(&mut *cursor)?;
+				skip_bytes(cursor, value_len)?;
+				read_vli(&mut *cursor)?;
+			}
+		}
+	}
+
+	Ok(())
+}
+
+
+fn skip_tags(cursor: &mut Cursor<&[u8]>) -> Result<(), std::io::Error> {
+	let num_tags = read_vli(&mut *cursor)?;
+	for _ in 0..num_tags {
+		read_vli(&mut *cursor)?;
+		read_vli(&mut *cursor)?;
+	}
+	Ok(())
+}
+
+
+fn skip_bytes(cursor: &mut Cursor<&[u8]>, len: u64) -> Result<(), std::io::Error> {
+	let end = cursor.position().checked_add(len).filter(|&end| end <= cursor.get_ref().len() as u64);
+	match end {
+		Some(end) => {
+			cursor.set_position(end);
+			Ok(())
+		},
+		None => Err(std::io::Error::new(std::io::ErrorKind::UnexpectedEof, "Record extends past the end of the response")),
+	}
+}
+
+
+/// Decode the records spanning each (start, end) window of offsets, in parallel for large batches.
+fn decode_records<'a>(flags: Flags, data: &'a [u8], windows: &[&[usize]], attribute_keys: Option<&HashSet<String>>) -> Result<Vec<DecodedImage<'a>>, std::io::Error> {
+	let decode = |window: &&[usize]| decode_record(flags, &data[window[0]..window[1]], attribute_keys);
+
+	if windows.len() < PARALLEL_THRESHOLD {
+		windows.iter().map(decode).collect()
+	} else {
+		windows.par_iter().map(decode).collect()
+	}
+}
+
+
+fn read_tags(cursor: &mut Cursor<&[u8]>) -> Result<Vec<(u64, u64)>, std::io::Error> {
+	let num_tags = read_vli(&mut *cursor)? as usize;
+	let mut tags = Vec::with_capacity(num_tags.min(cursor.get_ref().len()));
+	for _ in 0..num_tags {
+		let tag_id = read_vli(&mut *cursor)?;
+		let user_id = read_vli(&mut *cursor)?;
+		tags.push((tag_id, user_id));
+	}
+	Ok(tags)
+}
+
+
+/// Read a record's attributes, skipping the values of any key not in `attribute_keys` (if given).
+fn read_attributes<'a>(cursor: &mut Cursor<&'a [u8]>, attribute_keys: Option<&HashSet<String>>) -> Result<Attributes<'a>, std::io::Error> {
+	let num_keys = read_vli(&mut *cursor)? as usize;
+	let mut attributes = Vec::with_capacity(num_keys.min(cursor.get_ref().len()));
+	for _ in 0..num_keys {
+		let key = read_str(cursor)?;
+		let num_values = read_vli(&mut *cursor)? as usize;
+
+		if attribute_keys.is_some_and(|keys| !keys.contains(key)) {
+			for _ in 0..num_values {
+				let value_len = read_vli(&mut *cursor)?;
+				skip_bytes(cursor, value_len)?;
+				read_vli(&mut *cursor)?;
+			}
+			continue;
+		}
+
+		let mut values = Vec::with_capacity(num_values.min(cursor.get_ref().len()));
+		for _ in 0..num_values {
+			let value = read_str(cursor)?;
+			let user_id = read_vli(&mut *cursor)?;
+			values.push((value, user_id));
+		}
+		attributes.push((key, values));
+	}
+	Ok(attributes)
+}
+
+
+fn decode_record<'a>(flags: Flags, record: &'a [u8], attribute_keys: Option<&HashSet<String>>) -> Result<DecodedImage<'a>, std::io::Error> {
+	let mut cursor = Cursor::new(record);
+	let mut image = DecodedImage {
+		id: None,
+		hash: None,
+		tags: None,
+		attributes: None,
+	};
+
+	if flags.has_ids {
+		image.id = Some(cursor.read_u32::<LittleEndian>()?);
+	}
+
+	if flags.has_hashes {
+		let start = cursor.position() as usize;
+		skip_bytes(&mut cursor, 32)?;
+		image.hash = Some(&record[start..start + 32]);
+	}
+
+	if flags.has_tags {
+		image.tags = Some(pack_tags(&read_tags(&mut cursor)?));
+	}
+
+	if flags.has_attributes {
+		image.attributes = Some(read_attributes(&mut cursor, attribute_keys)?);
+	}
+
+	Ok(image)
+}
+
+
+/// Build a SearchResultImage from a decoded record.
+fn materialize_image(py: Python, py_class: &Bound<'_, PyAny>, decoded: DecodedImage, strings: &mut StringTable) -> PyResult<PyObject> {
+	let hash = decoded.hash.map(|hash| PyBytes::new(py, hash));
+	let packed_tags = decoded.tags.map(|tags| PyBytes::new(py, &tags));
+	let attributes = match decoded.attributes {
+		Some(attributes) => Some(attributes_to_dict(py, attributes, strings)?),
+		None => None,
+	};
+
+	Ok(py_class.call1((decoded.id, hash, packed_tags, attributes))?.unbind())
+}
+
+
+/// Pack (tag, user_id) pairs as little-endian u64s, the representation SearchResultImage keeps its tags in.
+fn pack_tags(tags: &[(u64, u64)]) -> Vec<u8> {
+	let mut packed = Vec::with_capacity(tags.len() * 16);
+	for &(tag_id, user_id) in tags {
+		packed.extend_from_slice(&tag_id.to_le_bytes());
+		packed.extend_from_slice(&user_id.to_le_bytes());
+	}
+	packed
+}
+
+
+fn tags_to_dict(py: Python<'_>, tags: Vec<(u64, u64)>) -> PyResult<Bound<'_, PyDict>> {
+	let tag_dict = PyDict::new(py);
+	for (tag_id, user_id) in tags {
+		tag_dict.set_item(tag_id, user_id)?;
+	}
+	Ok(tag_dict)
+}
+
+
+fn attributes_to_dict<'py>(py: Python<'py>, attributes: Attributes, strings: &mut StringTable) -> PyResult<Bound<'py, PyDict>> {
+	let attribute_dict = PyDict::new(py);
+	for (key, values) in attributes {
+		let value_dict = PyDict::new(py);
+		for (value, user_id) in values {
+			value_dict.set_item(strings.get(py, value, false), user_id)?;
+		}
+		attribute_dict.set_item(strings.get(py, key, true), value_dict)?;
+	}
+	Ok(attribute_dict)
+}
+
+
+/// The response behind LazySearchResults, shared by its slices and images.
+struct LazyResponse {
+	data: PyBuffer<u8>,
+	flags: Flags,
+	attribute_keys: Option<HashSet<String>>,
+	strings: Mutex<StringTable>,
+}
+
 
+/// Search results that keep the raw response and decode each image only when it is accessed.
+/// Building one only indexes where each record starts; slicing shares the buffer and the index.
+#[pyclass(frozen, module = "tag_machine_api.parse")]
+struct LazySearchResults {
+	response: Arc<LazyResponse>,
+	/// Record boundaries in `data`. Record i spans offsets[i]..offsets[i + 1].
+	offsets: Arc<Vec<usize>>,
+	/// This view covers records start, start + step, ... (len of them).
+	start: isize,
+	step: isize,
+	len: usize,
+}
+
+
+impl LazySearchResults {
+	fn image(&self, index: usize) -> LazySearchResultImage {
+		let record = (self.start + index as isize * self.step) as usize;
+
+		LazySearchResultImage {
+			response: self.response.clone(),
+			start: self.offsets[record],
+			end: self.offsets[record + 1],
+			tags: GILOnceCell::new(),
+			attributes: GILOnceCell::new(),
+		}
+	}
+}
+
+
+#[pymethods]
+impl LazySearchResults {
+	fn __len__(&self) -> usize {
+		self.len
+	}
+
+	fn __getitem__(&self, py: Python<'_>, index: &Bound<'_, PyAny>) -> PyResult<PyObject> {
+		if let Ok(slice) = index.downcast::<PySlice>() {
+			let indices = slice.indices(self.len as isize)?;
+			let view = LazySearchResults {
+				response: self.response.clone(),
+				offsets: self.offsets.clone(),
+				start: self.start + indices.start * self.step,
+				step: self.step * indices.step,
+				len: indices.slicelength as usize,
+			};
+			return Ok(Py::new(py, view)?.into_any());
+		}
+
+		let mut i = index.extract::<isize>()?;
+		if i < 0 {
+			i += self.len as isize;
+		}
+		if i < 0 || i as usize >= self.len {
+			return Err(PyIndexError::new_err("search result index out of range"));
+		}
+
+		Ok(Py::new(py, self.image(i as usize))?.into_any())
+	}
+
+	fn __iter__(slf: Bound<'_, Self>) -> LazySearchResultsIter {
+		LazySearchResultsIter { results: slf.unbind(), position: 0 }
+	}
+
+	fn __repr__(&self) -> String {
+		format!("<LazySearchResults of {} images>", self.len)
+	}
+}
+
+
+#[pyclass(module = "tag_machine_api.parse")]
+struct LazySearchResultsIter {
+	results: Py<LazySearchResults>,
+	position: usize,
+}
+
+
+#[pymethods]
+impl LazySearchResultsIter {
+	fn __iter__(slf: PyRef<'_, Self>) -> PyRef<'_, Self> {
+		slf
+	}
+
+	fn __next__(&mut self) -> Option<LazySearchResultImage> {
+		let results = self.results.get();
+		if self.position >= results.len {
+			return None;
+		}
+
+		let image = results.image(self.position);
+		self.position += 1;
+		Some(image)
+	}
+}
+
+
+/// A single image of LazySearchResults, with the same fields as SearchResultImage.
+/// Tags and attributes are decoded on first access and then cached.
+#[pyclass(frozen, module = "tag_machine_api.parse")]
+struct LazySearchResultImage {
+	response: Arc<LazyResponse>,
+	start: usize,
+	end: usize,
+	tags: GILOnceCell<Py<PyDict>>,
+	attributes: GILOnceCell<Py<PyDict>>,
+}
+
+
+impl LazySearchResultImage {
+	fn record(&self) -> &[u8] {
+		&buffer_bytes(&self.response.data)[self.start..self.end]
+	}
+
+	/// Size of the fixed width fields at the start of each record
+	fn fixed_len(&self) -> u64 {
+		(if self.response.flags.has_ids { 4 } else { 0 }) + (if self.response.flags.has_hashes { 32 } else { 0 })
+	}
+}
+
+
+#[pymethods]
+impl LazySearchResultImage {
+	#[getter]
+	fn id(&self) -> Option<u32> {
+		if !self.response.flags.has_ids {
+			return None;
+		}
+
+		let record = self.record();
+		Some(u32::from_le_bytes([record[0], record[1], record[2], record[3]]))
+	}
+
+	#[getter]
+	fn hash<'py>(&self, py: Python<'py>) -> Option<Bound<'py, PyBytes>> {
+		if !self.response.flags.has_hashes {
+			return None;
+		}
+
+		let start = if self.response.flags.has_ids { 4 } else { 0 };
+		Some(PyBytes::new(py, &self.record()[start..start + 32]))
+	}
+
+	#[getter]
+	fn tags(&self, py: Python<'_>) -> PyResult<Option<Py<PyDict>>> {
+		if !self.response.flags.has_tags {
+			return Ok(None);
+		}
+
+		let tags = self.tags.get_or_try_init(py, || -> PyResult<Py<PyDict>> {
+			let mut cursor = Cursor::new(self.record());
+			cursor.set_position(self.fixed_len());
+			Ok(tags_to_dict(py, read_tags(&mut cursor)?)?.unbind())
+		})?;
+
+		Ok(Some(tags.clone_ref(py)))
+	}
+
+	#[getter]
+	fn attributes(&self, py: Python<'_>) -> PyResult<Option<Py<PyDict>>> {
+		if !self.response.flags.has_attributes {
+			return Ok(None);
+		}
+
+		let attributes = self.attributes.get_or_try_init(py, || -> PyResult<Py<PyDict>> {
+			let mut cursor = Cursor::new(self.record());
+			cursor.set_position(self.fixed_len());
+			if self.response.flags.has_tags {
+				skip_tags(&mut cursor)?;
+			}
+			let attributes = read_attributes(&mut cursor, self.response.attribute_keys.as_ref())?;
+			let mut strings = self.response.strings.lock().unwrap();
+			Ok(attributes_to_dict(py, attributes, &mut strings)?.unbind())
+		})?;
+
+		Ok(Some(attributes.clone_ref(py)))
+	}
+
+	fn __repr__(&self, py: Python<'_>) -> String {
+		match (self.id(), self.hash(py)) {
+			(Some(id), _) => format!("<LazySearchResultImage id={}>", id),
+			(None, Some(hash)) => format!("<LazySearchResultImage hash={}>", hash.as_bytes().iter().map(|b| format!("{:02x}", b)).collect::<String>()),
+			(None, None) => "<LazySearchResultImage>".to_string(),
+		}
+	}
+}
+
+
+/// Index the records in data[start..end] without decoding them.
+/// The results keep `data` exported, so it must not be modified while they're alive.
+#[pyfunction]
+#[pyo3(signature = (has_ids, has_hashes, has_tags, has_attributes, data, start=0, end=None, attribute_keys=None))]
+fn parse_search_response_lazy(
+	py: Python,
+	has_ids: bool,
+	has_hashes: bool,
+	has_tags: bool,
+	has_attributes: bool,
+	data: PyBuffer<u8>,
+	start: usize,
+	end: Option<usize>,
+	attribute_keys: Option<HashSet<String>>,
+) -> PyResult<LazySearchResults> {
+	let flags = Flags { has_ids, has_hashes, has_tags, has_attributes };
+	let bytes = buffer_slice(&data, start, end)?;
+
+	let offsets = py.allow_threads(|| -> Result<Vec<usize>, std::io::Error> {
+		let mut offsets = index_records(flags, bytes)?;
+		offsets.iter_mut().for_each(|o| *o += start);
+		Ok(offsets)
+	})?;
+	let len = offsets.len() - 1;
+
+	Ok(LazySearchResults {
+		response: Arc::new(LazyResponse {
+			data,
+			flags,
+			attribute_keys,
+			strings: Mutex::new(StringTable::default()),
+		}),
+		offsets: Arc::new(offsets),
+		start: 0,
+		step: 1,
+		len,
+	})
+}
+
+
+/// Image search response decoded into flat columns.
+/// Tags and attributes are stored CSR-style: image i's entries are [offsets[i], offsets[i + 1]).
+/// Attribute keys and values are indices into `strings`, which holds each distinct string once.
+#[derive(Default)]
+struct Columns<'a> {
+	num_images: usize,
+	ids: Vec<u32>,
+	hashes: Vec<u8>,
+	tag_offsets: Vec<u64>,
+	tag_ids: Vec<u32>,
+	tag_blame: Vec<u32>,
+	attribute_offsets: Vec<u64>,
+	attribute_keys: Vec<u32>,
+	attribute_values: Vec<u32>,
+	attribute_blame: Vec<u32>,
+	strings: Vec<&'a str>,
+}
+
+
+/// Decode the records in data[start..end] into a dict of NumPy columns (see Columns).
+/// If `attribute_keys` is given, other attributes are skipped over without being decoded.
+#[pyfunction]
+#[pyo3(signature = (has_ids, has_hashes, has_tags, has_attributes, data, start=0, end=None, attribute_keys=None))]
+fn parse_search_response_columns<'py>(
+	py: Python<'py>,
+	has_ids: bool,
+	has_hashes: bool,
+	has_tags: bool,
+	has_attributes: bool,
+	data: PyBuffer<u8>,
+	start: usize,
+	end: Option<usize>,
+	attribute_keys: Option<HashSet<String>>,
+) -> PyResult<Bound<'py, PyDict>> {
+	let bytes = buffer_slice(&data, start, end)?;
+	let columns = py.allow_threads(|| decode_columns(has_ids, has_hashes, has_tags, has_attributes, bytes, attribute_keys.as_ref()))?;
+	let num_images = columns.num_images;
+	let result = PyDict::new(py);
+
+	result.set_item(intern!(py, "num_images"), num_images)?;
+
+	if has_ids {
+		result.set_item(intern!(py, "ids"), columns.ids.into_pyarray(py))?;
+	}
+
+	if has_hashes {
+		result.set_item(intern!(py, "hashes"), columns.hashes.into_pyarray(py).reshape([num_images, 32])?)?;
+	}
+
+	if has_tags {
+		result.set_item(intern!(py, "tag_offsets"), columns.tag_offsets.into_pyarray(py))?;
+		result.set_item(intern!(py, "tag_ids"), columns.tag_ids.into_pyarray(py))?;
+		result.set_item(intern!(py, "tag_blame"), columns.tag_blame.into_pyarray(py))?;
+	}
+
+	if has_attributes {
+		result.set_item(intern!(py, "attribute_offsets"), columns.attribute_offsets.into_pyarray(py))?;
+		result.set_item(intern!(py, "attribute_keys"), columns.attribute_keys.into_pyarray(py))?;
+		result.set_item(intern!(py, "attribute_values"), columns.attribute_values.into_pyarray(py))?;
+		result.set_item(intern!(py, "attribute_blame"), columns.attribute_blame.into_pyarray(py))?;
+		result.set_item(intern!(py, "strings"), columns.strings)?;
+	}
+
+	Ok(result)
+}
+
+
+fn decode_columns<'a>(
+	has_ids: bool,
+	has_hashes: bool,
+	has_tags: bool,
+	has_attributes: bool,
+	data: &'a [u8],
+	attribute_keys: Option<&HashSet<String>>,
+) -> Result<Columns<'a>, std::io::Error> {
+	if !(has_ids || has_hashes || has_tags || has_attributes) && !data.is_empty() {
+		return Err(std::io::Error::new(std::io::ErrorKind::InvalidData, "Response has data but no fields"));
+	}
+
+	let mut cursor = Cursor::new(data);
+	let mut columns = Columns::default();
+	let mut string_ids: HashMap<&'a str, u32> = HashMap::new();
+
+	if has_tags {
+		columns.tag_offsets.push(0);
+	}
+
+	if has_attributes {
+		columns.attribute_offsets.push(0);
+	}
+
+	while (cursor.position() as usize) < data.len() {
 		if has_ids {
-			let image_id = cursor.read_u32::<LittleEndian>()?;
-			//image.id = Some(image_id.into_pyobject(py)?.into());
-			//image.setattr("id", image_id.into_pyobject(py)?)?;
-			image.setattr(intern!(py, "id"), image_id)?;
+			columns.ids.push(cursor.read_u32::<LittleEndian>()?);
 		}
 
 		if has_hashes {
-			if cursor.position() + 32 > data_len {
-				return Err(PyErr::new::<pyo3::exceptions::PyValueError, _>("Buffer overflow while parsing image hash"));
-			}
-			let hash_slice = &data.as_bytes()[cursor.position() as usize..(cursor.position() + 32) as usize];
-			cursor.set_position(cursor.position() + 32);
-			//image.hash = Some(PyBytes::new(py, hash_slice).into());
-			image.setattr(intern!(py, "hash"), PyBytes::new(py, hash_slice))?;
+			let mut hash = [0u8; 32];
+			cursor.read_exact(&mut hash)?;
+			columns.hashes.extend_from_slice(&hash);
 		}
 
 		if has_tags {
-			let num_tags = read_vli(&mut cursor)? as usize;
-			let tag_dict = PyDict::new(py);
+			let num_tags = read_vli(&mut cursor)?;
 			for _ in 0..num_tags {
-				let tag_id = read_vli(&mut cursor)?;
-				let user_id = read_vli(&mut cursor)?;
-				tag_dict.set_item(tag_id, user_id)?;
+				columns.tag_ids.push(read_vli_u32(&mut cursor)?);
+				columns.tag_blame.push(read_vli_u32(&mut cursor)?);
 			}
-			//image.tags = Some(tag_list);
-			image.setattr(intern!(py, "tags"), tag_dict)?;
+			columns.tag_offsets.push(columns.tag_ids.len() as u64);
 		}
 
 		if has_attributes {
-			let num_keys = read_vli(&mut cursor)? as usize;
-			let attributes = PyDict::new(py);
-			for _ in 0..num_keys {
-				let key_str = read_string(&mut cursor)?;
-				let num_values = read_vli(&mut cursor)? as usize;
-				let value_dict = PyDict::new(py);
-				for _ in 0..num_values {
-					let val_str = read_string(&mut cursor)?;
-					let user_id = read_vli(&mut cursor)?;
-					value_dict.set_item(val_str, user_id)?;
+			for (key, values) in read_attributes(&mut cursor, attribute_keys)? {
+				let key = intern_string(&mut string_ids, &mut columns.strings, key);
+				for (value, user_id) in values {
+					let value = intern_string(&mut string_ids, &mut columns.strings, value);
+					columns.attribute_keys.push(key);
+					columns.attribute_values.push(value);
+					columns.attribute_blame.push(u32::try_from(user_id).map_err(|e| std::io::Error::new(std::io::ErrorKind::InvalidData, e))?);
 				}
-				attributes.set_item(key_str, value_dict)?;
 			}
-			//image.attributes = Some(attributes.into());
-			image.setattr(intern!(py, "attributes"), attributes)?;
+			columns.attribute_offsets.push(columns.attribute_keys.len() as u64);
 		}
 
-		images.push(image.into());
+		columns.num_images += 1;
 	}
 
-	Ok(images)
+	Ok(columns)
+}
+
+
+/// Return the index of `s` in the string table, adding it if it's new
+fn intern_string<'a>(string_ids: &mut HashMap<&'a str, u32>, strings: &mut Vec<&'a str>, s: &'a str) -> u32 {
+	if let Some(&id) = string_ids.get(s) {
+		return id;
+	}
+
+	let id = strings.len() as u32;
+	strings.push(s);
+	string_ids.insert(s, id);
+	id
+}
+
+
+/// View data[start..end] of a contiguous buffer. `end` defaults to the end of the buffer.
+fn buffer_slice(buffer: &PyBuffer<u8>, start: usize, end: Option<usize>) -> PyResult<&[u8]> {
+	if !buffer.is_c_contiguous() {
+		return Err(PyValueError::new_err("Expected a contiguous buffer"));
+	}
+
+	let bytes = buffer_bytes(buffer);
+	let end = end.unwrap_or(bytes.len());
+	bytes.get(start..end).ok_or_else(|| PyIndexError::new_err("start and end must be within the buffer"))
+}
+
+
+/// The contents of a contiguous buffer.
+fn buffer_bytes(buffer: &PyBuffer<u8>) -> &[u8] {
+	if buffer.len_bytes() == 0 {
+		return &[];
+	}
+
+	// SAFETY: The memory stays valid for as long as the buffer is held, since the exporter can't free or resize it until then.
+	// The exporter is expected to not modify the contents while they're being parsed.
+	unsafe { std::slice::from_raw_parts(buffer.buf_ptr() as *const u8, buffer.len_bytes()) }
+}
+
+
+/// Read a variable-length integer that must fit in 32 bits
+fn read_vli_u32<R: Read>(reader: R) -> Result<u32, std::io::Error> {
+	let value = read_vli(reader)?;
+	u32::try_from(value).map_err(|e| std::io::Error::new(std::io::ErrorKind::InvalidData, e))
 }
 
 
@@ -116,11 +793,11 @@ fn read_vli<R: Read>(mut reader: R) -> Result<u64, std::io::Error> {
 }
 
 
-/// Read a string from a reader
-fn read_string<R: Read>(mut reader: R) -> Result<String, std::io::Error> {
-	let len = read_vli(&mut reader)?;
-	let mut bytes = vec![0u8; len as usize];
-	reader.read_exact(&mut bytes)?;
-	let s = String::from_utf8(bytes).map_err(|e| std::io::Error::new(std::io::ErrorKind::InvalidData, e))?;
-	Ok(s)
+/// Read a string without copying it out of the cursor's data
+fn read_str<'a>(cursor: &mut Cursor<&'a [u8]>) -> Result<&'a str, std::io::Error> {
+	let len = read_vli(&mut *cursor)?;
+	let start = cursor.position() as usize;
+	skip_bytes(cursor, len)?;
+	let data: &'a [u8] = *cursor.get_ref();
+	std::str::from_utf8(&data[start..cursor.position() as usize]).map_err(|e| std::io::Error::new(std::io::ErrorKind::InvalidData, e))
 }
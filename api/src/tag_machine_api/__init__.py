@@ -1,59 +1,205 @@
 #!/usr/bin/env python3
-from typing import Generator
-import requests
-from pydantic import BaseModel
-import logging
-import numpy as np
+# requests, numpy, pydantic, PIL and the search response parser are imported where they're used rather than here,
+# since loading them takes far longer than most short scripts spend doing anything else
+from __future__ import annotations
+
+import bisect
 import dataclasses
-from pathlib import Path
-from hashlib import sha256
-from PIL import Image
-import time
-from numpy.typing import NDArray
-from tag_machine_api.parse import parse_search_response_images
+import functools
+import importlib
+import itertools
+import logging
+import mmap
 import os
+import random
+import tempfile
+import threading
+import time
+from collections import OrderedDict, deque
+from collections.abc import Callable, Generator, Iterable, Iterator
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from hashlib import sha256
+from pathlib import Path
+from typing import TYPE_CHECKING
+from urllib.parse import urlsplit
+
+if TYPE_CHECKING:
+	from typing import Self
+
+	import numpy as np
+	import requests
+	from numpy.typing import NDArray
+
+	from tag_machine_api.models import DBTag
+	from tag_machine_api.parse import LazySearchResults
 
 
 DEFAULT_API_URL = 'http://localhost:1420'
+READ_SIZE = 1 << 20  # Bytes read from the socket at a time when reading a response into a buffer
+MAX_POOLED_BUFFERS = 2  # Search response buffers kept for reuse per client
+MAX_POOLED_BUFFER_SIZE = 64 << 20  # Larger buffers are freed rather than kept for reuse
 TAG_MACHINE_DEST_DIR = Path("/home/night/tag-machine/rust-api/images").absolute()
 
+# Public names that are only imported when they're first accessed (see __getattr__)
+LAZY_NAMES = {
+	'DBTag': 'tag_machine_api.models',
+	'DBLog': 'tag_machine_api.models',
+	'CircuitOpenError': 'tag_machine_api.errors',
+}
+PARSER_NAMES = (
+	'parse_search_response_images', 'parse_search_response_columns', 'parse_search_response_lazy', 'scan_complete_records',
+	'LazySearchResults', 'LazySearchResultImage',
+)
+
+
+def __getattr__(name: str):
+	if name in LAZY_NAMES:
+		value = getattr(importlib.import_module(LAZY_NAMES[name]), name)
+	elif name in PARSER_NAMES:
+		value = getattr(search_parser(), name)
+	elif name == 'HAS_NATIVE_PARSER':
+		value = search_parser().__name__ == 'tag_machine_api.parse'
+	else:
+		raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+	globals()[name] = value
+	return value
+
+
+def __dir__() -> list[str]:
+	return sorted(set(globals()) | set(LAZY_NAMES) | set(PARSER_NAMES) | {'HAS_NATIVE_PARSER'})
+
+
+@functools.cache
+def search_parser():
+	"""
+	The module that decodes search responses: the compiled extension, or the (slower) pure Python fallback if it isn't built
+	or TAG_MACHINE_PURE_PYTHON is set.
+	"""
+	try:
+		if os.environ.get('TAG_MACHINE_PURE_PYTHON'):
+			raise ImportError('TAG_MACHINE_PURE_PYTHON is set')
+		return importlib.import_module('tag_machine_api.parse')
+	except ImportError:
+		return importlib.import_module('tag_machine_api.parse_fallback')
+
 
-@dataclasses.dataclass(frozen=True)
+@dataclasses.dataclass(frozen=True, slots=True)
 class DBImage:
 	id: int
 	hash: str
-	active: bool
+	active: bool | None  # None when unknown, as for images looked up through search (see get_images_metadata)
 	tags: dict[int, int]  # tag -> user_id
 	attributes: dict[str, dict[str, int]]  # key -> {value -> user_id}
 
 
-# @dataclasses.dataclass(frozen=True)
 class SearchResultImage:
+	"""
+	An image returned by a search. Fields that weren't selected are None.
+	To keep large result sets small, tags are stored packed in `packed_tags` as little-endian uint64 (tag, user_id) pairs
+	until `tags` is first accessed, which decodes them into a dict once and keeps that instead (so changes to it stick).
+	`tag_array` and `tag_ids` are cheaper views as long as `tags` hasn't been accessed.
+	"""
+	__slots__ = ('_packed_tags', '_tags', 'attributes', 'hash', 'id')
 	id: int | None
 	hash: bytes | None
-	tags: dict[int, int] | None
 	attributes: dict[str, dict[str, int]] | None
 
+	def __init__(self, id: int | None = None, hash: bytes | None = None, packed_tags: bytes | None = None, attributes: dict[str, dict[str, int]] | None = None):
+		self.id = id
+		self.hash = hash
+		self._packed_tags = packed_tags
+		self._tags = None
+		self.attributes = attributes
 
-class DBTag(BaseModel):
-	id: int
-	name: str
-	active: bool
+	@property
+	def packed_tags(self) -> bytes | None:
+		if self._tags is None:
+			return self._packed_tags
+		import numpy as np
 
+		return np.array(list(self._tags.items()), dtype='<u8').reshape(-1, 2).tobytes()
+
+	@packed_tags.setter
+	def packed_tags(self, packed_tags: bytes | None):
+		self._packed_tags = packed_tags
+		self._tags = None
+
+	@property
+	def tag_array(self) -> NDArray[np.uint64] | None:
+		"""(num_tags, 2) array of (tag, user_id)"""
+		import numpy as np
+
+		packed_tags = self.packed_tags
+		if packed_tags is None:
+			return None
+		return np.frombuffer(packed_tags, dtype='<u8').reshape(-1, 2)
+
+	@property
+	def tag_ids(self) -> NDArray[np.uint64] | None:
+		tag_array = self.tag_array
+		return tag_array[:, 0] if tag_array is not None else None
+
+	@property
+	def tags(self) -> dict[int, int] | None:
+		"""tag -> user_id"""
+		if self._tags is None and self._packed_tags is not None:
+			self._tags = dict(self.tag_array.tolist())
+			self._packed_tags = None
+		return self._tags
+
+	@tags.setter
+	def tags(self, tags: dict[int, int] | None):
+		self._tags = tags
+		self._packed_tags = None
+
+	def __repr__(self) -> str:
+		hash = self.hash.hex() if self.hash is not None else None
+		return f'SearchResultImage(id={self.id!r}, hash={hash}, tags={self.tags!r}, attributes={self.attributes!r})'
 
-class DBLog(BaseModel):
-	id: int
-	timestamp: int
-	user_id: int
-	action: str
-	image_hash: str | None
-	tag: str | None
-	attribute_key: str | None
-	attribute_value: str | None
+
+@dataclasses.dataclass
+class SearchResultColumns:
+	"""
+	Search results as flat NumPy columns instead of one object per image.
+	Fields that weren't selected are None.
+	Tags and attributes are stored CSR-style: image i's tags are tag_ids[tag_offsets[i]:tag_offsets[i + 1]]
+	(blamed on the matching tag_blame entries), and likewise for attributes with attribute_offsets.
+	attribute_keys and attribute_values index into `strings`, which holds each distinct key and value once.
+	"""
+	num_images: int
+	ids: NDArray[np.uint32] | None = None
+	hashes: NDArray[np.uint8] | None = None  # (num_images, 32)
+	tag_offsets: NDArray[np.uint64] | None = None
+	tag_ids: NDArray[np.uint32] | None = None
+	tag_blame: NDArray[np.uint32] | None = None
+	attribute_offsets: NDArray[np.uint64] | None = None
+	attribute_keys: NDArray[np.uint32] | None = None
+	attribute_values: NDArray[np.uint32] | None = None
+	attribute_blame: NDArray[np.uint32] | None = None
+	strings: list[str] | None = None
+
+	def __len__(self) -> int:
+		return self.num_images
 
 
 class TagMachineAPI:
-	def __init__(self, token: bytes | str | None = None, url: str | None = None):
+	def __init__(
+		self, token: bytes | str | None = None, url: str | None = None, cache: ClientCache | None = None, image_cache: ImageCache | None = None,
+		local_store: Path | str | None = None, pool_size: int = 10, retry_policy: RetryPolicy | None = None,
+		concurrency_limit: AdaptiveLimit | None = None, client_stats: ClientStats | None = None,
+	):
+		"""
+		The client can be used from many threads at once. Each thread gets its own session,
+		with a pool of up to pool_size connections to the server; raise it if one thread streams several responses at a time.
+		Requests are retried according to retry_policy (see RetryPolicy); by default each client gets its own.
+		Pass an AdaptiveLimit as concurrency_limit to have the client find how many requests it can have in flight across threads.
+		Pass a ClientStats as client_stats to record per-endpoint request statistics (see stats()).
+		Pass a ClientCache as cache to cache the tag list and image metadata (see ClientCache),
+		and an ImageCache as image_cache to keep downloaded images on disk (see ImageCache).
+		When running on the database host, pass the server's image store (e.g. TAG_MACHINE_DEST_DIR) as local_store,
+		or set TAG_MACHINE_LOCAL_STORE, to read images straight from it instead of over HTTP.
+		"""
 		if isinstance(token, bytes):
 			token = token.hex()
 		
@@ -63,59 +209,277 @@ class TagMachineAPI:
 		
 		url = url or os.environ.get('TAG_MACHINE_URL') or DEFAULT_API_URL
 
-		self.session = requests.Session()
 		self.url = url
-
-		# Set default headers
-		self.session.headers['Authorization'] = f'Bearer {token}'
+		self.headers = {'Authorization': f'Bearer {token}'}
+		self.pool_size = pool_size
+		self.retry_policy = retry_policy or RetryPolicy()
+		self.concurrency_limit = concurrency_limit
+		self.client_stats = client_stats
+		self.buffers: list[bytearray] = []  # Reused to read search responses into
+		self.local = threading.local()  # Per-thread sessions
+		self.cache = cache
+		self.image_cache = image_cache
+		local_store = local_store or os.environ.get('TAG_MACHINE_LOCAL_STORE')
+		self.local_store = Path(local_store) if local_store else None
 	
 	def get_image_metadata(self, id: bytes | int) -> DBImage:
 		"""
 		Get an image's metadata.
 		"""
+		if self.cache is not None and (image := self.cache.get_image(id)) is not None:
+			return image
+
+		return self._fetch_image_metadata(id)
+
+	def _fetch_image_metadata(self, id: bytes | int, missing_ok: bool = False) -> DBImage | None:
 		if isinstance(id, bytes):
 			id_str = id.hex()
 		else:
 			id_str = str(id)
-		r = request_with_retry(self.session, 'GET', f'{self.url}/api/images/{id_str}/metadata', timeout=30)
+		r = self._request('GET', f'{self.url}/api/images/{id_str}/metadata', timeout=30)
+		if missing_ok and r.status_code == 404:
+			return None
 		r.raise_for_status()
 		metadata = r.json()
-		return DBImage(**metadata)
+		# JSON object keys are always strings
+		metadata['tags'] = {int(tag): user_id for tag, user_id in metadata['tags'].items()}
+		image = DBImage(**metadata)
+
+		if self.cache is not None:
+			self.cache.put_image(image)
+
+		return image
 	
+	def get_images_metadata(
+		self, ids: Iterable[bytes | int], workers: int = 8, images_query: Callable[[list[bytes | int]], str] | None = None,
+		max_query_length: int = 4096,
+	) -> list[DBImage | None]:
+		"""
+		Get the metadata of many images, looked up by id or hash, with up to `workers` requests at once.
+		By default each image is fetched from its metadata endpoint.
+		images_query instead looks them up many at a time through the search endpoint: given a list of ids (or of hashes), it returns
+		a query matching exactly those images in the server's query language, which isn't assumed here.
+		The lookups are then split into queries of at most max_query_length characters.
+		Returns the images in the same order as `ids`, with None for images that weren't found.
+		Search results don't say whether an image is active, so with images_query `active` is None unless the image came from the cache.
+		"""
+		ids = list(ids)
+		found = {}
+		if self.cache is not None:
+			for id in ids:
+				if (image := self.cache.get_image(id)) is not None:
+					found[id] = image
+
+		missing = list(dict.fromkeys(id for id in ids if id not in found))
+		if images_query is None:
+			with ThreadPoolExecutor(max_workers=workers) as executor:
+				found.update(zip(missing, executor.map(functools.partial(self._fetch_image_metadata, missing_ok=True), missing)))
+			return [found.get(id) for id in ids]
+
+		queries = [
+			images_query(chunk)
+			for chunk in chunk_by_length([id for id in missing if isinstance(id, int)], max_query_length)
+			+ chunk_by_length([id for id in missing if isinstance(id, bytes)], max_query_length)
+		]
+
+		def run(query: str) -> list[SearchResultImage]:
+			import requests
+
+			params = {'select': 'id,hash,tags,attributes', 'query': query}
+			start = time.perf_counter()
+			r = self._request('GET', f'{self.url}/api/search/images', params=params, timeout=120)
+			if r.status_code != 200:
+				raise requests.HTTPError(f'Failed to search images ({r.status_code}): {r.text}', response=r)
+			content = r.content
+			parse_start = time.perf_counter()
+			images = parse_search_response(content)
+			if self.client_stats is not None:
+				self.client_stats.add_time('search.network', parse_start - start)
+				self.client_stats.add_time('search.parse', time.perf_counter() - parse_start)
+			return images
+
+		with ThreadPoolExecutor(max_workers=workers) as executor:
+			for image in itertools.chain.from_iterable(executor.map(run, queries)):
+				metadata = DBImage(id=image.id, hash=image.hash.hex(), active=None, tags=image.tags, attributes=image.attributes)
+				found[image.id] = metadata
+				found[image.hash] = metadata
+				if self.cache is not None:
+					self.cache.put_image(metadata)
+
+		return [found.get(id) for id in ids]
+
+	@property
+	def session(self) -> requests.Session:
+		"""
+		The calling thread's session, since requests.Session isn't safe to share between threads.
+		"""
+		import requests
+
+		session = getattr(self.local, 'session', None)
+		if session is None:
+			session = self.local.session = requests.Session()
+			adapter = requests.adapters.HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size)
+			session.mount('http://', adapter)
+			session.mount('https://', adapter)
+			session.headers.update(self.headers)
+		return session
+
+	def _request(self, method: str, url: str, **kwargs) -> requests.Response:
+		return request_with_retry(self.session, method, url, policy=self.retry_policy, client_stats=self.client_stats, limit=self.concurrency_limit, **kwargs)
+	
+	def stats(self) -> dict:
+		"""
+		A snapshot of the statistics recorded by client_stats (see ClientStats.snapshot).
+		"""
+		if self.client_stats is None:
+			raise ValueError('stats requires client_stats')
+		return self.client_stats.snapshot()
+
 	def read_image(self, id: bytes | int) -> bytes:
 		"""
 		Read an image's data.
+		Images in the local store are read from it. Otherwise, with an image cache,
+		the image is read from the cache, after downloading it into it if needed.
 		"""
+		if (path := self._local_path(id)) is not None:
+			try:
+				return path.read_bytes()
+			except FileNotFoundError:
+				pass
+
+		if self.image_cache is not None:
+			try:
+				return self.image_path(id).read_bytes()
+			except FileNotFoundError:
+				# Evicted between finding and reading it; download it directly
+				pass
+
 		id_str = id.hex() if isinstance(id, bytes) else str(id)
-		r = request_with_retry(self.session, 'GET', f'{self.url}/api/images/{id_str}', timeout=60)
+		r = self._request('GET', f'{self.url}/api/images/{id_str}', timeout=60)
 		r.raise_for_status()
 		return r.content
+
+	def map_image(self, id: bytes | int) -> mmap.mmap | bytes:
+		"""
+		Memory-map an image's file from the local store, so that it's paged in as it's used instead of being read up front.
+		Falls back to read_image if the image isn't in the local store.
+		"""
+		if (path := self._local_path(id)) is not None:
+			try:
+				with open(path, 'rb') as f:
+					if os.fstat(f.fileno()).st_size == 0:
+						return b''
+					return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+			except FileNotFoundError:
+				pass
+
+		return self.read_image(id)
+
+	def image_path(self, id: bytes | int) -> Path:
+		"""
+		The path of an image's file in the local store, or in the image cache after downloading it into it if needed.
+		Images requested by id can only be found on disk if their metadata is cached, or the image cache downloaded them by id.
+		"""
+		if (path := self._local_path(id)) is not None and path.exists():
+			return path
+
+		if self.image_cache is None:
+			raise ValueError('image_path requires an image_cache for images that aren\'t in the local store')
+
+		hash = id if isinstance(id, bytes) else self._cached_hash(id)
+		if hash is not None and (path := self.image_cache.get(hash)) is not None:
+			return path
+
+		return self._download_image(id, hash)
+
+	def prefetch_images(self, hashes: Iterable[bytes], workers: int = 8) -> list[bytes]:
+		"""
+		Download the images that aren't in the image cache yet into it, concurrently.
+		Returns the hashes of the images that couldn't be downloaded.
+		"""
+		import requests
+
+		if self.image_cache is None:
+			raise ValueError('prefetch_images requires an image_cache')
+
+		def fetch(hash: bytes) -> bool:
+			if self.image_cache.get(hash) is not None:
+				return True
+			try:
+				self._download_image(hash, hash)
+				return True
+			except (requests.RequestException, ValueError) as e:
+				logging.getLogger(__name__).warning(f'Failed to prefetch image {hash.hex()}: {e}')
+				return False
+
+		hashes = list(hashes)
+		with ThreadPoolExecutor(max_workers=workers) as executor:
+			return [hash for hash, ok in zip(hashes, executor.map(fetch, hashes)) if not ok]
+
+	def _local_path(self, id: bytes | int) -> Path | None:
+		"""
+		Where an image would be in the local store, if there is one and the image's hash is known.
+		"""
+		if self.local_store is None:
+			return None
+
+		hash = id if isinstance(id, bytes) else self._cached_hash(id)
+		if hash is None:
+			return None
+
+		hash_hex = hash.hex()
+		return self.local_store / hash_hex[:2] / hash_hex[2:4] / hash_hex
+
+	def _cached_hash(self, id: int) -> bytes | None:
+		image = self.cache.get_image(id) if self.cache is not None else None
+		if image is not None:
+			return bytes.fromhex(image.hash)
+		return self.image_cache.ids.get(id) if self.image_cache is not None else None
+
+	def _download_image(self, id: bytes | int, hash: bytes | None) -> Path:
+		"""
+		Stream an image into the image cache. If its hash is known, the download is checked against it.
+		"""
+		id_str = id.hex() if isinstance(id, bytes) else str(id)
+		r = self._request('GET', f'{self.url}/api/images/{id_str}', timeout=60, stream=True)
+		with r:
+			r.raise_for_status()
+			return self.image_cache.put(r.iter_content(READ_SIZE), hash, id=id if isinstance(id, int) else None)
 	
 	def tag_image(self, id: bytes | int, tag: str | int):
 		"""
 		Add a tag to an image.
 		"""
 		id_str = id.hex() if isinstance(id, bytes) else str(id)
-		r = request_with_retry(self.session, 'POST', f'{self.url}/api/images/{id_str}/tags/{tag}', timeout=30)
+		r = self._request('POST', f'{self.url}/api/images/{id_str}/tags/{tag}', timeout=30)
 		r.raise_for_status()
+		if self.cache is not None:
+			self.cache.apply(BulkOp('tag', id, tag=tag))
 	
 	def untag_image(self, id: bytes | int, tag: str | int):
 		"""
 		Remove a tag from an image.
 		"""
 		id_str = id.hex() if isinstance(id, bytes) else str(id)
-		r = request_with_retry(self.session, 'DELETE', f'{self.url}/api/images/{id_str}/tags/{tag}', timeout=30)
+		r = self._request('DELETE', f'{self.url}/api/images/{id_str}/tags/{tag}', timeout=30)
 		r.raise_for_status()
+		if self.cache is not None:
+			self.cache.apply(BulkOp('untag', id, tag=tag))
 	
 	def add_image_attribute(self, id: bytes | int, key: str | int, value: str, singular: bool) -> bool:
 		"""
 		Add an attribute to an image. Returns False if the attribute already exists.
 		"""
 		id_str = id.hex() if isinstance(id, bytes) else str(id)
-		r = request_with_retry(self.session, 'POST', f'{self.url}/api/images/{id_str}/attributes', json={'key': key, 'value': value, 'singular': singular}, timeout=30)
+		r = self._request('POST', f'{self.url}/api/images/{id_str}/attributes', json={'key': key, 'value': value, 'singular': singular}, timeout=30)
 		if r.status_code == 409:
+			if self.cache is not None:
+				# Nothing changed, but the value is there
+				self.cache.apply(BulkOp('add_attribute', id, key=key, value=value))
 			return False
 		r.raise_for_status()
+		if self.cache is not None:
+			self.cache.apply(BulkOp('add_attribute', id, key=key, value=value, singular=singular))
 		return True
 
 	def remove_image_attribute(self, id: bytes | int, key: str | int, value: str):
@@ -123,8 +487,10 @@ class TagMachineAPI:
 		Remove an attribute from an image.
 		"""
 		id_str = id.hex() if isinstance(id, bytes) else str(id)
-		r = request_with_retry(self.session, 'DELETE', f'{self.url}/api/images/{id_str}/attributes', json={'key': key, 'value': value}, timeout=30)
+		r = self._request('DELETE', f'{self.url}/api/images/{id_str}/attributes', json={'key': key, 'value': value}, timeout=30)
 		r.raise_for_status()
+		if self.cache is not None:
+			self.cache.apply(BulkOp('remove_attribute', id, key=key, value=value))
 	
 	# def fetch_logs(self, image_hash: bytes | None = None, action: str | None = None) -> list[DBLog]:
 	# 	params = {
@@ -149,36 +515,178 @@ class TagMachineAPI:
 	
 	# 	return logs
 	
-	def search(self, query: str, select: list[str]) -> np.ndarray | list[bytes] | list[SearchResultImage]:
+	def search(
+		self, query: str, select: list[str], columnar: bool = False, lazy: bool = False, attribute_keys: Iterable[str] | None = None,
+	) -> np.ndarray | list[bytes] | list[SearchResultImage] | SearchResultColumns | LazySearchResults:
 		"""
 		Search images in the database.
+		If columnar is True, the results are returned as a SearchResultColumns, which is far more compact for large result sets.
+		If lazy is True, the results are returned as a LazySearchResults, which only decodes the images that are accessed.
+		If attribute_keys is given, only those attributes are included in the results.
 		"""
 		params = {
 			'select': ','.join(select),
 			'query': query,
 		}
-		r = request_with_retry(self.session, 'GET', f'{self.url}/api/search/images', params=params, timeout=120)
-		if r.status_code != 200:
-			raise Exception(f'Failed to search images ({r.status_code}): {r.text}')
+		start = time.perf_counter()
+		r = self._request('GET', f'{self.url}/api/search/images', params=params, timeout=120, stream=True)
+		with r:
+			if r.status_code != 200:
+				raise Exception(f'Failed to search images ({r.status_code}): {r.text}')
+
+			buffer, size = self._read_into_buffer(r)
 
-		result = r.content
-		return parse_search_response(result)
+		parse_start = time.perf_counter()
+		response = memoryview(buffer)[:size]
+		result = parse_search_response(response, columnar=columnar, lazy=lazy, attribute_keys=attribute_keys)
+		if self.client_stats is not None:
+			self.client_stats.add_time('search.network', parse_start - start)
+			self.client_stats.add_time('search.parse', time.perf_counter() - parse_start)
+
+		# ID, hash and lazy results are views of the buffer, so it's handed over to them instead of being reused
+		if not lazy and size >= 4 and response[3] not in (1 << 3, 1 << 2):
+			response.release()
+			if len(buffer) <= MAX_POOLED_BUFFER_SIZE and len(self.buffers) < MAX_POOLED_BUFFERS:
+				self.buffers.append(buffer)
+
+		return result
+	
+	def _read_into_buffer(self, r: requests.Response) -> tuple[bytearray, int]:
+		"""
+		Read a streamed response's body into one of self.buffers, without the intermediate copies of r.content.
+		The buffer is sized up front from Content-Length when possible.
+		Returns the buffer and the size of the body.
+		"""
+		r.raw.decode_content = True
+		try:
+			buffer = self.buffers.pop()
+		except IndexError:
+			buffer = bytearray()
+
+		expected_size = int(r.headers.get('Content-Length', 0)) if 'Content-Encoding' not in r.headers else 0
+		if expected_size >= len(buffer):
+			# One spare byte so that the read which hits the end of the body doesn't have to grow the buffer
+			buffer = bytearray(expected_size + 1)
+
+		size = 0
+		while True:
+			if size == len(buffer):
+				grown = bytearray(max(2 * len(buffer), READ_SIZE))
+				grown[:size] = buffer
+				buffer = grown
+
+			n = r.raw.readinto(memoryview(buffer)[size:size + READ_SIZE])
+			if not n:
+				break
+			size += n
+
+		return buffer, size
 	
+	def search_stream(
+		self, query: str, select: list[str], columnar: bool = False, batch_size: int = 2**16, chunk_size: int = 2**20,
+		attribute_keys: Iterable[str] | None = None,
+	) -> Iterator[SearchResultImage | SearchResultColumns | np.ndarray]:
+		"""
+		Search images in the database, parsing the response as it arrives instead of buffering all of it.
+		See iter_search_response for what is yielded.
+		"""
+		import requests
+
+		params = {
+			'select': ','.join(select),
+			'query': query,
+		}
+		r = self._request('GET', f'{self.url}/api/search/images', params=params, timeout=120, stream=True)
+		with r:
+			if r.status_code != 200:
+				raise requests.HTTPError(f'Failed to search images ({r.status_code}): {r.text}', response=r)
+
+			yield from iter_search_response(r.iter_content(chunk_size), columnar=columnar, batch_size=batch_size, attribute_keys=attribute_keys)
+
+	def search_partitioned(
+		self, operator: dict | None, select: list[str], partition_size: int = 2**16, window: int | None = None,
+		min_id: int = 0, max_id: int | None = None,
+	) -> Iterator[dict]:
+		"""
+		Search images through /api/search_images, the endpoint DatabaseData.search_images_batched pages through with a minid
+		cursor, in partitions of partition_size images, for result sets too large for one request.
+		operator is that endpoint's filter (None for every image) and select its field names, e.g. ['id', 'hash', 'tags'].
+		Since it only pages forward from a minid, the matching ids are listed first, a few partitions at a time, and then up to
+		window (by default pool_size) partitions are fetched at once, each starting at its first id.
+		Yields the images as the server returns them (dicts of the selected fields, plus id), in id order.
+		Only images with min_id <= id <= max_id are included; both bounds are inclusive.
+		"""
+		window = window or self.pool_size
+		fields = select if 'id' in select else ['id'] + select
+		next_id = min_id
+		listed_all = False
+		pending: deque[Future] = deque()
+
+		def page(lo: int, limit: int, fields: list[str]) -> list[dict]:
+			params = {
+				'order_by': 'id',
+				'operator': {'minid': lo} if operator is None else {'and': [operator, {'minid': lo}]},
+				'limit': limit,
+				'select': fields,
+			}
+			r = self._request('POST', f'{self.url}/api/search_images', json=params, timeout=120)
+			r.raise_for_status()
+			return r.json()['images']
+
+		def fetch(ids: list[int]) -> list[dict]:
+			# Images deleted since their ids were listed would make the page run on into the next partition
+			return [image for image in page(ids[0], len(ids), fields) if image['id'] <= ids[-1]]
+
+		with ThreadPoolExecutor(max_workers=window) as executor:
+			try:
+				while True:
+					if not listed_all and len(pending) < window:
+						limit = partition_size * (window - len(pending))
+						ids = [image['id'] for image in page(next_id, limit, ['id'])]
+						listed_all = len(ids) < limit
+						if max_id is not None and ids and ids[-1] > max_id:
+							ids = [id for id in ids if id <= max_id]
+							listed_all = True
+						if ids:
+							next_id = ids[-1] + 1
+						for i in range(0, len(ids), partition_size):
+							pending.append(executor.submit(fetch, ids[i:i + partition_size]))
+
+					if not pending:
+						return
+
+					yield from pending.popleft().result()
+			finally:
+				for future in pending:
+					future.cancel()
+
 	def add_image(self, image_hash: bytes) -> bool:
 		"""
 		Add an image to the database. Returns False if the image already exists.
 		"""
-		r = request_with_retry(self.session, 'POST', f'{self.url}/api/images/{image_hash.hex()}', timeout=30)
+		r = self._request('POST', f'{self.url}/api/images/{image_hash.hex()}', timeout=30)
 		if r.status_code == 409:
 			return False
 		r.raise_for_status()
 		return True
 	
-	def fetch_tags(self) -> list[DBTag]:
-		response = request_with_retry(self.session, 'GET', f'{self.url}/api/tags', timeout=30)
+	def fetch_tags(self, refresh: bool = False) -> list[DBTag]:
+		"""
+		Get the list of tags. With a cache, the cached list is returned unless it's expired or refresh is True.
+		"""
+		from tag_machine_api.models import DBTag
+
+		if self.cache is not None and not refresh and (tags := self.cache.get_tags()) is not None:
+			return tags
+
+		response = self._request('GET', f'{self.url}/api/tags', timeout=30)
 		response.raise_for_status()
-		tags = response.json()
-		return [DBTag(**tag) for tag in tags]
+		tags = [DBTag(**tag) for tag in response.json()]
+
+		if self.cache is not None:
+			self.cache.put_tags(tags)
+
+		return tags
 	
 	def add_image_by_path(self, src_path: Path, file_hash: bytes | None) -> bytes | None:
 		"""
@@ -232,32 +740,935 @@ class TagMachineAPI:
 			self.add_image_attribute(file_hash, 'image_height', str(image_size[1]), singular=True)
 
 		return file_hash
+	
+	def bulk_writer(self, workers: int = 16, window: int = 1024) -> BulkWriter:
+		"""
+		Queue tag and attribute mutations and send them from a pool of worker threads.
+		See BulkWriter.
+		"""
+		return BulkWriter(self, workers=workers, window=window)
+
+
+@dataclasses.dataclass(frozen=True, slots=True)
+class BulkOp:
+	action: str  # 'tag', 'untag', 'add_attribute' or 'remove_attribute'
+	id: bytes | int
+	tag: str | int | None = None
+	key: str | int | None = None
+	value: str | None = None
+	singular: bool = False
+
+	@property
+	def target(self) -> tuple:
+		"""What the op changes on its image; ops with the same target supersede each other"""
+		return ('tag', self.tag) if self.tag is not None else ('attribute', self.key, self.value)
+
+	@property
+	def adds(self) -> bool:
+		return self.action in ('tag', 'add_attribute')
+
+
+@dataclasses.dataclass(frozen=True, slots=True)
+class BulkFailure:
+	op: BulkOp
+	status: int | None  # None if the request itself failed
+	error: str
+
+
+@dataclasses.dataclass
+class BulkResult:
+	queued: int = 0  # Ops given to the writer
+	coalesced: int = 0  # Ops dropped as duplicates or because a later op superseded them
+	sent: int = 0
+	succeeded: int = 0
+	conflicts: list[BulkOp] = dataclasses.field(default_factory=list)  # add_attribute ops that already existed (409)
+	failures: list[BulkFailure] = dataclasses.field(default_factory=list)
+	elapsed: float = 0.0
+
+	@property
+	def ops_per_second(self) -> float:
+		"""Ops that took effect (or already had) per second, not counting failures"""
+		return (self.succeeded + len(self.conflicts)) / self.elapsed if self.elapsed > 0 else 0.0
+
+
+class BulkWriter:
+	"""
+	Queues tag and attribute mutations and sends them from a pool of worker threads.
+	Use as a context manager; everything queued is sent by the time it exits and the outcome is in `result`.
+
+	Ops are held per image until more than `window` images are pending, so that repeats can be coalesced:
+	a duplicate op is dropped and an opposing one (untag after tag, remove after add) replaces the earlier one.
+	Each image's ops are sent in order, one at a time; different images are sent concurrently,
+	with at most 2 * workers batches in flight.
+	Failed ops are collected in result.failures instead of raising, and don't stop the rest of the batch.
+	Images are keyed by how they are referenced, so mixing ids and hashes for the same image loses that ordering.
+	Ops must be queued from a single thread.
+	"""
+	def __init__(self, api: TagMachineAPI, workers: int = 16, window: int = 1024):
+		self.api = api
+		self.window = window
+		self.result = BulkResult()
+		self.pending: dict[str, list[BulkOp]] = {}  # Image -> ops, oldest image first
+		self.in_flight: dict[str, Future] = {}
+		self.slots = threading.BoundedSemaphore(2 * workers)
+		self.lock = threading.Lock()
+		self.executor = ThreadPoolExecutor(max_workers=workers)
+		self.start_time = time.perf_counter()
+
+	def __enter__(self) -> Self:
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.close(flush=exc_type is None)
+
+	def close(self, flush: bool = True):
+		"""
+		Wait for the writer to finish. If flush is False, ops that haven't been dispatched yet are dropped.
+		"""
+		if flush:
+			self.flush()
+		else:
+			self.pending.clear()
+
+		self.executor.shutdown(wait=True)
+		self.result.elapsed = time.perf_counter() - self.start_time
+
+	def flush(self):
+		"""
+		Dispatch every pending op without waiting for them to finish.
+		"""
+		while self.pending:
+			self._dispatch_oldest()
+
+	def tag_image(self, id: bytes | int, tag: str | int):
+		self.queue(BulkOp('tag', id, tag=tag))
+
+	def untag_image(self, id: bytes | int, tag: str | int):
+		self.queue(BulkOp('untag', id, tag=tag))
+
+	def add_image_attribute(self, id: bytes | int, key: str | int, value: str, singular: bool):
+		self.queue(BulkOp('add_attribute', id, key=key, value=value, singular=singular))
+
+	def remove_image_attribute(self, id: bytes | int, key: str | int, value: str):
+		self.queue(BulkOp('remove_attribute', id, key=key, value=value))
+
+	def queue(self, op: BulkOp):
+		self.result.queued += 1
+		image = op.id.hex() if isinstance(op.id, bytes) else str(op.id)
+		ops = self.pending.get(image)
+		if ops is None:
+			ops = self.pending[image] = []
+
+		if op.singular:
+			# A singular attribute replaces every value of its key, so earlier ops on the key don't matter
+			kept = [o for o in ops if o.key is None or o.key != op.key]
+			self.result.coalesced += len(ops) - len(kept)
+			ops[:] = kept
+			ops.append(op)
+		else:
+			previous = next((i for i in range(len(ops) - 1, -1, -1) if ops[i].target == op.target), None)
+			if previous is not None and ops[previous].adds == op.adds:
+				self.result.coalesced += 1
+				return
+			elif previous is not None and not ops[previous].singular:
+				del ops[previous]
+				self.result.coalesced += 1
+			ops.append(op)
+
+		if len(self.pending) > self.window:
+			self._dispatch_oldest()
+
+	def _dispatch_oldest(self):
+		image = next(iter(self.pending))
+		ops = self.pending.pop(image)
+		self.slots.acquire()
+		with self.lock:
+			# Ops for an image that's still being written wait for the earlier batch, to keep them in order
+			previous = self.in_flight.get(image)
+			future = self.executor.submit(self._apply, ops, previous)
+			self.in_flight[image] = future
+		future.add_done_callback(lambda f: self._finished(image, f))
+
+	def _finished(self, image: str, future: Future):
+		with self.lock:
+			if self.in_flight.get(image) is future:
+				del self.in_flight[image]
+		self.slots.release()
+
+	def _apply(self, ops: list[BulkOp], previous: Future | None):
+		if previous is not None:
+			wait([previous])
+
+		for op in ops:
+			id_str = op.id.hex() if isinstance(op.id, bytes) else str(op.id)
+			if op.action in ('tag', 'untag'):
+				method = 'POST' if op.action == 'tag' else 'DELETE'
+				url, body = f'{self.api.url}/api/images/{id_str}/tags/{op.tag}', None
+			else:
+				method = 'POST' if op.action == 'add_attribute' else 'DELETE'
+				url, body = f'{self.api.url}/api/images/{id_str}/attributes', {'key': op.key, 'value': op.value}
+				if op.action == 'add_attribute':
+					body['singular'] = op.singular
+
+			try:
+				r = self.api._request(method, url, json=body, timeout=30)
+			except Exception as e:  # noqa: BLE001
+				# Anything, not just connection errors, so that one bad op can't lose the rest of the batch
+				with self.lock:
+					self.result.sent += 1
+					self.result.failures.append(BulkFailure(op, None, f'{type(e).__name__}: {e}'))
+				continue
+
+			with self.lock:
+				self.result.sent += 1
+				if r.status_code == 409 and op.action == 'add_attribute':
+					self.result.conflicts.append(op)
+				elif r.status_code >= 400:
+					self.result.failures.append(BulkFailure(op, r.status_code, r.text))
+				else:
+					self.result.succeeded += 1
+
+			if self.api.cache is not None and r.status_code < 400:
+				self.api.cache.apply(op)
+			elif self.api.cache is not None and r.status_code == 409 and op.action == 'add_attribute':
+				self.api.cache.apply(dataclasses.replace(op, singular=False))
+
+
+@dataclasses.dataclass
+class CacheStats:
+	image_hits: int = 0
+	image_misses: int = 0
+	tag_hits: int = 0
+	tag_misses: int = 0
+
+
+class ClientCache:
+	"""
+	Opt-in cache for TagMachineAPI, of the tag list and of image metadata.
+	Image metadata is kept in an LRU of up to max_images images, found by id or hash.
+	The client's own tag and attribute changes are applied to cached images instead of invalidating them,
+	with user_id 0 for tags and values they add, since the client doesn't know its own user id.
+	Changes made by anyone else aren't seen until the image is evicted or invalidated.
+	The tag list, and the tag_to_id / id_to_tag maps, are refetched once they're older than tags_ttl seconds (never if None).
+	Safe to share between threads.
+	"""
+	def __init__(self, max_images: int = 100_000, tags_ttl: float | None = None):
+		self.max_images = max_images
+		self.tags_ttl = tags_ttl
+		self.images: OrderedDict[int, DBImage] = OrderedDict()  # id -> image, least recently used first
+		self.hash_to_id: dict[str, int] = {}
+		self.tags: list[DBTag] | None = None
+		self.tag_to_id: dict[str, int] = {}
+		self.id_to_tag: dict[int, str] = {}
+		self.tags_fetched_at = 0.0
+		self.stats = CacheStats()
+		self.lock = threading.Lock()
+
+	def _image_id(self, id: bytes | int) -> int | None:
+		return self.hash_to_id.get(id.hex()) if isinstance(id, bytes) else id
+
+	def get_image(self, id: bytes | int) -> DBImage | None:
+		with self.lock:
+			image_id = self._image_id(id)
+			image = self.images.get(image_id) if image_id is not None else None
+			if image is None:
+				self.stats.image_misses += 1
+				return None
 
+			self.stats.image_hits += 1
+			self.images.move_to_end(image_id)
+			return image
 
-def request_with_retry(session: requests.Session, method: str, url: str, **kwargs) -> requests.Response:
-	for i in range(4):
+	def put_image(self, image: DBImage):
+		with self.lock:
+			self._put_image(image)
+
+	def _put_image(self, image: DBImage):
+		self.images[image.id] = image
+		self.images.move_to_end(image.id)
+		self.hash_to_id[image.hash] = image.id
+		while len(self.images) > self.max_images:
+			_, evicted = self.images.popitem(last=False)
+			del self.hash_to_id[evicted.hash]
+
+	def invalidate_image(self, id: bytes | int):
+		with self.lock:
+			image_id = self._image_id(id)
+			image = self.images.pop(image_id, None) if image_id is not None else None
+			if image is not None:
+				del self.hash_to_id[image.hash]
+
+	def apply(self, op: BulkOp):
+		"""
+		Apply a change the client made to its cached image, if the image is cached.
+		"""
+		with self.lock:
+			image_id = self._image_id(op.id)
+			image = self.images.get(image_id) if image_id is not None else None
+			if image is None:
+				return
+
+			if op.tag is not None:
+				tag = op.tag if isinstance(op.tag, int) else self.tag_to_id.get(op.tag)
+				if tag is None:
+					# Can't tell which tag this is without the tag list
+					self.images.pop(image_id)
+					del self.hash_to_id[image.hash]
+					return
+
+				tags = dict(image.tags)
+				if op.action == 'tag':
+					tags.setdefault(tag, 0)
+				else:
+					tags.pop(tag, None)
+				self.images[image_id] = dataclasses.replace(image, tags=tags)
+			else:
+				key, value = str(op.key), str(op.value)
+				attributes = dict(image.attributes)
+				values = {} if op.singular else dict(attributes.get(key, {}))
+				if op.action == 'add_attribute':
+					values.setdefault(value, image.attributes.get(key, {}).get(value, 0))
+				else:
+					values.pop(value, None)
+
+				if values:
+					attributes[key] = values
+				else:
+					attributes.pop(key, None)
+				self.images[image_id] = dataclasses.replace(image, attributes=attributes)
+
+	def get_tags(self) -> list[DBTag] | None:
+		"""
+		The cached tag list, or None if it hasn't been fetched or has expired.
+		"""
+		with self.lock:
+			if self.tags is None or (self.tags_ttl is not None and time.monotonic() - self.tags_fetched_at > self.tags_ttl):
+				self.stats.tag_misses += 1
+				return None
+
+			self.stats.tag_hits += 1
+			return self.tags
+
+	def put_tags(self, tags: list[DBTag]):
+		with self.lock:
+			self.tags = tags
+			self.tag_to_id = {tag.name: tag.id for tag in tags}
+			self.id_to_tag = {tag.id: tag.name for tag in tags}
+			self.tags_fetched_at = time.monotonic()
+
+
+class ImageCache:
+	"""
+	On-disk cache of image files, stored by sha256 at root/xx/yy/hash like the server's image store.
+	Files are written to a temporary file, checked against their hash and moved into place, so a cached file is always complete.
+	Once the cache grows past max_bytes (unbounded if None), the least recently read files are deleted until it's back under 90% of that.
+	Sizes and read order are kept in memory in `files`, from a scan of root when the cache is created, so eviction doesn't touch the disk
+	beyond deleting files. Reads also update the files' mtimes, which is the order the next scan starts from.
+	The hashes of images downloaded by id are remembered (in memory) in `ids`, so that they can be found again by id.
+	Safe to share between threads, and between processes as long as only one of them evicts
+	(files other processes add are only counted once this one reads them).
+	"""
+	def __init__(self, root: Path | str, max_bytes: int | None = None):
+		self.root = Path(root)
+		self.max_bytes = max_bytes
+		self.ids: dict[int, bytes] = {}  # Image id -> hash
+		self.lock = threading.Lock()
+		self.root.mkdir(parents=True, exist_ok=True)
+
+		files = []
+		for p in self.root.glob('??/??/*'):
+			try:
+				stat = p.stat()
+			except FileNotFoundError:
+				continue
+			files.append((stat.st_mtime, p.name, stat.st_size))
+		files.sort()
+		self.files: OrderedDict[str, int] = OrderedDict((name, size) for _, name, size in files)  # Hash -> size, least recently read first
+		self.size = sum(self.files.values())  # Bytes cached
+
+	def path(self, hash: bytes) -> Path:
+		hash_hex = hash.hex()
+		return self.root / hash_hex[:2] / hash_hex[2:4] / hash_hex
+
+	def get(self, hash: bytes) -> Path | None:
+		"""
+		The cached file for hash, or None if it isn't cached.
+		"""
+		path = self.path(hash)
+		try:
+			os.utime(path)
+		except FileNotFoundError:
+			with self.lock:
+				self._remove(path.name)
+			return None
+
+		with self.lock:
+			known = path.name in self.files
+			if known:
+				self.files.move_to_end(path.name)
+		if not known:
+			# Written by another process
+			try:
+				size = path.stat().st_size
+			except FileNotFoundError:
+				return None
+			with self.lock:
+				self._add(path.name, size)
+		return path
+
+	def put(self, chunks: Iterable[bytes], hash: bytes | None = None, id: int | None = None) -> Path:
+		"""
+		Write a file to the cache from chunks of its data.
+		Raises ValueError if its sha256 isn't hash. If hash is None, the file is stored under the sha256 of its data.
+		If the image's id is given, it's remembered in `ids`.
+		"""
+		hasher = sha256()
+		size = 0
+		with tempfile.NamedTemporaryFile(dir=self.root, prefix='.tmp-', delete=False) as f:
+			try:
+				for chunk in chunks:
+					hasher.update(chunk)
+					f.write(chunk)
+					size += len(chunk)
+			except BaseException:
+				os.unlink(f.name)
+				raise
+
+		digest = hasher.digest()
+		if hash is not None and digest != hash:
+			os.unlink(f.name)
+			raise ValueError(f'Downloaded image {hash.hex()} has the wrong hash {digest.hex()}')
+
+		path = self.path(digest)
+		path.parent.mkdir(parents=True, exist_ok=True)
+		os.replace(f.name, path)
+
+		with self.lock:
+			if id is not None:
+				self.ids[id] = digest
+
+			self._add(path.name, size)
+			if self.max_bytes is not None and self.size > self.max_bytes:
+				self._evict()
+
+		return path
+
+	def _add(self, name: str, size: int):
+		self._remove(name)
+		self.files[name] = size
+		self.size += size
+
+	def _remove(self, name: str):
+		self.size -= self.files.pop(name, 0)
+
+	def _evict(self):
+		target = int(self.max_bytes * 0.9)
+		evicted = set()
+		while self.size > target and self.files:
+			name, size = self.files.popitem(last=False)
+			self.size -= size
+			(self.root / name[:2] / name[2:4] / name).unlink(missing_ok=True)
+			evicted.add(name)
+
+		if evicted:
+			self.ids = {id: hash for id, hash in self.ids.items() if hash.hex() not in evicted}
+
+
+class AdaptiveLimit:
+	"""
+	AIMD limit on the number of requests in flight, shared by all threads of a client.
+	Completed requests are judged in windows of about `limit` requests (at least min_window).
+	A window whose mean latency stays within latency_tolerance times the baseline (the lowest mean of the last
+	baseline_windows windows without overloads) grows the limit by one, if the limit was reached during it.
+	A window with inflated latency, or with a 429, 5xx or failed request, multiplies the limit by `backoff`.
+	Since the baseline only remembers recent windows, a lasting change in latency (a slower backend, a longer route)
+	becomes the new baseline after baseline_windows windows, instead of holding the limit down.
+	Bulk operations still run at most as many requests at once as they have workers, so give them at least max_limit workers.
+	"""
+	def __init__(
+		self, initial: int = 4, min_limit: int = 1, max_limit: int = 64, latency_tolerance: float = 2.0, backoff: float = 0.9, min_window: int = 8,
+		baseline_windows: int = 20,
+	):
+		self.min_limit = min_limit
+		self.max_limit = max_limit
+		self.latency_tolerance = latency_tolerance
+		self.backoff = backoff
+		self.min_window = min_window
+		self.current = float(initial)
+		self.in_flight = 0
+		self.window_means: deque[float] = deque(maxlen=baseline_windows)  # Of recent windows without overloads
+		self.increases = 0
+		self.decreases = 0
+		self.condition = threading.Condition()
+
+		# The current window
+		self.samples = 0
+		self.latency_sum = 0.0
+		self.overloads = 0
+		self.saturated = False
+
+	@property
+	def limit(self) -> int:
+		return int(self.current)
+
+	def acquire(self):
+		with self.condition:
+			while self.in_flight >= int(self.current):
+				self.condition.wait()
+			self.in_flight += 1
+			self.saturated = self.saturated or self.in_flight >= int(self.current)
+
+	def release(self, latency: float, overloaded: bool):
+		with self.condition:
+			self.in_flight -= 1
+			self.samples += 1
+			self.latency_sum += latency
+			self.overloads += overloaded
+
+			if self.samples >= max(int(self.current), self.min_window):
+				self._end_window()
+
+			self.condition.notify_all()
+
+	@property
+	def baseline(self) -> float | None:
+		return min(self.window_means, default=None)
+
+	def _end_window(self):
+		mean = self.latency_sum / self.samples
+		baseline = self.baseline
+		if self.overloads == 0:
+			# Failed requests can come back much faster than real ones, so those windows don't count towards the baseline
+			self.window_means.append(mean)
+
+		if self.overloads > 0 or (baseline is not None and mean > self.latency_tolerance * baseline):
+			self.current = max(float(self.min_limit), self.current * self.backoff)
+			self.decreases += 1
+		elif self.saturated and self.current < self.max_limit:
+			self.current = min(float(self.max_limit), self.current + 1)
+			self.increases += 1
+
+		self.samples = 0
+		self.latency_sum = 0.0
+		self.overloads = 0
+		self.saturated = False
+
+
+class CircuitOpen(Exception):
+	"""
+	Raised instead of making a request while the server is considered down (see RetryPolicy).
+	Each client raises a subclass that is also one of its own connection errors: CircuitOpenError (a requests.ConnectionError)
+	from TagMachineAPI, and aio.AsyncCircuitOpenError (an aiohttp.ClientConnectionError) from AsyncTagMachineAPI.
+	"""
+
+
+class RetryPolicy:
+	"""
+	How a client retries failed requests (connection errors and 5xx responses), shared by all of its threads.
+	Each request is tried up to max_attempts times, sleeping a random time of up to base_delay * 2**attempt (at most max_delay) between tries.
+	Retries are limited client-wide by a budget, so that an outage doesn't multiply the load on the server:
+	every request adds retry_ratio of a retry to it, it refills at min_retries_per_second, and it holds at most max_budget retries.
+	After failure_threshold failed tries in a row the circuit opens, and requests fail fast with CircuitOpen
+	until `cooldown` seconds have passed. Then a single trial request is let through, which closes the circuit if it succeeds.
+	"""
+	def __init__(
+		self, max_attempts: int = 4, base_delay: float = 0.5, max_delay: float = 8.0, retry_ratio: float = 0.1, min_retries_per_second: float = 1.0,
+		max_budget: float = 20.0, failure_threshold: int = 20, cooldown: float = 10.0,
+	):
+		self.max_attempts = max_attempts
+		self.base_delay = base_delay
+		self.max_delay = max_delay
+		self.retry_ratio = retry_ratio
+		self.min_retries_per_second = min_retries_per_second
+		self.max_budget = max_budget
+		self.failure_threshold = failure_threshold
+		self.cooldown = cooldown
+
+		self.budget = max_budget
+		self.budget_updated_at = time.monotonic()
+		self.consecutive_failures = 0
+		self.open_until = 0.0
+		self.trial_in_flight = False
+		self.retries = 0  # Totals, for monitoring
+		self.retries_denied = 0
+		self.fast_failures = 0
+		self.lock = threading.Lock()
+
+	def delay(self, attempt: int) -> float:
+		return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+	def before_request(self):
+		with self.lock:
+			self._refill(self.retry_ratio)
+
+	def before_attempt(self, error: type[CircuitOpen] | None = None) -> bool:
+		"""
+		Raises `error` (CircuitOpenError by default) if the circuit is open.
+		Returns True if the attempt is the trial request of a circuit that's about to close. Its outcome must be passed on to
+		succeeded or failed with trial=True, or the trial given back with end_trial if the attempt ends some other way.
+		"""
+		with self.lock:
+			if self.consecutive_failures < self.failure_threshold:
+				return False
+
+			now = time.monotonic()
+			if now >= self.open_until and not self.trial_in_flight:
+				self.trial_in_flight = True
+				return True
+
+			self.fast_failures += 1
+			if error is None:
+				from tag_machine_api.errors import CircuitOpenError as error
+			raise error(f'Not sending requests for {max(self.open_until - now, 0):.1f}s after {self.consecutive_failures} failures in a row')
+
+	def succeeded(self, trial: bool = False):
+		with self.lock:
+			self.consecutive_failures = 0
+			if trial:
+				self.trial_in_flight = False
+
+	def failed(self, trial: bool = False):
+		with self.lock:
+			self.consecutive_failures += 1
+			if self.consecutive_failures >= self.failure_threshold:
+				self.open_until = time.monotonic() + self.cooldown
+			# Only the trial's own outcome ends it; requests that were already in flight when the circuit opened don't
+			if trial:
+				self.trial_in_flight = False
+
+	def end_trial(self):
+		"""
+		Give back the trial after an attempt that neither succeeded nor failed (an unexpected exception), so that another can be made.
+		"""
+		with self.lock:
+			self.trial_in_flight = False
+
+	def allow_retry(self) -> bool:
+		"""
+		Takes a retry from the budget, if there's one left and the circuit isn't open.
+		"""
+		with self.lock:
+			if self.consecutive_failures >= self.failure_threshold:
+				return False
+
+			self._refill(0)
+			if self.budget < 1:
+				self.retries_denied += 1
+				return False
+			self.budget -= 1
+			self.retries += 1
+			return True
+
+	def _refill(self, amount: float):
+		now = time.monotonic()
+		self.budget = min(self.max_budget, self.budget + amount + (now - self.budget_updated_at) * self.min_retries_per_second)
+		self.budget_updated_at = now
+
+
+DEFAULT_RETRY_POLICIES: dict[str, RetryPolicy] = {}  # Server (scheme and host) -> policy, for callers that don't pass one
+DEFAULT_RETRY_POLICIES_LOCK = threading.Lock()
+
+
+def default_retry_policy(url: str) -> RetryPolicy:
+	"""
+	The retry policy request_with_retry uses for url's server when it isn't given one.
+	Each server gets its own, so that one server being down doesn't open the circuit for requests to others.
+	"""
+	parts = urlsplit(url)
+	server = f'{parts.scheme}://{parts.netloc}'
+	with DEFAULT_RETRY_POLICIES_LOCK:
+		policy = DEFAULT_RETRY_POLICIES.get(server)
+		if policy is None:
+			policy = DEFAULT_RETRY_POLICIES[server] = RetryPolicy()
+		return policy
+
+
+def request_with_retry(
+	session: requests.Session, method: str, url: str, policy: RetryPolicy | None = None, client_stats: ClientStats | None = None,
+	limit: AdaptiveLimit | None = None, **kwargs,
+) -> requests.Response:
+	"""
+	Make a request, retrying connection errors and 5xx responses according to policy
+	(by default one shared by all callers that don't pass one, per server; see default_retry_policy).
+	Each attempt is recorded in client_stats, if given.
+	With a limit, each attempt holds one of its slots: not while backing off, and for stream=True responses, until the response is closed.
+	"""
+	import requests
+
+	policy = policy or default_retry_policy(url)
+	policy.before_request()
+	for i in range(policy.max_attempts):
+		trial = policy.before_attempt()
+		holding = limit is not None
+		if holding:
+			limit.acquire()
+		start = time.perf_counter()
 		try:
-			response = session.request(method, url, **kwargs)
-			if response.status_code >= 200 and response.status_code < 500:
+			try:
+				response = session.request(method, url, **kwargs)
+			except requests.RequestException:
+				if client_stats is not None:
+					client_stats.record(method, url, None, time.perf_counter() - start, 0, 0, retry=i > 0)
+				raise
+
+			stream = kwargs.get('stream', False)
+			if client_stats is not None:
+				# A streamed body is counted once it's been read, as far as it was read
+				body = response.request.body
+				bytes_sent = len(body) if body is not None else 0
+				bytes_received = 0 if stream else response.raw.tell()
+				client_stats.record(method, url, response.status_code, time.perf_counter() - start, bytes_sent, bytes_received, retry=i > 0)
+
+			if response.status_code < 500:
+				policy.succeeded(trial)
+				trial = False
+				if stream:
+					# The body is still to be read, which is part of the latency the limit should see
+					call_on_close(response, functools.partial(close_streamed, response, method, url, start, limit if holding else None, client_stats))
+				elif holding:
+					limit.release(time.perf_counter() - start, response.status_code == 429)
+				holding = False
 				return response
-			
+
 			response.raise_for_status()
-			return response
 		except requests.RequestException as e:
-			if i == 3:
+			policy.failed(trial)
+			trial = False
+			if holding:
+				limit.release(time.perf_counter() - start, True)
+				holding = False
+			if i == policy.max_attempts - 1 or not policy.allow_retry():
 				raise e
-			time.sleep(2 ** i)  # Exponential backoff
-			continue
+			time.sleep(policy.delay(i))  # Exponential backoff, with jitter so that clients don't retry in lockstep
+		finally:
+			if trial:
+				policy.end_trial()
+			if holding:
+				limit.release(time.perf_counter() - start, True)
 	
 	raise NotImplementedError() # Should not reach here
 
 
+def close_streamed(
+	response: requests.Response, method: str, url: str, start: float, limit: AdaptiveLimit | None, client_stats: ClientStats | None,
+):
+	"""
+	Account for a stream=True response once it's closed: count the bytes read from it, and release its slot of limit.
+	"""
+	if client_stats is not None:
+		client_stats.add_bytes_received(method, url, response.raw.tell())
+	if limit is not None:
+		limit.release(time.perf_counter() - start, response.status_code == 429)
+
+
+def call_on_close(response: requests.Response, callback):
+	"""
+	Call callback once, when response is closed (as `with response:` does when it's done).
+	"""
+	close = response.close
+	called = False
+
+	def closing():
+		nonlocal called
+		try:
+			close()
+		finally:
+			if not called:
+				called = True
+				callback()
+
+	response.close = closing
+
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, float('inf'))
+
+
+@dataclasses.dataclass
+class EndpointStats:
+	requests: int = 0  # Attempts, including retries
+	retries: int = 0
+	errors: int = 0  # Attempts that got no response
+	bytes_sent: int = 0
+	bytes_received: int = 0  # Body bytes actually read, before decompression
+	statuses: dict[int, int] = dataclasses.field(default_factory=dict)
+	latency_sum: float = 0.0
+	latency_buckets: list[int] = dataclasses.field(default_factory=lambda: [0] * len(LATENCY_BUCKETS))  # Not cumulative
+
+
+class ClientStats:
+	"""
+	Request statistics for TagMachineAPI, per endpoint (method and path, with image ids and tags replaced by placeholders):
+	attempts, retries, status codes, bytes sent and received, and a latency histogram.
+	Also the time search spends on the network versus in parse_search_response.
+	Clients without one don't pay for any of this.
+	Safe to share between threads and clients.
+	"""
+	def __init__(self):
+		self.endpoints: dict[str, EndpointStats] = {}
+		self.timers: dict[str, list[float]] = {}  # name -> [count, seconds]
+		self.lock = threading.Lock()
+		self.logging_stop: threading.Event | None = None
+
+	def record(self, method: str, url: str, status: int | None, latency: float, bytes_sent: int, bytes_received: int, retry: bool = False):
+		endpoint = endpoint_name(method, url)
+		bucket = bisect.bisect_left(LATENCY_BUCKETS, latency)
+		with self.lock:
+			stats = self._endpoint_stats(endpoint)
+			stats.requests += 1
+			stats.retries += retry
+			stats.bytes_sent += bytes_sent
+			stats.bytes_received += bytes_received
+			stats.latency_sum += latency
+			stats.latency_buckets[bucket] += 1
+			if status is None:
+				stats.errors += 1
+			else:
+				stats.statuses[status] = stats.statuses.get(status, 0) + 1
+
+	def add_bytes_received(self, method: str, url: str, n: int):
+		"""
+		Count n more bytes received from endpoint, for bodies that are read after their request was recorded.
+		"""
+		endpoint = endpoint_name(method, url)
+		with self.lock:
+			self._endpoint_stats(endpoint).bytes_received += n
+
+	def _endpoint_stats(self, endpoint: str) -> EndpointStats:
+		stats = self.endpoints.get(endpoint)
+		if stats is None:
+			stats = self.endpoints[endpoint] = EndpointStats()
+		return stats
+
+	def add_time(self, name: str, seconds: float):
+		with self.lock:
+			timer = self.timers.setdefault(name, [0, 0.0])
+			timer[0] += 1
+			timer[1] += seconds
+
+	def snapshot(self) -> dict:
+		"""
+		The statistics so far, as plain dicts. Latency buckets are cumulative, keyed by their upper bound in seconds.
+		"""
+		with self.lock:
+			return {
+				'endpoints': {
+					endpoint: {
+						'requests': stats.requests,
+						'retries': stats.retries,
+						'errors': stats.errors,
+						'bytes_sent': stats.bytes_sent,
+						'bytes_received': stats.bytes_received,
+						'statuses': dict(stats.statuses),
+						'latency_sum': stats.latency_sum,
+						'latency_buckets': dict(zip(LATENCY_BUCKETS, itertools.accumulate(stats.latency_buckets))),
+					}
+					for endpoint, stats in self.endpoints.items()
+				},
+				'timers': {name: {'count': count, 'seconds': seconds} for name, (count, seconds) in self.timers.items()},
+			}
+
+	def prometheus(self, prefix: str = 'tag_machine_client') -> str:
+		"""
+		The statistics in the Prometheus text exposition format.
+		"""
+		snapshot = self.snapshot()
+		endpoints = [(f'endpoint="{endpoint}"', stats) for endpoint, stats in snapshot['endpoints'].items()]
+		lines = [f'# TYPE {prefix}_requests_total counter']
+		for label, stats in endpoints:
+			lines += [f'{prefix}_requests_total{{{label},status="{status}"}} {count}' for status, count in stats['statuses'].items()]
+			if stats['errors']:
+				lines.append(f'{prefix}_requests_total{{{label},status="error"}} {stats["errors"]}')
+
+		for name in ('retries', 'bytes_sent', 'bytes_received'):
+			lines.append(f'# TYPE {prefix}_{name}_total counter')
+			lines += [f'{prefix}_{name}_total{{{label}}} {stats[name]}' for label, stats in endpoints]
+
+		lines.append(f'# TYPE {prefix}_request_duration_seconds histogram')
+		for label, stats in endpoints:
+			for bound, count in stats['latency_buckets'].items():
+				le = '+Inf' if bound == float('inf') else repr(bound)
+				lines.append(f'{prefix}_request_duration_seconds_bucket{{{label},le="{le}"}} {count}')
+			lines.append(f'{prefix}_request_duration_seconds_sum{{{label}}} {stats["latency_sum"]}')
+			lines.append(f'{prefix}_request_duration_seconds_count{{{label}}} {stats["requests"]}')
+
+		lines.append(f'# TYPE {prefix}_time_seconds_total counter')
+		lines += [f'{prefix}_time_seconds_total{{phase="{name}"}} {timer["seconds"]}' for name, timer in snapshot['timers'].items()]
+		return '\n'.join(lines) + '\n'
+
+	def summary(self) -> str:
+		"""
+		A one line summary, for logging.
+		"""
+		snapshot = self.snapshot()
+		parts = []
+		for endpoint, stats in snapshot['endpoints'].items():
+			mean_ms = 1000 * stats['latency_sum'] / stats['requests'] if stats['requests'] else 0.0
+			parts.append(f'{endpoint}: {stats["requests"]} req, {stats["retries"]} retries, {stats["errors"]} errors, {mean_ms:.1f}ms mean')
+		for name, timer in snapshot['timers'].items():
+			parts.append(f'{name}: {timer["seconds"]:.2f}s')
+		return '; '.join(parts)
+
+	def start_logging(self, interval: float = 60.0, logger: logging.Logger | None = None):
+		"""
+		Log summary() every interval seconds from a daemon thread, until stop_logging is called.
+		"""
+		self.stop_logging()
+		stop = self.logging_stop = threading.Event()
+		logger = logger or logging.getLogger(__name__)
+
+		def run():
+			while not stop.wait(interval):
+				logger.info(f'Client stats: {self.summary()}')
+
+		threading.Thread(target=run, daemon=True, name='tag-machine-stats').start()
+
+	def stop_logging(self):
+		if self.logging_stop is not None:
+			self.logging_stop.set()
+			self.logging_stop = None
+
+
+def endpoint_name(method: str, url: str) -> str:
+	"""
+	'GET /api/images/{image}/tags/{tag}' for 'GET http://host/api/images/123/tags/cat', so that requests group by endpoint.
+	"""
+	parts = urlsplit(url).path.strip('/').split('/')
+	for i in range(1, len(parts)):
+		if parts[i - 1] == 'images':
+			parts[i] = '{image}'
+		elif parts[i - 1] == 'tags':
+			parts[i] = '{tag}'
+	return f'{method} /' + '/'.join(parts)
+
+
+def chunk_by_length(ids: list[bytes | int], max_length: int) -> list[list[bytes | int]]:
+	"""
+	Split image ids or hashes into chunks that take at most max_length characters when written out comma separated.
+	"""
+	chunks = []
+	chunk, length = [], 0
+	for id in ids:
+		id_length = 2 * len(id) + 1 if isinstance(id, bytes) else len(str(id)) + 1
+		if chunk and length + id_length > max_length:
+			chunks.append(chunk)
+			chunk, length = [], 0
+		chunk.append(id)
+		length += id_length
+
+	if chunk:
+		chunks.append(chunk)
+
+	return chunks
+
+
 def is_valid_image(path: Path | str) -> tuple[int, int] | None:
 	"""
 	Check if the given image is valid, returning the image size if so, or None otherwise.
 	In our case, that means it can be loaded with PIL,
 	it's not animated, and it doesn't have an alpha channel.
 	"""
+	from PIL import Image
+
 	try:
 		image = Image.open(path)
 	except:  # noqa: E722
@@ -280,22 +1691,153 @@ def is_valid_image(path: Path | str) -> tuple[int, int] | None:
 	return image.size
 
 
-def parse_search_response(response: bytes) -> NDArray[np.uint32] | NDArray[np.uint8] | list[SearchResultImage]:
-	assert response[:3] == b"TMS", f"Expected TMSR header, got {response[:3]}"
-	has_ids = response[3] & (1 << 3) != 0
-	has_hashes = response[3] & (1 << 2) != 0
-	has_tags = response[3] & (1 << 1) != 0
-	has_attributes = response[3] & (1 << 0) != 0
+def parse_search_response(
+	response: bytes | bytearray | memoryview, columnar: bool = False, lazy: bool = False, attribute_keys: Iterable[str] | None = None,
+) -> NDArray[np.uint32] | NDArray[np.uint8] | list[SearchResultImage] | SearchResultColumns | LazySearchResults:
+	"""
+	Parse a TMS search response.
+	ID and hash only responses are returned as arrays that are views of `response`, without copying it.
+	Image responses are returned as a list of SearchResultImage, a SearchResultColumns if columnar is True,
+	or a LazySearchResults if lazy is True.
+	LazySearchResults supports len, indexing, slicing and iteration, and decodes each image's tags and attributes on first access.
+	If attribute_keys is given, other attributes are skipped without being decoded.
+	Repeated attribute keys and short values share a single str object across the response.
+	"""
+	if columnar and lazy:
+		raise ValueError('columnar and lazy are mutually exclusive')
+
+	if len(response) < 4:
+		raise ValueError(f'Search response is too short for a TMS header ({len(response)} bytes)')
+	assert response[:3] == b"TMS", f"Expected TMSR header, got {bytes(response[:3])}"
+	return parse_search_records(response[3], response, 4, len(response), columnar=columnar, lazy=lazy, attribute_keys=attribute_keys)
+
+
+def parse_search_records(
+	flags: int, data: bytes | bytearray | memoryview, start: int, end: int, columnar: bool = False, lazy: bool = False,
+	attribute_keys: Iterable[str] | None = None,
+) -> NDArray[np.uint32] | NDArray[np.uint8] | list[SearchResultImage] | SearchResultColumns | LazySearchResults:
+	"""
+	Parse the records in data[start:end], with the fields given by a TMS header's flags byte.
+	"""
+	import numpy as np
+
+	has_ids = flags & (1 << 3) != 0
+	has_hashes = flags & (1 << 2) != 0
+	has_tags = flags & (1 << 1) != 0
+	has_attributes = flags & (1 << 0) != 0
+	attribute_keys = set(attribute_keys) if attribute_keys is not None else None
 
 	if has_ids and not has_hashes and not has_tags and not has_attributes:
 		# ID response
-		return np.frombuffer(response[4:], dtype=np.uint32)
+		if (end - start) % 4 != 0:
+			raise ValueError(f'ID response size {end - start} is not a multiple of 4')
+		ids = np.frombuffer(data, dtype=np.uint32, count=(end - start) // 4, offset=start)
+		return SearchResultColumns(num_images=len(ids), ids=ids) if columnar else ids
 	elif has_hashes and not has_ids and not has_tags and not has_attributes:
 		# Hash response
-		return np.frombuffer(response[4:], dtype=np.uint8).reshape(-1, 32)
+		if (end - start) % 32 != 0:
+			raise ValueError(f'Hash response size {end - start} is not a multiple of 32')
+		hashes = np.frombuffer(data, dtype=np.uint8, count=end - start, offset=start).reshape(-1, 32)
+		return SearchResultColumns(num_images=len(hashes), hashes=hashes) if columnar else hashes
+	elif lazy:
+		return search_parser().parse_search_response_lazy(has_ids, has_hashes, has_tags, has_attributes, data, start, end, attribute_keys)
+	elif columnar:
+		columns = search_parser().parse_search_response_columns(has_ids, has_hashes, has_tags, has_attributes, data, start, end, attribute_keys)
+		return SearchResultColumns(**columns)
 	else:
 		# Image response
-		return parse_search_response_images(has_ids, has_hashes, has_tags, has_attributes, response[4:])
+		return search_parser().parse_search_response_images(has_ids, has_hashes, has_tags, has_attributes, data, start, end, attribute_keys)
+
+
+def iter_search_response(
+	chunks: Iterable[bytes], columnar: bool = False, batch_size: int = 2**16, attribute_keys: Iterable[str] | None = None,
+) -> Iterator[SearchResultImage | SearchResultColumns | np.ndarray]:
+	"""
+	Parse a TMS search response that arrives as a sequence of byte chunks.
+	Records split across chunks are carried over until the rest of them arrives.
+	Image responses yield each SearchResultImage as soon as it's complete, or SearchResultColumns of batch_size images if columnar is True.
+	ID and hash only responses yield arrays (or SearchResultColumns) of batch_size entries.
+	The last batch may be smaller.
+	"""
+	chunks = iter(chunks)
+	buffer = bytearray()
+	while len(buffer) < 4:
+		chunk = next(chunks, None)
+		if chunk is None:
+			raise ValueError('Search response ended before the header')
+		buffer += chunk
+
+	assert buffer[:3] == b"TMS", f"Expected TMS header, got {bytes(buffer[:3])}"
+	flags = buffer[3]
+	has_ids = flags & (1 << 3) != 0
+	has_hashes = flags & (1 << 2) != 0
+	has_tags = flags & (1 << 1) != 0
+	has_attributes = flags & (1 << 0) != 0
+	del buffer[:4]
+
+	# ID and hash responses are fixed size arrays, so they can be split without scanning
+	if has_ids and not has_hashes and not has_tags and not has_attributes:
+		record_size = 4
+	elif has_hashes and not has_ids and not has_tags and not has_attributes:
+		record_size = 32
+	else:
+		record_size = None
+
+	stream_images = record_size is None and not columnar
+	parser = search_parser()
+	attribute_keys = set(attribute_keys) if attribute_keys is not None else None
+
+	# Complete records (and their size) at the start of the buffer that earlier scans found, so that each byte is only scanned once
+	# while a batch builds up over many chunks
+	scanned = [0, 0]
+
+	def take(max_records: int) -> tuple[int, int]:
+		if record_size is not None:
+			num_records = min(len(buffer) // record_size, max_records)
+			return num_records, num_records * record_size
+
+		num_records, num_bytes = scanned
+		if num_records < max_records:
+			with memoryview(buffer) as view:
+				more_records, more_bytes = parser.scan_complete_records(
+					has_ids, has_hashes, has_tags, has_attributes, view[num_bytes:], max_records - num_records,
+				)
+			num_records += more_records
+			num_bytes += more_bytes
+			scanned[:] = num_records, num_bytes
+		return num_records, num_bytes
+
+	def parse(num_bytes: int):
+		# ID and hash arrays would be views of the buffer, so they get a copy of their part of it
+		data = buffer[:num_bytes] if record_size is not None else buffer
+		result = parse_search_records(flags, data, 0, num_bytes, columnar=columnar, attribute_keys=attribute_keys)
+		del buffer[:num_bytes]
+		scanned[:] = 0, 0
+		return result
+
+	for chunk in itertools.chain([b''], chunks):
+		buffer += chunk
+
+		while True:
+			num_records, num_bytes = take(batch_size)
+			# Batches are only emitted once full, except for the last one
+			if num_records == 0 or (num_records < batch_size and not stream_images):
+				break
+
+			if stream_images:
+				yield from parse(num_bytes)
+			else:
+				yield parse(num_bytes)
+
+	while len(buffer) > 0:
+		num_records, num_bytes = take(batch_size)
+		if num_records == 0:
+			raise ValueError(f'Search response ended partway through a record ({len(buffer)} bytes left over)')
+
+		if stream_images:
+			yield from parse(num_bytes)
+		else:
+			yield parse(num_bytes)
 
 
 # def parse_search_response(response: SearchResultResponse) -> np.ndarray | list[bytes] | list[SearchResultImage]:
@@ -372,6 +1914,8 @@ class DatabaseData:
 	fetch_limit: int = 1000000
 
 	def __init__(self, username: str, login_key: bytes):
+		import requests
+
 		self.tags = []
 		self.tag_to_id = {}
 		self.id_to_tag = {}
@@ -388,6 +1932,10 @@ class DatabaseData:
 		self.user_token = user_token
 	
 	def fetch_tags(self):
+		import requests
+
+		from tag_machine_api.models import DBTag
+
 		response = requests.get(API_URL + '/api/tags', headers={'Authorization': f'Bearer {self.user_token}'})
 		response.raise_for_status()
 		tags = response.json()
@@ -396,6 +1944,8 @@ class DatabaseData:
 		self.id_to_tag = {tag.id: tag.name for tag in self.tags}
 	
 	def fetch_images(self, with_blame: bool = False):
+		import requests
+
 		while True:
 			if with_blame:
 				response = requests.get(API_URL + '/api/list_images_with_blame', params={'min_id': max(self.images.keys()) + 1 if len(self.images) > 0 else 0, 'limit': self.fetch_limit}, headers={'Authorization': f'Bearer {self.user_token}'})
@@ -423,6 +1973,8 @@ class DatabaseData:
 		self.images_sorted_by_id = sorted(self.images.values(), key=lambda image: image.id)
 	
 	def fetch_image_batches(self, with_blame: bool = False, batch_size: int = 2**16) -> Generator[DBImage, None, None]:
+		import requests
+
 		while True:
 			if with_blame:
 				response = requests.get(API_URL + '/api/list_images_with_blame', params={'min_id': max(self.images.keys()) + 1 if len(self.images) > 0 else 0, 'limit': batch_size}, headers={'Authorization': f'Bearer {self.user_token}'})
@@ -451,6 +2003,8 @@ class DatabaseData:
 		self.images_sorted_by_id = sorted(self.images.values(), key=lambda image: image.id)
 	
 	def search_images_batched(self, operator: dict, batch_size: int = 2**16) -> Generator[DBImage, None, None]:
+		import requests
+
 		min_id = 0
 
 		while True:
@@ -0,0 +1,182 @@
+"""
+Asyncio client for the tag machine API.
+Requires aiohttp (pip install tag_machine_api[async]).
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+from collections.abc import Iterable
+from typing import TYPE_CHECKING
+
+import aiohttp
+
+from tag_machine_api import DEFAULT_API_URL, CircuitOpen, DBImage, RetryPolicy, SearchResultColumns, SearchResultImage, parse_search_response
+
+if TYPE_CHECKING:
+	from typing import Self
+
+	import numpy as np
+
+	from tag_machine_api import LazySearchResults
+	from tag_machine_api.models import DBTag
+
+
+class AsyncCircuitOpenError(CircuitOpen, aiohttp.ClientConnectionError):
+	"""
+	Raised by AsyncTagMachineAPI instead of making a request while the server is considered down.
+	"""
+
+
+class AsyncTagMachineAPI:
+	"""
+	Asyncio version of TagMachineAPI, for issuing many requests at once.
+	At most `concurrency` requests are in flight at a time, over a pool of reused keep-alive connections.
+	Requests are retried according to retry_policy (see RetryPolicy).
+	Must be closed (or used as an async context manager) when done.
+	"""
+	def __init__(self, token: bytes | str | None = None, url: str | None = None, concurrency: int = 32, retry_policy: RetryPolicy | None = None):
+		if isinstance(token, bytes):
+			token = token.hex()
+
+		token = token or os.environ.get('TAG_MACHINE_TOKEN')
+		if token is None:
+			raise ValueError('Token must be provided either as an argument or in the TAG_MACHINE_TOKEN environment variable')
+
+		self.url = url or os.environ.get('TAG_MACHINE_URL') or DEFAULT_API_URL
+		self.token = token
+		self.concurrency = concurrency
+		self.semaphore = asyncio.Semaphore(concurrency)
+		self.retry_policy = retry_policy or RetryPolicy()
+		self.session: aiohttp.ClientSession | None = None
+
+	async def __aenter__(self) -> Self:
+		return self
+
+	async def __aexit__(self, *exc_info):
+		await self.close()
+
+	async def close(self):
+		if self.session is not None:
+			await self.session.close()
+			self.session = None
+
+	def _get_session(self) -> aiohttp.ClientSession:
+		# Created on first use, since aiohttp sessions have to be created inside the event loop
+		if self.session is None:
+			connector = aiohttp.TCPConnector(limit=self.concurrency)
+			self.session = aiohttp.ClientSession(connector=connector, headers={'Authorization': f'Bearer {self.token}'})
+		return self.session
+
+	async def request(self, method: str, path: str, ok_statuses: tuple[int, ...] = (), timeout: float = 30, **kwargs) -> tuple[int, bytes]:
+		"""
+		Make a request, retrying connection errors and 5xx responses according to the retry policy.
+		Returns the status and body. Other error responses, unless listed in ok_statuses, raise aiohttp.ClientResponseError.
+		"""
+		session = self._get_session()
+		policy = self.retry_policy
+		client_timeout = aiohttp.ClientTimeout(total=timeout)
+		policy.before_request()
+		for i in range(policy.max_attempts):
+			trial = policy.before_attempt(AsyncCircuitOpenError)
+			try:
+				async with self.semaphore, session.request(method, f'{self.url}{path}', timeout=client_timeout, **kwargs) as r:
+					if r.status >= 500:
+						r.raise_for_status()
+					policy.succeeded(trial)
+					trial = False
+					if r.status not in ok_statuses:
+						r.raise_for_status()
+					return r.status, await r.read()
+			# asyncio.TimeoutError is only an alias of TimeoutError from Python 3.11
+			except (aiohttp.ClientError, asyncio.TimeoutError) as e:  # noqa: UP041
+				if isinstance(e, aiohttp.ClientResponseError) and e.status < 500:
+					raise
+				policy.failed(trial)
+				trial = False
+				if i == policy.max_attempts - 1 or not policy.allow_retry():
+					raise
+			finally:
+				# Cancelled, or failed some other way
+				if trial:
+					policy.end_trial()
+
+			# Back off without holding a slot
+			await asyncio.sleep(policy.delay(i))
+
+		raise NotImplementedError() # Should not reach here
+
+	async def get_image_metadata(self, id: bytes | int) -> DBImage:
+		"""
+		Get an image's metadata.
+		"""
+		_, body = await self.request('GET', f'/api/images/{id_to_str(id)}/metadata')
+		metadata = json.loads(body)
+		# JSON object keys are always strings
+		metadata['tags'] = {int(tag): user_id for tag, user_id in metadata['tags'].items()}
+		return DBImage(**metadata)
+
+	async def read_image(self, id: bytes | int) -> bytes:
+		"""
+		Read an image's data.
+		"""
+		_, body = await self.request('GET', f'/api/images/{id_to_str(id)}', timeout=60)
+		return body
+
+	async def tag_image(self, id: bytes | int, tag: str | int):
+		"""
+		Add a tag to an image.
+		"""
+		await self.request('POST', f'/api/images/{id_to_str(id)}/tags/{tag}')
+
+	async def untag_image(self, id: bytes | int, tag: str | int):
+		"""
+		Remove a tag from an image.
+		"""
+		await self.request('DELETE', f'/api/images/{id_to_str(id)}/tags/{tag}')
+
+	async def add_image_attribute(self, id: bytes | int, key: str | int, value: str, singular: bool) -> bool:
+		"""
+		Add an attribute to an image. Returns False if the attribute already exists.
+		"""
+		body = {'key': key, 'value': value, 'singular': singular}
+		status, _ = await self.request('POST', f'/api/images/{id_to_str(id)}/attributes', ok_statuses=(409,), json=body)
+		return status != 409
+
+	async def remove_image_attribute(self, id: bytes | int, key: str | int, value: str):
+		"""
+		Remove an attribute from an image.
+		"""
+		await self.request('DELETE', f'/api/images/{id_to_str(id)}/attributes', json={'key': key, 'value': value})
+
+	async def add_image(self, image_hash: bytes) -> bool:
+		"""
+		Add an image to the database. Returns False if the image already exists.
+		"""
+		status, _ = await self.request('POST', f'/api/images/{image_hash.hex()}', ok_statuses=(409,))
+		return status != 409
+
+	async def fetch_tags(self) -> list[DBTag]:
+		from tag_machine_api.models import DBTag
+
+		_, body = await self.request('GET', '/api/tags')
+		return [DBTag(**tag) for tag in json.loads(body)]
+
+	async def search(
+		self, query: str, select: list[str], columnar: bool = False, lazy: bool = False, attribute_keys: Iterable[str] | None = None,
+	) -> np.ndarray | list[SearchResultImage] | SearchResultColumns | LazySearchResults:
+		"""
+		Search images in the database. See TagMachineAPI.search.
+		The response is parsed in a worker thread so that large results don't stall the event loop.
+		"""
+		params = {
+			'select': ','.join(select),
+			'query': query,
+		}
+		_, body = await self.request('GET', '/api/search/images', params=params, timeout=120)
+		return await asyncio.to_thread(parse_search_response, body, columnar=columnar, lazy=lazy, attribute_keys=attribute_keys)
+
+
+def id_to_str(id: bytes | int) -> str:
+	return id.hex() if isinstance(id, bytes) else str(id)
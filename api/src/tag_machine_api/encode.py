@@ -0,0 +1,69 @@
+"""
+Reference encoder for the TMS search response format.
+
+A response is b"TMS", a flags byte saying which fields each record has (ids = bit 3, hashes = bit 2, tags = bit 1,
+attributes = bit 0), then the records back to back. Each record has, in order and if selected:
+  id          u32, little-endian
+  hash        32 bytes
+  tags        VLI count, then (tag, user_id) VLI pairs
+  attributes  VLI key count, then for each key: string, VLI value count, then (string value, VLI user_id) pairs
+A VLI is a single byte below 0xfd, or 0xfd/0xfe/0xff followed by a little-endian u16/u32/u64.
+A string is a VLI byte length followed by UTF-8.
+"""
+import struct
+from collections.abc import Iterable
+
+
+def encode_vli(value: int) -> bytes:
+	if value < 0xfd:
+		return bytes([value])
+	elif value <= 0xffff:
+		return b'\xfd' + struct.pack('<H', value)
+	elif value <= 0xffffffff:
+		return b'\xfe' + struct.pack('<I', value)
+	else:
+		return b'\xff' + struct.pack('<Q', value)
+
+
+def encode_string(value: str) -> bytes:
+	data = value.encode('utf-8')
+	return encode_vli(len(data)) + data
+
+
+def encode_flags(has_ids: bool, has_hashes: bool, has_tags: bool, has_attributes: bool) -> int:
+	return (has_ids << 3) | (has_hashes << 2) | (has_tags << 1) | int(has_attributes)
+
+
+def flags_for_select(select: Iterable[str]) -> tuple[bool, bool, bool, bool]:
+	"""(has_ids, has_hashes, has_tags, has_attributes) for a search's select list"""
+	select = set(select)
+	return ('id' in select, 'hash' in select, 'tags' in select, 'attributes' in select)
+
+
+def encode_record(flags: tuple[bool, bool, bool, bool], id: int, hash: bytes, tags: dict[int, int], attributes: dict[str, dict[str, int]]) -> bytes:
+	has_ids, has_hashes, has_tags, has_attributes = flags
+	parts = []
+
+	if has_ids:
+		parts.append(struct.pack('<I', id))
+
+	if has_hashes:
+		assert len(hash) == 32, f'Expected a 32 byte hash, got {len(hash)} bytes'
+		parts.append(hash)
+
+	if has_tags:
+		parts.append(encode_vli(len(tags)))
+		parts.extend(encode_vli(tag) + encode_vli(user_id) for tag, user_id in tags.items())
+
+	if has_attributes:
+		parts.append(encode_vli(len(attributes)))
+		for key, values in attributes.items():
+			parts.append(encode_string(key) + encode_vli(len(values)))
+			parts.extend(encode_string(value) + encode_vli(user_id) for value, user_id in values.items())
+
+	return b''.join(parts)
+
+
+def encode_search_response(flags: tuple[bool, bool, bool, bool], records: Iterable[bytes]) -> bytes:
+	"""A complete response from records encoded with encode_record"""
+	return b'TMS' + bytes([encode_flags(*flags)]) + b''.join(records)
@@ -0,0 +1,12 @@
+"""
+Exceptions based on requests' exceptions, kept out of tag_machine_api's import so that requests is only loaded when it's used.
+"""
+import requests
+
+from tag_machine_api import CircuitOpen
+
+
+class CircuitOpenError(CircuitOpen, requests.ConnectionError):
+	"""
+	Raised by TagMachineAPI instead of making a request while the server is considered down.
+	"""
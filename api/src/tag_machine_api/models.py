@@ -0,0 +1,21 @@
+"""
+Pydantic models of API responses, kept out of tag_machine_api's import so that pydantic is only loaded when they're used.
+"""
+from pydantic import BaseModel
+
+
+class DBTag(BaseModel):
+	id: int
+	name: str
+	active: bool
+
+
+class DBLog(BaseModel):
+	id: int
+	timestamp: int
+	user_id: int
+	action: str
+	image_hash: str | None
+	tag: str | None
+	attribute_key: str | None
+	attribute_value: str | None
@@ -0,0 +1,402 @@
+"""
+Pure Python decoder for TMS search responses, with the same interface as the compiled tag_machine_api.parse extension.
+Used automatically when the extension isn't available.
+Fixed width fields, and tag lists whose VLIs are all single bytes (the common case), are decoded with NumPy.
+Everything else is decoded one value at a time.
+"""
+import bisect
+from collections.abc import Iterator
+
+import numpy as np
+
+# Same interning policy as the extension
+MAX_INTERNED_VALUE_LEN = 32
+MAX_INTERNED_STRINGS = 1 << 16
+
+
+class _UnexpectedEof(OSError):
+	pass
+
+
+class _Decoder:
+	"""Reads the fields of records in a response body."""
+	def __init__(
+		self, has_ids: bool, has_hashes: bool, has_tags: bool, has_attributes: bool, data, start: int = 0, end: int | None = None,
+		attribute_keys: set[str] | None = None,
+	):
+		view = memoryview(data).cast('B')
+		end = len(view) if end is None else end
+		if not 0 <= start <= end <= len(view):
+			raise IndexError('start and end must be within the buffer')
+
+		self.has_ids = has_ids
+		self.has_hashes = has_hashes
+		self.has_tags = has_tags
+		self.has_attributes = has_attributes
+		self.data = view[start:end]
+		self.array = np.frombuffer(self.data, dtype=np.uint8)
+		self.attribute_keys = attribute_keys
+		self.fixed_len = (4 if has_ids else 0) + (32 if has_hashes else 0)
+		self.strings: dict[str, str] = {}
+
+		if not (has_ids or has_hashes or has_tags or has_attributes) and len(self.data) > 0:
+			raise OSError('Response has data but no fields')
+
+		# Positions of every byte that could start a multi-byte VLI.
+		# A run of VLIs without any of these is all single byte VLIs, and can be read as plain bytes.
+		self.prefix_positions = np.flatnonzero(self.array >= 0xfd).tolist()
+
+	def single_byte_run(self, start: int, end: int) -> bool:
+		i = bisect.bisect_left(self.prefix_positions, start)
+		return i == len(self.prefix_positions) or self.prefix_positions[i] >= end
+
+	def check(self, end: int):
+		if end > len(self.data):
+			raise _UnexpectedEof('Record extends past the end of the response')
+
+	def read_vli(self, pos: int) -> tuple[int, int]:
+		self.check(pos + 1)
+		byte = self.data[pos]
+		if byte < 0xfd:
+			return byte, pos + 1
+
+		size = {0xfd: 2, 0xfe: 4, 0xff: 8}[byte]
+		self.check(pos + 1 + size)
+		return int.from_bytes(self.data[pos + 1:pos + 1 + size], 'little'), pos + 1 + size
+
+	def read_str(self, pos: int) -> tuple[str, int]:
+		length, pos = self.read_vli(pos)
+		self.check(pos + length)
+		try:
+			return str(self.data[pos:pos + length], 'utf-8'), pos + length
+		except UnicodeDecodeError as e:
+			raise OSError(str(e)) from e
+
+	def intern(self, s: str, is_key: bool) -> str:
+		interned = self.strings.get(s)
+		if interned is not None:
+			return interned
+		if len(self.strings) < MAX_INTERNED_STRINGS and (is_key or len(s.encode()) <= MAX_INTERNED_VALUE_LEN):
+			self.strings[s] = s
+		return s
+
+	def read_tags(self, pos: int) -> tuple[int, list[int] | None, int]:
+		"""
+		Read a tag list, returning (start, values, end).
+		values is None if every VLI in it is a single byte, in which case the values are the bytes data[start:end].
+		Otherwise it's the flattened (tag, user_id) values.
+		"""
+		num_tags, pos = self.read_vli(pos)
+		end = pos + 2 * num_tags
+		if end <= len(self.data) and self.single_byte_run(pos, end):
+			return pos, None, end
+
+		# Inlined, since this is where the fallback spends most of its time
+		start = pos
+		data = self.data
+		values = []
+		append = values.append
+		try:
+			for _ in range(2 * num_tags):
+				byte = data[pos]
+				if byte < 0xfd:
+					append(byte)
+					pos += 1
+				elif byte == 0xfd:
+					append(data[pos + 1] | data[pos + 2] << 8)
+					pos += 3
+				else:
+					value, pos = self.read_vli(pos)
+					append(value)
+		except IndexError:
+			raise _UnexpectedEof('Record extends past the end of the response') from None
+		return start, values, pos
+
+	def skip_tags(self, pos: int) -> int:
+		return self.read_tags(pos)[2]
+
+	def read_attributes(self, pos: int) -> tuple[list[tuple[str, list[tuple[str, int]]]], int]:
+		num_keys, pos = self.read_vli(pos)
+		attributes = []
+		for _ in range(num_keys):
+			key, pos = self.read_str(pos)
+			num_values, pos = self.read_vli(pos)
+
+			if self.attribute_keys is not None and key not in self.attribute_keys:
+				for _ in range(num_values):
+					length, pos = self.read_vli(pos)
+					self.check(pos + length)
+					_, pos = self.read_vli(pos + length)
+				continue
+
+			values = []
+			for _ in range(num_values):
+				value, pos = self.read_str(pos)
+				user_id, pos = self.read_vli(pos)
+				values.append((self.intern(value, False), user_id))
+			attributes.append((self.intern(key, True), values))
+		return attributes, pos
+
+	def skip_attributes(self, pos: int) -> int:
+		num_keys, pos = self.read_vli(pos)
+		for _ in range(num_keys):
+			length, pos = self.read_vli(pos)
+			self.check(pos + length)
+			num_values, pos = self.read_vli(pos + length)
+			for _ in range(num_values):
+				length, pos = self.read_vli(pos)
+				self.check(pos + length)
+				_, pos = self.read_vli(pos + length)
+		return pos
+
+	def skip_record(self, pos: int) -> int:
+		pos += self.fixed_len
+		self.check(pos)
+		if self.has_tags:
+			pos = self.skip_tags(pos)
+		if self.has_attributes:
+			pos = self.skip_attributes(pos)
+		return pos
+
+	def index(self) -> list[int]:
+		"""Where each record starts, followed by the end of the last record"""
+		offsets = [0]
+		while offsets[-1] < len(self.data):
+			offsets.append(self.skip_record(offsets[-1]))
+		return offsets
+
+	def decode(self) -> '_Records':
+		records = _Records()
+		fast_starts, fast_counts, fast_outputs = [], [], []
+		slow_tags = []
+		num_values = 0
+		pos = 0
+
+		while pos < len(self.data):
+			records.starts.append(pos)
+			pos += self.fixed_len
+			self.check(pos)
+
+			if self.has_tags:
+				start, values, pos = self.read_tags(pos)
+				if values is None:
+					fast_starts.append(start)
+					fast_counts.append(pos - start)
+					fast_outputs.append(num_values)
+					num_values += pos - start
+				else:
+					slow_tags.append((num_values, values))
+					num_values += len(values)
+				records.tag_offsets.append(num_values // 2)
+
+			if self.has_attributes:
+				attributes, pos = self.read_attributes(pos)
+				records.attributes.append(attributes)
+
+		starts = np.array(records.starts, dtype=np.int64)
+		if self.has_ids:
+			records.ids = self.gather(starts, 4).view('<u4').reshape(-1)
+		if self.has_hashes:
+			records.hashes = self.gather(starts + (4 if self.has_ids else 0), 32)
+
+		if self.has_tags:
+			# Single byte runs are copied in one vectorized gather, the rest one list at a time
+			tag_values = np.empty(num_values, dtype=np.uint64)
+			counts = np.array(fast_counts, dtype=np.int64)
+			within = np.arange(counts.sum(), dtype=np.int64) - np.repeat(np.cumsum(counts) - counts, counts)
+			outputs = np.repeat(np.array(fast_outputs, dtype=np.int64), counts) + within
+			tag_values[outputs] = self.array[np.repeat(np.array(fast_starts, dtype=np.int64), counts) + within]
+			for output, values in slow_tags:
+				tag_values[output:output + len(values)] = values
+			records.tag_values = tag_values
+
+		return records
+
+	def gather(self, starts: np.ndarray, width: int) -> np.ndarray:
+		"""(len(starts), width) array of the bytes at each start"""
+		return self.array[starts[:, None] + np.arange(width)]
+
+
+class _Records:
+	"""Fields of decoded records. Tags are flattened (tag, user_id) values, with record i's in [2 * tag_offsets[i], 2 * tag_offsets[i + 1])."""
+	def __init__(self):
+		self.starts: list[int] = []
+		self.ids: np.ndarray | None = None
+		self.hashes: np.ndarray | None = None
+		self.tag_offsets: list[int] = [0]
+		self.tag_values: np.ndarray | None = None
+		self.attributes: list[list[tuple[str, list[tuple[str, int]]]]] = []
+
+
+def _attributes_to_dict(attributes: list[tuple[str, list[tuple[str, int]]]]) -> dict[str, dict[str, int]]:
+	return {key: dict(values) for key, values in attributes}
+
+
+def parse_search_response_images(
+	has_ids: bool, has_hashes: bool, has_tags: bool, has_attributes: bool, data, start: int = 0, end: int | None = None,
+	attribute_keys: set[str] | None = None,
+) -> list:
+	from tag_machine_api import SearchResultImage
+
+	records = _Decoder(has_ids, has_hashes, has_tags, has_attributes, data, start, end, attribute_keys).decode()
+	num_images = len(records.starts)
+	ids = records.ids.tolist() if records.ids is not None else [None] * num_images
+	hashes = [bytes(h) for h in records.hashes] if records.hashes is not None else [None] * num_images
+
+	if records.tag_values is not None:
+		packed = records.tag_values.astype('<u8').tobytes()
+		packed_tags = [packed[16 * a:16 * b] for a, b in zip(records.tag_offsets, records.tag_offsets[1:])]
+	else:
+		packed_tags = [None] * num_images
+
+	attributes = [_attributes_to_dict(a) for a in records.attributes] if has_attributes else [None] * num_images
+
+	return [SearchResultImage(*fields) for fields in zip(ids, hashes, packed_tags, attributes)]
+
+
+def parse_search_response_columns(
+	has_ids: bool, has_hashes: bool, has_tags: bool, has_attributes: bool, data, start: int = 0, end: int | None = None,
+	attribute_keys: set[str] | None = None,
+) -> dict:
+	records = _Decoder(has_ids, has_hashes, has_tags, has_attributes, data, start, end, attribute_keys).decode()
+	num_images = len(records.starts)
+	result: dict = {'num_images': num_images}
+
+	if has_ids:
+		result['ids'] = records.ids
+	if has_hashes:
+		result['hashes'] = records.hashes
+
+	if has_tags:
+		result['tag_offsets'] = np.array(records.tag_offsets, dtype=np.uint64)
+		# Columns are uint32, like the compiled parser's
+		if len(records.tag_values) > 0 and records.tag_values.max() > 0xffffffff:
+			raise OSError('Tag value does not fit in 32 bits')
+		result['tag_ids'] = records.tag_values[0::2].astype(np.uint32)
+		result['tag_blame'] = records.tag_values[1::2].astype(np.uint32)
+
+	if has_attributes:
+		string_ids: dict[str, int] = {}
+		offsets, keys, values, blame = [0], [], [], []
+		for attributes in records.attributes:
+			for key, key_values in attributes:
+				key_id = string_ids.setdefault(key, len(string_ids))
+				for value, user_id in key_values:
+					keys.append(key_id)
+					values.append(string_ids.setdefault(value, len(string_ids)))
+					blame.append(user_id)
+			offsets.append(len(keys))
+
+		result['attribute_offsets'] = np.array(offsets, dtype=np.uint64)
+		result['attribute_keys'] = np.array(keys, dtype=np.uint32)
+		result['attribute_values'] = np.array(values, dtype=np.uint32)
+		result['attribute_blame'] = np.array(blame, dtype=np.uint32)
+		result['strings'] = list(string_ids)
+
+	return result
+
+
+def scan_complete_records(has_ids: bool, has_hashes: bool, has_tags: bool, has_attributes: bool, data, max_records: int) -> tuple[int, int]:
+	decoder = _Decoder(has_ids, has_hashes, has_tags, has_attributes, data)
+	num_records = 0
+	end = 0
+
+	while num_records < max_records and end < len(decoder.data):
+		try:
+			end = decoder.skip_record(end)
+		except _UnexpectedEof:
+			break
+		num_records += 1
+
+	return num_records, end
+
+
+class LazySearchResults:
+	"""Search results that keep the raw response and decode each image only when it is accessed."""
+	def __init__(self, decoder: _Decoder, offsets: list[int], records: range):
+		self._decoder = decoder
+		self._offsets = offsets
+		self._records = records
+
+	def __len__(self) -> int:
+		return len(self._records)
+
+	def __getitem__(self, index: int | slice):
+		if isinstance(index, slice):
+			return LazySearchResults(self._decoder, self._offsets, self._records[index])
+
+		try:
+			record = self._records[index]
+		except IndexError:
+			raise IndexError('search result index out of range') from None
+		return LazySearchResultImage(self._decoder, self._offsets[record], self._offsets[record + 1])
+
+	def __iter__(self) -> Iterator['LazySearchResultImage']:
+		for record in self._records:
+			yield LazySearchResultImage(self._decoder, self._offsets[record], self._offsets[record + 1])
+
+	def __repr__(self) -> str:
+		return f'<LazySearchResults of {len(self)} images>'
+
+
+class LazySearchResultImage:
+	"""A single image of LazySearchResults. Tags and attributes are decoded on first access and then cached."""
+	__slots__ = ('_attributes', '_decoder', '_end', '_start', '_tags')
+
+	def __init__(self, decoder: _Decoder, start: int, end: int):
+		self._decoder = decoder
+		self._start = start
+		self._end = end
+		self._tags = None
+		self._attributes = None
+
+	@property
+	def id(self) -> int | None:
+		if not self._decoder.has_ids:
+			return None
+		return int.from_bytes(self._decoder.data[self._start:self._start + 4], 'little')
+
+	@property
+	def hash(self) -> bytes | None:
+		if not self._decoder.has_hashes:
+			return None
+		start = self._start + (4 if self._decoder.has_ids else 0)
+		return bytes(self._decoder.data[start:start + 32])
+
+	@property
+	def tags(self) -> dict[int, int] | None:
+		if not self._decoder.has_tags:
+			return None
+		if self._tags is None:
+			start, values, end = self._decoder.read_tags(self._start + self._decoder.fixed_len)
+			if values is None:
+				values = self._decoder.data[start:end].tolist()
+			self._tags = dict(zip(values[0::2], values[1::2]))
+		return self._tags
+
+	@property
+	def attributes(self) -> dict[str, dict[str, int]] | None:
+		if not self._decoder.has_attributes:
+			return None
+		if self._attributes is None:
+			pos = self._start + self._decoder.fixed_len
+			if self._decoder.has_tags:
+				pos = self._decoder.skip_tags(pos)
+			self._attributes = _attributes_to_dict(self._decoder.read_attributes(pos)[0])
+		return self._attributes
+
+	def __repr__(self) -> str:
+		if self._decoder.has_ids:
+			return f'<LazySearchResultImage id={self.id}>'
+		elif self._decoder.has_hashes:
+			return f'<LazySearchResultImage hash={self.hash.hex()}>'
+		return '<LazySearchResultImage>'
+
+
+def parse_search_response_lazy(
+	has_ids: bool, has_hashes: bool, has_tags: bool, has_attributes: bool, data, start: int = 0, end: int | None = None,
+	attribute_keys: set[str] | None = None,
+) -> LazySearchResults:
+	decoder = _Decoder(has_ids, has_hashes, has_tags, has_attributes, data, start, end, attribute_keys)
+	offsets = decoder.index()
+	return LazySearchResults(decoder, offsets, range(len(offsets) - 1))
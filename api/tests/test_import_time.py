@@ -0,0 +1,45 @@
+"""
+Import time regression tests: `import tag_machine_api` mustn't load requests, pydantic, numpy or PIL, which the client
+imports when they're first needed (see benchmarks/bench_import.py for a fuller report).
+"""
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+SRC = Path(__file__).resolve().parents[1] / 'src'
+DEFERRED = ('requests', 'pydantic', 'numpy', 'PIL')
+MAX_IMPORT_MS = 250  # Generous, it's about 60ms; this catches a heavy import creeping back in, not small regressions
+
+
+def import_times(code: str) -> dict[str, int]:
+	"""
+	module -> cumulative microseconds, for everything `code` imported in a fresh interpreter, from `python -X importtime`
+	"""
+	env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [str(SRC), os.environ.get('PYTHONPATH')])))
+	result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], capture_output=True, text=True, env=env, check=True)
+	times = {}
+	for line in result.stderr.splitlines():
+		if line.startswith('import time:') and 'self [us]' not in line:
+			_, cumulative_us, name = line.removeprefix('import time:').split('|')
+			times[name.strip()] = int(cumulative_us)
+	return times
+
+
+def test_import_defers_heavy_modules():
+	times = import_times('import tag_machine_api')
+	assert 'tag_machine_api' in times
+	assert sorted(name for name in times if name.split('.')[0] in DEFERRED) == []
+
+
+def test_import_time():
+	# The first run may include compiling the package to bytecode
+	import_times('import tag_machine_api')
+	best_ms = min(import_times('import tag_machine_api')['tag_machine_api'] for _ in range(3)) / 1000
+	assert best_ms < MAX_IMPORT_MS
+
+
+def test_lazy_names_still_import():
+	times = import_times('import tag_machine_api; tag_machine_api.DBTag, tag_machine_api.CircuitOpenError, tag_machine_api.DBImage')
+	assert 'pydantic' in times
+	assert 'numpy' not in times
@@ -0,0 +1,256 @@
+"""
+Parity tests for the search response decoders: the pure Python fallback, and the Rust extension when it's built.
+
+Fixed cases cover empty responses, every flag combination, each VLI width, truncated data and invalid UTF-8; random
+responses (multi-byte VLIs, non-ASCII strings, empty lists, truncation) are then decoded in every output mode and
+compared with the images they were encoded from.
+"""
+import importlib
+import itertools
+import random
+import struct
+
+import pytest
+
+from tag_machine_api import parse_fallback, parse_search_response
+from tag_machine_api.encode import encode_record, encode_search_response
+
+
+def native_decoder():
+	try:
+		return importlib.import_module('tag_machine_api.parse')
+	except ImportError:
+		return None
+
+
+DECODERS = [
+	pytest.param(parse_fallback, id='fallback'),
+	pytest.param(native_decoder(), id='native', marks=pytest.mark.skipif(native_decoder() is None, reason='native parser not built')),
+]
+ALL_FLAGS = [flags for flags in itertools.product([False, True], repeat=4) if any(flags)]
+STRINGS = ['image_width', 'image_height', 'source', 'caption', 'é', '画像', '', 'x' * 300]
+VLI_EDGES = [0, 0xfc, 0xfd, 0xffff, 0x10000, 0xffffffff]  # The ends of each VLI width that tags and blame can use
+
+
+def random_value(rng: random.Random) -> int:
+	"""Values spanning every VLI width the decoders accept (blame and tags must fit in 32 bits)"""
+	return rng.choice([rng.randint(0, 0xfc), rng.randint(0xfd, 0xffff), rng.randint(0x10000, 0xffffffff)])
+
+
+def random_image(rng: random.Random, i: int) -> dict:
+	return {
+		'id': rng.randint(0, 0xffffffff) if rng.random() < 0.5 else i,
+		'hash': rng.randbytes(32),
+		'tags': {random_value(rng): random_value(rng) for _ in range(rng.choice([0, 1, 5, 300]))},
+		'attributes': {
+			rng.choice(STRINGS) + str(rng.randint(0, 3)): {rng.choice(STRINGS): random_value(rng) for _ in range(rng.randint(0, 3))}
+			for _ in range(rng.randint(0, 4))
+		},
+	}
+
+
+def encode(image: dict, flags: tuple[bool, bool, bool, bool]) -> bytes:
+	return encode_record(flags, image['id'], image['hash'], image['tags'], image['attributes'])
+
+
+def expected(image: dict, flags: tuple[bool, bool, bool, bool], attribute_keys: set[str] | None) -> tuple:
+	has_ids, has_hashes, has_tags, has_attributes = flags
+	attributes = {k: v for k, v in image['attributes'].items() if attribute_keys is None or k in attribute_keys}
+	return (
+		image['id'] if has_ids else None,
+		image['hash'] if has_hashes else None,
+		image['tags'] if has_tags else None,
+		attributes if has_attributes else None,
+	)
+
+
+def image_fields(image) -> tuple:
+	return (image.id, image.hash, image.tags, image.attributes)
+
+
+def columns_to_fields(columns: dict, flags: tuple[bool, bool, bool, bool]) -> list[tuple]:
+	has_ids, has_hashes, has_tags, has_attributes = flags
+	images = []
+	for i in range(columns['num_images']):
+		id = int(columns['ids'][i]) if has_ids else None
+		hash = bytes(columns['hashes'][i]) if has_hashes else None
+		tags = None
+		if has_tags:
+			a, b = columns['tag_offsets'][i:i + 2]
+			tags = dict(zip(columns['tag_ids'][a:b].tolist(), columns['tag_blame'][a:b].tolist()))
+		attributes = None
+		if has_attributes:
+			a, b = columns['attribute_offsets'][i:i + 2]
+			attributes = {}
+			for key, value, user in zip(columns['attribute_keys'][a:b], columns['attribute_values'][a:b], columns['attribute_blame'][a:b]):
+				attributes.setdefault(columns['strings'][key], {})[columns['strings'][value]] = int(user)
+			# Keys without any values only show up in the object form
+		images.append((id, hash, tags, attributes))
+	return images
+
+
+def without_empty_keys(fields: tuple) -> tuple:
+	id, hash, tags, attributes = fields
+	return (id, hash, tags, {k: v for k, v in attributes.items() if v} if attributes is not None else None)
+
+
+def check(decoder, flags: tuple[bool, bool, bool, bool], data: bytes, images: list[dict], attribute_keys: set[str] | None = None):
+	"""Decode data every way the decoder can, and compare with the images it was encoded from"""
+	padded = b'pad' + data + b'tail'
+	want = [expected(image, flags, attribute_keys) for image in images]
+
+	got = [image_fields(image) for image in decoder.parse_search_response_images(*flags, padded, 3, 3 + len(data), attribute_keys)]
+	assert got == want
+
+	got = columns_to_fields(decoder.parse_search_response_columns(*flags, bytearray(data), attribute_keys=attribute_keys), flags)
+	assert got == [without_empty_keys(w) for w in want]
+
+	lazy = decoder.parse_search_response_lazy(*flags, memoryview(padded), 3, 3 + len(data), attribute_keys)
+	assert len(lazy) == len(images)
+	assert [image_fields(image) for image in lazy[::-1]] == want[::-1]
+	if len(images) > 0:
+		assert image_fields(lazy[-1]) == want[-1]
+
+	num_records, num_bytes = decoder.scan_complete_records(*flags, data, len(images) + 1)
+	assert (num_records, num_bytes) == (len(images), len(data))
+
+
+def check_truncated(decoder, flags: tuple[bool, bool, bool, bool], data: bytes, images: list[dict], cut: int):
+	"""Truncating the data should only ever lose whole records, and decoding a partial record should fail"""
+	num_records, num_bytes = decoder.scan_complete_records(*flags, data[:cut], len(images) + 1)
+	ends = list(itertools.accumulate(len(encode(image, flags)) for image in images))
+	complete = len(list(itertools.takewhile(lambda end: end <= cut, ends)))
+	assert num_records == complete
+	assert num_bytes == (ends[complete - 1] if complete > 0 else 0)
+
+	if num_bytes < cut:
+		with pytest.raises(OSError):
+			decoder.parse_search_response_images(*flags, data[:cut])
+		with pytest.raises(OSError):
+			decoder.parse_search_response_columns(*flags, bytearray(data[:cut]))
+
+
+@pytest.mark.parametrize('decoder', DECODERS)
+@pytest.mark.parametrize('flags', ALL_FLAGS)
+def test_empty(decoder, flags):
+	check(decoder, flags, b'', [])
+
+
+@pytest.mark.parametrize('decoder', DECODERS)
+@pytest.mark.parametrize('flags', ALL_FLAGS)
+def test_every_flag_combination(decoder, flags):
+	rng = random.Random(sum(bit << i for i, bit in enumerate(flags)))
+	images = [random_image(rng, i) for i in range(5)]
+	check(decoder, flags, b''.join(encode(image, flags) for image in images), images)
+
+
+@pytest.mark.parametrize('decoder', DECODERS)
+def test_no_fields(decoder):
+	assert decoder.scan_complete_records(False, False, False, False, b'', 1) == (0, 0)
+	with pytest.raises(OSError):
+		decoder.parse_search_response_images(False, False, False, False, b'\x00')
+
+
+@pytest.mark.parametrize('decoder', DECODERS)
+def test_vli_widths(decoder):
+	flags = (True, False, True, True)
+	image = {
+		'id': 0xffffffff,
+		'hash': bytes(32),
+		'tags': {tag: VLI_EDGES[-1 - i] for i, tag in enumerate(VLI_EDGES)},
+		'attributes': {'k' * 0xfd: {'v' * 0x10000: 0xfd, '': 0xffffffff}},
+	}
+	data = encode(image, flags)
+	for prefix in (b'\xfd', b'\xfe'):
+		assert prefix in data
+	check(decoder, flags, data, [image])
+
+
+@pytest.mark.parametrize('decoder', DECODERS)
+def test_overlong_vlis(decoder):
+	# Small values written with a wider VLI than they need are still read
+	flags = (False, False, True, False)
+	data = b'\xfd\x02\x00' + b'\xfe\x05\x00\x00\x00' + b'\xff\x07\x00\x00\x00\x00\x00\x00\x00' + b'\x09' + b'\x03'
+	assert decoder.parse_search_response_images(*flags, data)[0].tags == {5: 7, 9: 3}
+
+
+@pytest.mark.parametrize('decoder', DECODERS)
+def test_wide_tags(decoder):
+	"""Tags above 32 bits (0xff VLIs) survive in image results, which store them as uint64, and are rejected by the uint32 columns"""
+	flags = (True, False, True, False)
+	tags = {2**40: 2**33, 5: 2**64 - 1}
+	data = encode(random_image(random.Random(0), 1) | {'tags': tags}, flags)
+	assert b'\xff' in data
+
+	assert decoder.parse_search_response_images(*flags, data)[0].tags == tags
+	assert decoder.parse_search_response_lazy(*flags, memoryview(data), 0, len(data))[0].tags == tags
+	with pytest.raises(OSError):
+		decoder.parse_search_response_columns(*flags, bytearray(data))
+
+
+@pytest.mark.parametrize('decoder', DECODERS)
+@pytest.mark.parametrize('flags', ALL_FLAGS)
+def test_truncated(decoder, flags):
+	rng = random.Random(1)
+	images = [random_image(rng, i) for i in range(3)]
+	data = b''.join(encode(image, flags) for image in images)
+	# Either side of every record boundary, and some cuts inside records
+	ends = list(itertools.accumulate(len(encode(image, flags)) for image in images))
+	cuts = {0, 1} | {end + d for end in ends for d in (-1, 0, 1)} | {rng.randrange(len(data)) for _ in range(20)}
+	for cut in sorted(cut for cut in cuts if cut < len(data)):
+		check_truncated(decoder, flags, data, images, cut)
+
+
+@pytest.mark.parametrize('decoder', DECODERS)
+def test_truncated_vli(decoder):
+	flags = (False, False, True, False)
+	for data in (b'\xfd\x01', b'\x01\xfe\x01\x00\x00', b'\x01\x05\xff\x01\x00\x00\x00\x00\x00\x00'):
+		assert decoder.scan_complete_records(*flags, data, 1) == (0, 0)
+		with pytest.raises(OSError):
+			decoder.parse_search_response_images(*flags, data)
+
+
+@pytest.mark.parametrize('decoder', DECODERS)
+def test_invalid_utf8(decoder):
+	flags = (False, False, False, True)
+	for data in (b'\x01\x02\xff\xfe\x00', b'\x01\x01k\x01\x02\xc3\x28\x00'):
+		# The record is complete, it just doesn't decode
+		assert decoder.scan_complete_records(*flags, data, 2) == (1, len(data))
+		with pytest.raises(OSError):
+			decoder.parse_search_response_images(*flags, data)
+		with pytest.raises(OSError):
+			decoder.parse_search_response_columns(*flags, bytearray(data))
+		with pytest.raises(OSError):
+			_ = decoder.parse_search_response_lazy(*flags, memoryview(data), 0, len(data))[0].attributes
+
+
+@pytest.mark.parametrize('decoder', DECODERS)
+@pytest.mark.parametrize('seed', range(20))
+def test_random_responses(decoder, seed):
+	rng = random.Random(seed)
+	for _ in range(10):
+		flags = rng.choice(ALL_FLAGS)
+		images = [random_image(rng, i) for i in range(rng.randint(0, 50))]
+		data = b''.join(encode(image, flags) for image in images)
+		attribute_keys = {rng.choice(STRINGS) + str(rng.randint(0, 3)) for _ in range(2)} if rng.random() < 0.3 else None
+
+		check(decoder, flags, data, images, attribute_keys)
+		check_truncated(decoder, flags, data, images, rng.randint(0, len(data)))
+
+
+@pytest.mark.parametrize('flags', ALL_FLAGS)
+def test_parse_search_response_empty(flags):
+	result = parse_search_response(encode_search_response(flags, []))
+	assert len(result) == 0
+
+
+def test_parse_search_response_short():
+	for response in (b'', b'TMS'):
+		with pytest.raises(ValueError):
+			parse_search_response(response)
+
+
+def test_parse_search_response_ids():
+	ids = [1, 0xfd, 0xffffffff]
+	response = encode_search_response((True, False, False, False), [struct.pack('<I', id) for id in ids])
+	assert parse_search_response(response).tolist() == ids
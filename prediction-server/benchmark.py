@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+"""
+Load test for the prediction server.
+
+Starts prediction_server in a subprocess with small, randomly initialised models on the CPU (or any --device),
+drives /predict and /tag_assoc with synthetic images at each requested concurrency level, and prints the
+latency percentiles and throughput as JSON so results can be tracked across deploys.
+
+Example:
+	python benchmark.py --concurrency 1,4,16 --requests 200 --output bench.json
+"""
+import argparse
+import concurrent.futures
+import io
+import json
+import logging
+import random
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+import requests
+from PIL import Image
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--server', type=str, choices=['flask', 'asgi'], default='asgi')
+parser.add_argument('--device', type=str, default='cpu')
+parser.add_argument('--port', type=int, default=8187)
+parser.add_argument('--endpoints', type=str, default='predict,tag_assoc', help='Comma separated endpoints to benchmark')
+parser.add_argument('--concurrency', type=str, default='1,4,16', help='Comma separated concurrency levels')
+parser.add_argument('--requests', type=int, default=100, help='Requests per endpoint per concurrency level')
+parser.add_argument('--warmup', type=int, default=5, help='Untimed requests per endpoint before each run')
+parser.add_argument('--num-images', type=int, default=32, help='Size of the synthetic image pool')
+parser.add_argument('--tag-assoc-image-fraction', type=float, default=0.5, help='Fraction of /tag_assoc requests that include an image')
+parser.add_argument('--model-config', type=str, default='SWModel1', help='Entry of Models.MODEL_CONFIGS to build the image model from')
+parser.add_argument('--num-blocks', type=int, default=2, help='Transformer blocks in the image model')
+parser.add_argument('--n-tags', type=int, default=5812)
+parser.add_argument('--image-size', type=int, default=448)
+parser.add_argument('--seed', type=int, default=42)
+parser.add_argument('--cache-size', type=int, default=0, help='Size of the server\'s result caches (0 so that every request runs the models)')
+parser.add_argument('--output', type=str, default=None, help='Write the JSON report here instead of stdout')
+parser.add_argument('--serve', action='store_true', help=argparse.SUPPRESS)
+
+# Common aspect ratios (width / height) of uploaded images, roughly weighted by how often they show up.
+ASPECT_RATIOS = [(1.0, 0.25), (4 / 3, 0.15), (3 / 4, 0.2), (16 / 9, 0.1), (9 / 16, 0.05), (3 / 2, 0.1), (2 / 3, 0.15)]
+
+
+def build_models(model_config: str, num_blocks: int, n_tags: int, image_size: int):
+	"""Randomly initialised stand-ins for the tagger and the tag association model."""
+	import torch
+	from transformers.models.llama.modeling_llama import LlamaConfig
+
+	from Models import MODEL_CONFIGS, VisionModel
+	from MultiModel import LlamaMultiModel
+
+	torch.manual_seed(0)
+
+	config = dict(MODEL_CONFIGS[model_config])
+	config.update(n_tags=n_tags, image_size=image_size, loss_type='asl')
+	if 'num_blocks' in config:
+		config['num_blocks'] = num_blocks
+	else:
+		config['num_layers'] = num_blocks
+	model = VisionModel.from_config(config)
+	embedding_dim = config.get('d_model', config.get('embedding_dim'))
+
+	tag_assoc_config = LlamaConfig(
+		vocab_size=n_tags + 3,
+		hidden_size=128,
+		intermediate_size=256,
+		num_hidden_layers=2,
+		num_attention_heads=4,
+		num_key_value_heads=4,
+		max_position_embeddings=128,
+		pad_token_id=0,
+		bos_token_id=1,
+		eos_token_id=2,
+	)
+	tag_assoc_model = LlamaMultiModel(tag_assoc_config, image_embedding_dim=embedding_dim)
+
+	top_tags = [f'tag_{i}' for i in range(n_tags)]
+
+	return model, tag_assoc_model, top_tags
+
+
+def serve(args):
+	"""Subprocess entry point: run prediction_server with random models."""
+	import torch
+
+	import prediction_server as ps
+
+	logging.basicConfig(level=logging.WARNING, format='%(asctime)s %(levelname)s %(message)s')
+
+	ps.IMAGE_SIZE = args.image_size
+	ps.DEVICE = args.device
+	# The image pool is small, so with the caches on most requests would be cache hits
+	for cache in ps.CACHES.values():
+		cache.maxsize = args.cache_size
+	max_concurrency = max(int(c) for c in args.concurrency.split(','))
+	for queue in ps.QUEUES.values():
+		queue.max_pending = max_concurrency
+
+	def init():
+		model, tag_assoc_model, top_tags = build_models(args.model_config, args.num_blocks, args.n_tags, args.image_size)
+		ps.thread_local.model = model.to(args.device).eval()
+		ps.TOP_TAGS[:] = top_tags
+		ps.thread_local.tag_assoc_model = tag_assoc_model.to(args.device).eval()
+		ps.thread_local.tag_to_id = {'<PAD>': 0, '<BOS>': 1, '<EOS>': 2} | {tag: i + 3 for i, tag in enumerate(top_tags)}
+		ps.thread_local.id_to_tag = {i: tag for tag, i in ps.thread_local.tag_to_id.items()}
+		ps.register_model('tagger', ps.thread_local.model)
+		ps.register_model('tag_assoc', ps.thread_local.tag_assoc_model)
+		torch.set_grad_enabled(False)
+
+	ps.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, initializer=init)
+	ps.serve(args.server, '127.0.0.1', args.port)
+
+
+def synthetic_image(rng: random.Random) -> bytes:
+	"""A JPEG with a realistic size and aspect ratio and enough structure to not compress to nothing."""
+	aspect = rng.choices([a for a, _ in ASPECT_RATIOS], weights=[w for _, w in ASPECT_RATIOS])[0] * rng.uniform(0.95, 1.05)
+	long_side = int(min(max(rng.lognormvariate(7.2, 0.45), 256), 4096))
+	width, height = (long_side, int(long_side / aspect)) if aspect >= 1 else (int(long_side * aspect), long_side)
+
+	# Smooth gradients plus low amplitude noise
+	np_rng = np.random.default_rng(rng.getrandbits(32))
+	y = np.linspace(0, 1, height, dtype=np.float32)[:, None, None]
+	x = np.linspace(0, 1, width, dtype=np.float32)[None, :, None]
+	phase = np_rng.uniform(0, 2 * np.pi, size=(1, 1, 3)).astype(np.float32)
+	pixels = 127 + 100 * np.sin(6 * x + 4 * y + phase) + np_rng.normal(0, 12, size=(height, width, 3)).astype(np.float32)
+	image = Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8), 'RGB')
+
+	buf = io.BytesIO()
+	image.save(buf, format='JPEG', quality=90)
+	return buf.getvalue()
+
+
+def make_request(endpoint: str, images: list[bytes], tags: list[str], image_fraction: float, rng: random.Random):
+	if endpoint == 'predict':
+		return {'files': {'image': ('image.jpg', rng.choice(images))}}
+	elif endpoint == 'tag_assoc':
+		request = {'data': {'tags': rng.sample(tags, rng.randint(0, 30))}}
+		if rng.random() < image_fraction:
+			request['files'] = {'image': ('image.jpg', rng.choice(images))}
+		return request
+	else:
+		raise ValueError(f'Unsupported endpoint: {endpoint}')
+
+
+def run_level(url: str, endpoint: str, concurrency: int, num_requests: int, make) -> dict:
+	"""Issue num_requests requests from `concurrency` clients and summarise latency and throughput."""
+	sessions = [requests.Session() for _ in range(concurrency)]
+	counter = iter(range(num_requests))
+	latencies = []
+	statuses: dict[int, int] = {}
+	lock = threading.Lock()
+
+	def client(session: requests.Session):
+		for _ in counter:
+			request = make()
+			start = time.perf_counter()
+			try:
+				status = session.post(f'{url}/{endpoint}', timeout=300, **request).status_code
+			except requests.RequestException:
+				status = 0
+			elapsed = time.perf_counter() - start
+			with lock:
+				statuses[status] = statuses.get(status, 0) + 1
+				if status == 200:
+					latencies.append(elapsed)
+
+	start = time.perf_counter()
+	with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as pool:
+		list(pool.map(client, sessions))
+	elapsed = time.perf_counter() - start
+
+	result = {
+		'endpoint': endpoint,
+		'concurrency': concurrency,
+		'requests': num_requests,
+		'ok': len(latencies),
+		'status_counts': {str(k): v for k, v in sorted(statuses.items())},
+		'elapsed_s': elapsed,
+		'rps': len(latencies) / elapsed,
+	}
+
+	if len(latencies) > 0:
+		p = np.percentile(np.array(latencies), [50, 95, 99]) * 1000
+		result.update(mean_ms=float(np.mean(latencies) * 1000), p50_ms=float(p[0]), p95_ms=float(p[1]), p99_ms=float(p[2]))
+
+	return result
+
+
+def wait_for_server(url: str, process: subprocess.Popen, timeout: float = 300):
+	deadline = time.time() + timeout
+	while time.time() < deadline:
+		if process.poll() is not None:
+			raise RuntimeError(f'Server exited with code {process.returncode}')
+		try:
+			requests.get(f'{url}/metrics', timeout=1)
+			return
+		except requests.RequestException:
+			time.sleep(0.5)
+
+	raise TimeoutError('Server did not start in time')
+
+
+def main():
+	args = parser.parse_args()
+
+	if args.serve:
+		serve(args)
+		return
+
+	rng = random.Random(args.seed)
+	url = f'http://127.0.0.1:{args.port}'
+	endpoints = [e.strip() for e in args.endpoints.split(',') if e.strip()]
+	concurrency_levels = [int(c) for c in args.concurrency.split(',')]
+	tags = [f'tag_{i}' for i in range(args.n_tags)]
+
+	print(f'Generating {args.num_images} synthetic images...', file=sys.stderr)
+	images = [synthetic_image(rng) for _ in range(args.num_images)]
+
+	process = subprocess.Popen([sys.executable, str(Path(__file__).absolute()), '--serve', *sys.argv[1:]], cwd=Path(__file__).parent)
+	try:
+		wait_for_server(url, process)
+		results = []
+		for endpoint in endpoints:
+			make = lambda endpoint=endpoint: make_request(endpoint, images, tags, args.tag_assoc_image_fraction, rng)
+			run_level(url, endpoint, 1, args.warmup, make)
+
+			for concurrency in concurrency_levels:
+				print(f'Benchmarking /{endpoint} at concurrency {concurrency}...', file=sys.stderr)
+				results.append(run_level(url, endpoint, concurrency, args.requests, make))
+	finally:
+		process.terminate()
+		process.wait()
+
+	report = {
+		'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+		'config': {k: v for k, v in vars(args).items() if k not in ('serve', 'output')},
+		'image_bytes_mean': float(np.mean([len(image) for image in images])),
+		'results': results,
+	}
+	report_json = json.dumps(report, indent=2)
+
+	if args.output is not None:
+		Path(args.output).write_text(report_json)
+	else:
+		print(report_json)
+
+
+if __name__ == '__main__':
+	main()
@@ -3,8 +3,11 @@ from dataclasses import dataclass
 import functools
 import json
 import threading
+import time
+import contextlib
+from collections import defaultdict, OrderedDict
 from typing import Generic, TypeVar
-from flask import Flask, request
+from flask import Flask, request, Response
 from pathlib import Path
 from flask_cors import CORS
 import torch
@@ -14,10 +17,13 @@ from PIL import Image
 import torchvision.transforms.functional as TF
 import concurrent.futures
 import argparse
+import asyncio
 from transformers import AutoTokenizer, AutoModelForCausalLM, AutoProcessor, AutoModel, LlavaForConditionalGeneration
 from torch import nn
 import yaml
 import io
+import re
+import math
 from hashlib import sha256
 
 from Models import VisionModel
@@ -29,6 +35,14 @@ parser.add_argument('--image-dir', type=str, default='../rust-api/images')
 parser.add_argument('--image-size', type=int, default=448)
 parser.add_argument('--port', type=int, default=8087)
 parser.add_argument('--host', type=str, default='127.0.0.1')
+parser.add_argument('--device', type=str, default='cuda')
+parser.add_argument('--server', type=str, choices=['flask', 'asgi'], default='flask', help='flask runs the development server, asgi serves through uvicorn')
+parser.add_argument('--max-pending', type=int, default=8, help='Maximum queued + running requests per endpoint before shedding load with a 503')
+parser.add_argument('--max-pending-caption', type=int, default=2, help='Maximum queued + running requests for /caption')
+parser.add_argument('--retry-after', type=int, default=1, help='Retry-After seconds sent with 503 responses')
+parser.add_argument('--profile-dir', type=str, default='profiles', help='Directory that /profile writes torch.profiler traces to')
+parser.add_argument('--cache-size', type=int, default=1000, help='Images kept in each of the prediction and embedding caches')
+parser.add_argument('--prefetch-queue', type=int, default=256, help='Maximum number of image hashes waiting to be prefetched')
 parser.add_argument('--model', type=str, default='models/io1nspv6-660')
 parser.add_argument('--tag-assoc-model', type=str, default='tag_assoc_models/5kcpemm4')
 #parser.add_argument('--vlm-model', type=str, default='models/joy-caption-9e1pdwl9-399872')
@@ -46,12 +60,18 @@ parser.add_argument('--vlm-model', type=str, default="fancyfeast/llama-joycaptio
 
 IMAGE_DIR = Path('../rust-api/images')
 IMAGE_SIZE = 448
+MAX_GENERATE_STEPS = 32
+MAX_BEAMS = 8
+SPECIAL_TAG_IDS = [0, 1, 2]   # <PAD>, <BOS>, <EOS>
+DEVICE = 'cuda'
+PROFILE_DIR = Path('profiles')
 #VLM_PROMPT = "A descriptive caption for this image:\n"
 
 
 @dataclass
 class TagPredictionJob:
 	image: Image.Image
+	image_hash: bytes
 
 
 @dataclass
@@ -63,11 +83,22 @@ class ImageCaptioningJob:
 @dataclass
 class TagAssocJob:
 	tags: list[str]
+	steps: int = 0   # If > 0, generate this many additional tags instead of returning next-tag predictions
+	beams: int = 1
 
 
 @dataclass
 class TagImageAssocJob:
 	tags: list[str]
+	image: Image.Image | None   # None if the image's embedding was cached when the job was submitted
+	image_hash: bytes
+	image_data: bytes
+	steps: int = 0
+	beams: int = 1
+
+
+@dataclass
+class PrefetchJob:
 	image: Image.Image
 	image_hash: bytes
 
@@ -80,7 +111,7 @@ CORS(app)
 
 
 def load_model(model_path: Path):
-	model = VisionModel.load_model(model_path, 'cuda')
+	model = VisionModel.load_model(model_path, DEVICE)
 	model.eval()
 	model = torch.compile(model, mode="reduce-overhead", fullgraph=True)
 
@@ -103,7 +134,7 @@ def load_tag_assoc_model(model_path: Path):
 
 	model = LlamaMultiModel.from_pretrained(model_path / 'model', image_embedding_dim=768)
 	assert isinstance(model, LlamaMultiModel)
-	model = model.to('cuda') # type: ignore
+	model = model.to(DEVICE) # type: ignore
 	#model = torch.compile(model)  # Input sizes vary a lot
 	model.eval()
 
@@ -178,7 +209,7 @@ def load_vlm_model(model_path: Path):
 	Load the VLM model.
 	"""
 	processor = AutoProcessor.from_pretrained(model_path)
-	llava_model = LlavaForConditionalGeneration.from_pretrained(model_path, torch_dtype="bfloat16", device_map='cuda')
+	llava_model = LlavaForConditionalGeneration.from_pretrained(model_path, torch_dtype="bfloat16", device_map=DEVICE)
 	llava_model.eval()
 
 	return processor, llava_model
@@ -256,8 +287,11 @@ def run_vlm_model(prompt_str: str, processor, text_model: LlavaForConditionalGen
 	assert isinstance(convo_string, str)
 
 	# Process the inputs
-	inputs = processor(text=[convo_string], images=[image], return_tensors="pt").to('cuda')
-	inputs['pixel_values'] = inputs['pixel_values'].to(torch.bfloat16)
+	with stage('prepare_image'):
+		inputs = processor(text=[convo_string], images=[image], return_tensors="pt")
+	with stage('to_device'):
+		inputs = inputs.to(DEVICE)
+		inputs['pixel_values'] = inputs['pixel_values'].to(torch.bfloat16)
 
 	#prompt = tokenizer.encode(prompt_str, return_tensors='pt', padding=False, truncation=False, add_special_tokens=False)
 
@@ -297,14 +331,16 @@ def run_vlm_model(prompt_str: str, processor, text_model: LlavaForConditionalGen
 	#generate_ids = text_model.generate(input_ids, inputs_embeds=inputs_embeds, attention_mask=attention_mask, max_new_tokens=256, do_sample=False, suppress_tokens=None)
 	#generate_ids = text_model.generate(input_ids, inputs_embeds=inputs_embeds, attention_mask=attention_mask, max_new_tokens=256, do_sample=True, top_k=10, temperature=0.2, suppress_tokens=None)
 	#generate_ids = text_model.generate(input_ids, inputs_embeds=inputs_embeds, attention_mask=attention_mask, max_new_tokens=256, do_sample=True, suppress_tokens=None)   # Uses the default which is temp=0.6, top_p=0.9
-	generate_ids = text_model.generate(**inputs, max_new_tokens=512, do_sample=True, suppress_tokens=None, use_cache=True, temperature=0.6, top_p=0.9, top_k=None)[0]
+	with stage('forward'):
+		generate_ids = text_model.generate(**inputs, max_new_tokens=512, do_sample=True, suppress_tokens=None, use_cache=True, temperature=0.6, top_p=0.9, top_k=None)[0]
 
-	# Trim off the prompt
-	generate_ids = generate_ids[inputs['input_ids'].shape[1]:]
+	with stage('postprocess'):
+		# Trim off the prompt
+		generate_ids = generate_ids[inputs['input_ids'].shape[1]:]
 
-	# Decode
-	caption = processor.tokenizer.decode(generate_ids, skip_special_tokens=True, clean_up_tokenization_spaces=False)
-	caption = caption.strip()
+		# Decode
+		caption = processor.tokenizer.decode(generate_ids, skip_special_tokens=True, clean_up_tokenization_spaces=False)
+		caption = caption.strip()
 
 	return caption
 	#print(generate_ids)
@@ -316,94 +352,721 @@ def run_vlm_model(prompt_str: str, processor, text_model: LlavaForConditionalGen
 	#return caption
 
 
+T = TypeVar('T')
+K = TypeVar('K')
+
+class LruCache(Generic[T, K]):
+	cache: OrderedDict[K, T]
+
+	def __init__(self, maxsize: int):
+		self.maxsize = maxsize
+		self.cache = OrderedDict()
+		self.lock = threading.Lock()
+		self.hits = 0
+		self.misses = 0
+	
+	def get(self, key: K) -> T | None:
+		"""Look up a value, counting the lookup as a hit or miss."""
+		with self.lock:
+			value = self.cache.get(key)
+			if value is None:
+				self.misses += 1
+				return None
+			
+			self.hits += 1
+			self.cache.move_to_end(key)
+			return value
+	
+	def peek(self, key: K) -> T | None:
+		"""Look up a value without counting it in the hit/miss statistics."""
+		with self.lock:
+			value = self.cache.get(key)
+			if value is not None:
+				self.cache.move_to_end(key)
+			return value
+	
+	def put(self, key: K, value: T):
+		with self.lock:
+			self.cache[key] = value
+			self.cache.move_to_end(key)
+			while len(self.cache) > self.maxsize:
+				self.cache.popitem(last=False)
+
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64)
+
+METRIC_HELP = {
+	'prediction_request_seconds': ('histogram', 'End-to-end request latency, including queue wait'),
+	'prediction_stage_seconds': ('histogram', 'Latency of each stage of a request'),
+	'prediction_batch_size': ('histogram', 'Number of images or sequences per model forward'),
+	'prediction_requests_total': ('counter', 'Requests by endpoint and response status'),
+	'prediction_cache_requests_total': ('counter', 'Result cache lookups by outcome'),
+	'prediction_queue_pending': ('gauge', 'Requests currently queued or running per endpoint'),
+	'prediction_queue_rejected_total': ('counter', 'Requests shed with a 503 per endpoint'),
+	'prediction_model_memory_bytes': ('gauge', 'Size of each loaded model\'s parameters and buffers'),
+	'prediction_cuda_memory_bytes': ('gauge', 'CUDA allocator memory'),
+	'prediction_prefetch_total': ('counter', 'Prefetched images by outcome'),
+	'prediction_prefetch_pending': ('gauge', 'Image hashes waiting to be prefetched'),
+}
+
+
+class Histogram:
+	def __init__(self, buckets: tuple):
+		self.buckets = buckets
+		self.counts = [0] * len(buckets)
+		self.sum = 0.0
+		self.count = 0
+	
+	def observe(self, value: float):
+		for i, bound in enumerate(self.buckets):
+			if value <= bound:
+				self.counts[i] += 1
+				break
+		self.sum += value
+		self.count += 1
+
+
+class Metrics:
+	"""
+	Process-wide counters and histograms, rendered in the Prometheus text format by /metrics.
+	Labels are passed as keyword arguments and must be used consistently per metric.
+	"""
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.histograms: dict[str, dict[tuple, Histogram]] = defaultdict(dict)
+		self.counters: dict[str, dict[tuple, float]] = defaultdict(lambda: defaultdict(float))
+	
+	def observe(self, name: str, value: float, buckets: tuple = LATENCY_BUCKETS, **labels: str):
+		key = tuple(sorted(labels.items()))
+		with self.lock:
+			histogram = self.histograms[name].get(key)
+			if histogram is None:
+				histogram = self.histograms[name][key] = Histogram(buckets)
+			histogram.observe(value)
+	
+	def inc(self, name: str, amount: float = 1, **labels: str):
+		key = tuple(sorted(labels.items()))
+		with self.lock:
+			self.counters[name][key] += amount
+	
+	@contextlib.contextmanager
+	def time(self, endpoint: str, stage: str):
+		start = time.perf_counter()
+		try:
+			yield
+		finally:
+			self.observe('prediction_stage_seconds', time.perf_counter() - start, endpoint=endpoint, stage=stage)
+	
+	def render(self, gauges: dict[str, list[tuple[dict[str, str], float]]]) -> str:
+		lines = []
+
+		def header(name: str):
+			kind, help_text = METRIC_HELP[name]
+			lines.append(f'# HELP {name} {help_text}')
+			lines.append(f'# TYPE {name} {kind}')
+
+		with self.lock:
+			for name, series in self.histograms.items():
+				header(name)
+				for key, histogram in series.items():
+					cumulative = 0
+					for bound, count in zip(histogram.buckets, histogram.counts):
+						cumulative += count
+						lines.append(f'{name}_bucket{format_labels(key + (("le", str(bound)),))} {cumulative}')
+					lines.append(f'{name}_bucket{format_labels(key + (("le", "+Inf"),))} {histogram.count}')
+					lines.append(f'{name}_sum{format_labels(key)} {histogram.sum}')
+					lines.append(f'{name}_count{format_labels(key)} {histogram.count}')
+
+			for name, series in self.counters.items():
+				header(name)
+				for key, value in series.items():
+					lines.append(f'{name}{format_labels(key)} {value}')
+		
+		for name, series in gauges.items():
+			if len(series) == 0:
+				continue
+			header(name)
+			for labels, value in series:
+				lines.append(f'{name}{format_labels(tuple(labels.items()))} {value}')
+
+		return '\n'.join(lines) + '\n'
+
+
+def format_labels(labels: tuple) -> str:
+	if len(labels) == 0:
+		return ''
+	
+	escaped = (f'{k}="{str(v).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"' for k, v in labels)
+	return '{' + ','.join(escaped) + '}'
+
+
+METRICS = Metrics()
+MODEL_MEMORY: dict[str, int] = {}
+TOP_TAGS: list[str] = []
+
+# Keyed by hex image hash. 'predict' holds the tagger's probabilities on the CPU, 'image_embedding' the
+# projected embedding the tag association model is prompted with.
+CACHES: dict[str, LruCache[torch.Tensor, str]] = {
+	'predict': LruCache(maxsize=1000),
+	'image_embedding': LruCache(maxsize=1000),
+}
+
+
+def register_model(name: str, model: nn.Module):
+	"""Record a loaded model's footprint for /metrics."""
+	tensors = list(model.parameters()) + list(model.buffers())
+	MODEL_MEMORY[name] = sum(t.numel() * t.element_size() for t in tensors)
+
+
+def render_metrics() -> str:
+	gauges: dict[str, list[tuple[dict[str, str], float]]] = {
+		'prediction_queue_pending': [({'endpoint': name}, queue.pending) for name, queue in QUEUES.items()],
+		'prediction_queue_rejected_total': [({'endpoint': name}, queue.rejected) for name, queue in QUEUES.items()],
+		'prediction_cache_requests_total': [
+			({'cache': name, 'result': result}, value)
+			for name, cache in CACHES.items() for result, value in (('hit', cache.hits), ('miss', cache.misses))
+		],
+		'prediction_model_memory_bytes': [({'model': name}, size) for name, size in MODEL_MEMORY.items()],
+		'prediction_prefetch_pending': [({}, len(PREFETCHER.pending))],
+	}
+
+	if torch.cuda.is_available():
+		gauges['prediction_cuda_memory_bytes'] = [
+			({'kind': 'allocated'}, torch.cuda.memory_allocated()),
+			({'kind': 'reserved'}, torch.cuda.memory_reserved()),
+			({'kind': 'max_allocated'}, torch.cuda.max_memory_allocated()),
+		]
+
+	return METRICS.render(gauges)
+
+
+def stage(name: str):
+	"""Time a stage of the job currently running on the model worker thread."""
+	return METRICS.time(thread_local.endpoint, name)
+
+
+def synchronize():
+	"""Wait for queued GPU work so that stage timings include it."""
+	if torch.device(DEVICE).type == 'cuda':
+		torch.cuda.synchronize()
+
+
+def autocast():
+	"""Mixed precision on CUDA; full precision elsewhere."""
+	device_type = torch.device(DEVICE).type
+	return torch.amp.autocast_mode.autocast(device_type, enabled=device_type == 'cuda')
+
+
+class ProfileCapture:
+	"""
+	Captures a torch.profiler trace covering the next N model jobs and writes it to PROFILE_DIR.
+	The profiler is started and stopped on the model worker thread, around the jobs themselves.
+	"""
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.remaining = 0
+		self.path: Path | None = None
+		self.profiler = None
+	
+	def arm(self, num_jobs: int) -> Path | None:
+		with self.lock:
+			if self.remaining > 0:
+				return None
+			
+			self.remaining = num_jobs
+			self.path = PROFILE_DIR / f'trace-{time.strftime("%Y%m%d-%H%M%S")}.json'
+			return self.path
+	
+	def before_job(self):
+		if self.remaining == 0 or self.profiler is not None:
+			return
+		
+		activities = [torch.profiler.ProfilerActivity.CPU]
+		if torch.cuda.is_available():
+			activities.append(torch.profiler.ProfilerActivity.CUDA)
+		self.profiler = torch.profiler.profile(activities=activities, record_shapes=True, profile_memory=True)
+		self.profiler.start()
+	
+	def after_job(self):
+		if self.profiler is None:
+			return
+		
+		with self.lock:
+			self.remaining -= 1
+			if self.remaining > 0:
+				return
+			
+			profiler, path = self.profiler, self.path
+			self.profiler = None
+		
+		profiler.stop()
+		assert path is not None
+		path.parent.mkdir(parents=True, exist_ok=True)
+		profiler.export_chrome_trace(str(path))
+		logging.info(f'Wrote profiler trace to {path}')
+
+
+PROFILER = ProfileCapture()
+
+
+def submit_job(endpoint: str, worker, job) -> concurrent.futures.Future:
+	return executor.submit(run_job, endpoint, worker, job, time.perf_counter())
+
+
+def run_job(endpoint: str, worker, job, submitted: float):
+	METRICS.observe('prediction_stage_seconds', time.perf_counter() - submitted, endpoint=endpoint, stage='queue_wait')
+	thread_local.endpoint = endpoint
+	PROFILER.before_job()
+	try:
+		return worker(job)
+	finally:
+		PROFILER.after_job()
+
+
+class EndpointQueue:
+	"""
+	Bounded admission for one endpoint.
+	Requests that would push the number of queued + running jobs past max_pending are shed with a 503
+	instead of piling up behind the model worker.
+	All queues share the `idle` condition as their lock, and it's notified whenever one of them drains,
+	so background work can wait for every endpoint to be idle (see Prefetcher).
+	"""
+	idle = threading.Condition()
+
+	def __init__(self, name: str, max_pending: int):
+		self.name = name
+		self.max_pending = max_pending
+		self.pending = 0
+		self.rejected = 0
+	
+	def try_acquire(self) -> bool:
+		with self.idle:
+			if self.pending >= self.max_pending:
+				self.rejected += 1
+				return False
+			
+			self.pending += 1
+			return True
+	
+	def release(self):
+		with self.idle:
+			self.pending -= 1
+			if self.pending == 0:
+				self.idle.notify_all()
+
+
+QUEUES = {
+	'predict': EndpointQueue('predict', 8),
+	'tag_assoc': EndpointQueue('tag_assoc', 8),
+	'caption': EndpointQueue('caption', 2),
+}
+RETRY_AFTER = 1
+
+
+class Prefetcher:
+	"""
+	Computes predictions and embeddings for upcoming images from IMAGE_DIR in the background.
+	Images are read and decoded on the prefetch thread, and jobs are handed to the model executor one at a time
+	and only while no interactive request is pending, so an interactive request waits behind at most one prefetch job.
+	"""
+	def __init__(self, maxsize: int):
+		self.maxsize = maxsize
+		self.pending: OrderedDict[str, None] = OrderedDict()
+		self.cond = threading.Condition()
+		self.thread: threading.Thread | None = None
+	
+	def add(self, image_hashes: list[str]) -> int:
+		with self.cond:
+			for image_hash in image_hashes:
+				self.pending[image_hash] = None
+			
+			while len(self.pending) > self.maxsize:
+				self.pending.popitem(last=False)
+			
+			if self.thread is None:
+				self.thread = threading.Thread(target=self.run, name='prefetch', daemon=True)
+				self.thread.start()
+			
+			self.cond.notify()
+			return len(self.pending)
+	
+	def run(self):
+		while True:
+			with self.cond:
+				while len(self.pending) == 0:
+					self.cond.wait()
+				image_hash, _ = self.pending.popitem(last=False)
+			
+			try:
+				outcome = self.prefetch(image_hash)
+			except Exception as e:
+				logging.warning(f'Prefetch failed for {image_hash}: {e}')
+				outcome = 'failed'
+			METRICS.inc('prediction_prefetch_total', result=outcome)
+	
+	def prefetch(self, image_hash: str) -> str:
+		if CACHES['predict'].peek(image_hash) is not None and CACHES['image_embedding'].peek(image_hash) is not None:
+			return 'cached'
+		
+		path = IMAGE_DIR / image_hash[:2] / image_hash[2:4] / image_hash
+		if not path.exists():
+			return 'missing'
+		
+		image = decode_image(path.read_bytes())
+
+		# Submitting while holding the queues' lock means no interactive request is admitted between the check and the submit
+		with EndpointQueue.idle:
+			EndpointQueue.idle.wait_for(lambda: all(queue.pending == 0 for queue in QUEUES.values()))
+			future = submit_job('prefetch', prefetch_worker, PrefetchJob(image, bytes.fromhex(image_hash)))
+		
+		future.result()
+		return 'done'
+
+
+PREFETCHER = Prefetcher(maxsize=256)
+
+
+def decode_image(data: bytes) -> Image.Image:
+	image = Image.open(io.BytesIO(data))
+	image.load()
+	return image
+
+
+def submit_predict(data: bytes) -> concurrent.futures.Future:
+	image_hash = sha256(data).digest()
+	probs = CACHES['predict'].get(image_hash.hex())
+	if probs is not None:
+		# Cached (or prefetched) images skip the model worker entirely
+		future = concurrent.futures.Future()
+		with METRICS.time('predict', 'postprocess'):
+			future.set_result(tag_probabilities_to_dict(probs))
+		return future
+
+	with METRICS.time('predict', 'decode'):
+		image = decode_image(data)
+	return submit_job('predict', tag_prediction_worker, TagPredictionJob(image, image_hash))
+
+
+def submit_tag_assoc(tags: list[str], data: bytes | None, steps: int = 0, beams: int = 1) -> concurrent.futures.Future:
+	if data is None:
+		return submit_job('tag_assoc', tag_assoc_worker, TagAssocJob(tags, steps, beams))
+
+	image_hash = sha256(data).digest()
+	image = None
+	if CACHES['image_embedding'].get(image_hash.hex()) is None:
+		with METRICS.time('tag_assoc', 'decode'):
+			image = decode_image(data)
+	return submit_job('tag_assoc', tag_image_assoc_worker, TagImageAssocJob(tags, image, image_hash, data, steps, beams))
+
+
+def parse_generation_params(form) -> tuple[int, int] | None:
+	"""Read /tag_assoc's optional steps and beams fields, returning None if they are invalid."""
+	try:
+		steps = int(form.get('steps', 0))
+		beams = int(form.get('beams', 1))
+	except ValueError:
+		return None
+	
+	if not (0 <= steps <= MAX_GENERATE_STEPS and 1 <= beams <= MAX_BEAMS):
+		return None
+	
+	return steps, beams
+
+
+def parse_image_hashes(hashes: list[str]) -> list[str] | None:
+	"""Normalize hex sha256 hashes, returning None if any are malformed."""
+	hashes = [h.strip().lower() for h in hashes]
+	if not all(re.fullmatch(r'[0-9a-f]{64}', h) for h in hashes):
+		return None
+	return hashes
+
+
+def submit_caption(prompt: str, data: bytes) -> concurrent.futures.Future:
+	with METRICS.time('caption', 'decode'):
+		image = decode_image(data)
+	return submit_job('caption', captioning_worker, ImageCaptioningJob(image, prompt))
+
+
+def serialize_result(endpoint: str, result: dict) -> str:
+	with METRICS.time(endpoint, 'serialize'):
+		return json.dumps(result)
+
+
+def record_request(endpoint: str, start: float, status: int):
+	METRICS.observe('prediction_request_seconds', time.perf_counter() - start, endpoint=endpoint)
+	METRICS.inc('prediction_requests_total', endpoint=endpoint, status=str(status))
+
+
+def overloaded_response():
+	return 'Server overloaded', 503, {'Retry-After': str(RETRY_AFTER)}
+
+
+def read_upload(endpoint: str, file) -> bytes:
+	with METRICS.time(endpoint, 'read'):
+		return file.stream.read()
+
+
+def json_response(endpoint: str, result: dict):
+	return Response(serialize_result(endpoint, result), mimetype='application/json')
+
+
+def flask_endpoint(name: str):
+	"""Admission control and request metrics for a Flask route."""
+	def decorator(handler):
+		@functools.wraps(handler)
+		def wrapper():
+			queue = QUEUES[name]
+			if not queue.try_acquire():
+				METRICS.inc('prediction_requests_total', endpoint=name, status='503')
+				return overloaded_response()
+
+			start = time.perf_counter()
+			status = 500
+			try:
+				response = handler()
+				status = response[1] if isinstance(response, tuple) else 200
+				return response
+			except Exception as e:
+				logging.error(f'Prediction failed: {e}')
+				return 'Prediction failed', 500
+			finally:
+				queue.release()
+				record_request(name, start, status)
+		
+		return wrapper
+	return decorator
+
+
 @app.route('/predict', methods=['POST'])
+@flask_endpoint('predict')
 def predict():
 	"""Predict tags for an image."""
-	try:
-		file = request.files.get('image')
-		if file is None:
-			return 'No image provided', 400
-		image = Image.open(file.stream)
-		image.load()
-		future = executor.submit(tag_prediction_worker, TagPredictionJob(image))
-		result = future.result()
-		if result is None:
-			return 'Prediction failed', 500
-		
-		return result
-	except Exception as e:
-		logging.error(f'Prediction failed: {e}')
+	file = request.files.get('image')
+	if file is None:
+		return 'No image provided', 400
+	future = submit_predict(read_upload('predict', file))
+	result = future.result()
+	if result is None:
 		return 'Prediction failed', 500
+	
+	return json_response('predict', result)
 
 
 @app.route('/tag_assoc', methods=['POST'])
+@flask_endpoint('tag_assoc')
 def tag_assoc():
-	"""Predict tags based on the given tags."""
-	try:
-		tags = request.form.getlist('tags')
-		file = request.files.get('image')
-		if file is None:
-			future = executor.submit(tag_assoc_worker, TagAssocJob(tags))
-		else:
-			data = file.stream.read()
-			image = Image.open(io.BytesIO(data))
-			image.load()
-			image_hash = sha256(data).digest()
-			future = executor.submit(tag_image_assoc_worker, TagImageAssocJob(tags, image, image_hash))
-		
-		result = future.result()
-		if result is None:
-			return 'Prediction failed', 500
-		
-		return result
-	except Exception as e:
-		logging.error(f'Prediction failed: {e}')
+	"""
+	Predict tags based on the given tags.
+	With steps > 0, instead greedily (beams = 1) or with beam search extend the tags by that many tags.
+	"""
+	tags = request.form.getlist('tags')
+	generation = parse_generation_params(request.form)
+	if generation is None:
+		return f'steps must be between 0 and {MAX_GENERATE_STEPS} and beams between 1 and {MAX_BEAMS}', 400
+	file = request.files.get('image')
+	future = submit_tag_assoc(tags, read_upload('tag_assoc', file) if file is not None else None, *generation)
+	result = future.result()
+	if result is None:
 		return 'Prediction failed', 500
+	
+	return json_response('tag_assoc', result)
 
 
 @app.route('/caption', methods=['POST'])
+@flask_endpoint('caption')
 def caption():
 	"""Generate a caption for an image using the VLM model."""
-	try:
-		prompt = request.form.get('prompt')
-		if prompt is None:
-			return 'No prompt provided', 400
-		file = request.files.get('image')
-		if file is None:
-			return 'No image provided', 400
-		image = Image.open(file.stream)
-		image.load()
-		future = executor.submit(captioning_worker, ImageCaptioningJob(image, prompt))
-		result = future.result()
+	prompt = request.form.get('prompt')
+	if prompt is None:
+		return 'No prompt provided', 400
+	file = request.files.get('image')
+	if file is None:
+		return 'No image provided', 400
+	future = submit_caption(prompt, read_upload('caption', file))
+	result = future.result()
+	if result is None:
+		return 'Prediction failed', 500
+	
+	return json_response('caption', result)
+
+
+@app.route('/prefetch', methods=['POST'])
+def prefetch():
+	"""Warm the result caches for images that are likely to be requested next."""
+	hashes = parse_image_hashes(request.form.getlist('hashes'))
+	if hashes is None:
+		return 'Invalid image hash', 400
+	
+	return {'pending': PREFETCHER.add(hashes)}
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+	"""Prometheus metrics."""
+	return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/profile', methods=['POST'])
+def profile():
+	"""Capture a torch.profiler trace of the next N model jobs."""
+	num_jobs = request.form.get('requests', 10, type=int)
+	if num_jobs < 1:
+		return 'requests must be a positive integer', 400
+	
+	path = PROFILER.arm(num_jobs)
+	if path is None:
+		return 'A profile capture is already in progress', 409
+	
+	return {'path': str(path), 'requests': num_jobs}
+
+
+def create_asgi_app():
+	"""
+	Build an ASGI app exposing the same routes as the Flask app.
+	Uploads are parsed by the event loop as they stream in, while image decoding, JSON encoding and
+	the model work itself run on threads, so a slow job never stalls other connections.
+	"""
+	from starlette.applications import Starlette
+	from starlette.concurrency import run_in_threadpool
+	from starlette.datastructures import UploadFile
+	from starlette.middleware import Middleware
+	from starlette.middleware.cors import CORSMiddleware
+	from starlette.requests import Request
+	from starlette.responses import JSONResponse, PlainTextResponse, Response
+	from starlette.routing import Route
+
+	async def read_form(endpoint: str, request: Request, name: str) -> tuple:
+		"""Read a multipart form, returning it along with the named upload's bytes (or None)."""
+		start = time.perf_counter()
+		async with request.form() as form:
+			file = form.get(name)
+			data = await file.read() if isinstance(file, UploadFile) else None
+		METRICS.observe('prediction_stage_seconds', time.perf_counter() - start, endpoint=endpoint, stage='read')
+		return form, data
+	
+	async def finish(endpoint: str, future: concurrent.futures.Future) -> Response:
+		result = await asyncio.wrap_future(future)
 		if result is None:
-			return 'Prediction failed', 500
+			return PlainTextResponse('Prediction failed', 500)
 		
-		return result
-	except Exception as e:
-		logging.error(f'Prediction failed: {e}')
-		return 'Prediction failed', 500
+		body = await run_in_threadpool(serialize_result, endpoint, result)
+		return Response(body, media_type='application/json')
+
+	def endpoint(name: str):
+		def decorator(handler):
+			async def wrapper(request: Request) -> Response:
+				queue = QUEUES[name]
+				if not queue.try_acquire():
+					METRICS.inc('prediction_requests_total', endpoint=name, status='503')
+					return PlainTextResponse('Server overloaded', 503, headers={'Retry-After': str(RETRY_AFTER)})
+
+				start = time.perf_counter()
+				status = 500
+				try:
+					response = await handler(request)
+					status = response.status_code
+					return response
+				except Exception as e:
+					logging.error(f'Prediction failed: {e}')
+					return PlainTextResponse('Prediction failed', 500)
+				finally:
+					queue.release()
+					record_request(name, start, status)
+			
+			return wrapper
+		return decorator
+
+	@endpoint('predict')
+	async def asgi_predict(request: Request) -> Response:
+		_, data = await read_form('predict', request, 'image')
+		if data is None:
+			return PlainTextResponse('No image provided', 400)
+		
+		return await finish('predict', await run_in_threadpool(submit_predict, data))
+
+	@endpoint('tag_assoc')
+	async def asgi_tag_assoc(request: Request) -> Response:
+		form, data = await read_form('tag_assoc', request, 'image')
+		tags = [str(tag) for tag in form.getlist('tags')]
+		generation = parse_generation_params(form)
+		if generation is None:
+			return PlainTextResponse(f'steps must be between 0 and {MAX_GENERATE_STEPS} and beams between 1 and {MAX_BEAMS}', 400)
+		
+		return await finish('tag_assoc', await run_in_threadpool(submit_tag_assoc, tags, data, *generation))
+
+	@endpoint('caption')
+	async def asgi_caption(request: Request) -> Response:
+		form, data = await read_form('caption', request, 'image')
+		prompt = form.get('prompt')
+		if not isinstance(prompt, str):
+			return PlainTextResponse('No prompt provided', 400)
+		if data is None:
+			return PlainTextResponse('No image provided', 400)
+		
+		return await finish('caption', await run_in_threadpool(submit_caption, prompt, data))
+
+	async def asgi_prefetch(request: Request) -> Response:
+		async with request.form() as form:
+			hashes = parse_image_hashes([str(h) for h in form.getlist('hashes')])
+		if hashes is None:
+			return PlainTextResponse('Invalid image hash', 400)
+		
+		return JSONResponse({'pending': PREFETCHER.add(hashes)})
+
+	async def asgi_metrics(request: Request) -> Response:
+		body = await run_in_threadpool(render_metrics)
+		return PlainTextResponse(body, media_type='text/plain; version=0.0.4')
+
+	async def asgi_profile(request: Request) -> Response:
+		form = await request.form()
+		try:
+			num_jobs = int(str(form.get('requests', 10)))
+		except ValueError:
+			num_jobs = 0
+		if num_jobs < 1:
+			return PlainTextResponse('requests must be a positive integer', 400)
+		
+		path = PROFILER.arm(num_jobs)
+		if path is None:
+			return PlainTextResponse('A profile capture is already in progress', 409)
+		
+		return JSONResponse({'path': str(path), 'requests': num_jobs})
+
+	return Starlette(
+		routes=[
+			Route('/predict', asgi_predict, methods=['POST']),
+			Route('/tag_assoc', asgi_tag_assoc, methods=['POST']),
+			Route('/caption', asgi_caption, methods=['POST']),
+			Route('/prefetch', asgi_prefetch, methods=['POST']),
+			Route('/metrics', asgi_metrics, methods=['GET']),
+			Route('/profile', asgi_profile, methods=['POST']),
+		],
+		middleware=[Middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['*'], allow_headers=['*'])],
+	)
 
 
 def prediction_worker_init(model_path: Path, tag_assoc_model_path: Path):
 	logging.info('Loading image model')
 	thread_local.model = load_model(model_path)
 	thread_local.model.eval()
+	register_model('tagger', thread_local.model)
 
 	with open(model_path / 'top_tags.txt') as f:
-		thread_local.top_tags = [line.strip() for line in f.readlines() if line.strip()]
+		TOP_TAGS[:] = [line.strip() for line in f if line.strip()]
 
 	logging.info('Image model loaded')
 
 	logging.info('Loading tag association model')
 	thread_local.tag_assoc_model, thread_local.tag_to_id, thread_local.id_to_tag = load_tag_assoc_model(tag_assoc_model_path)
+	register_model('tag_assoc', thread_local.tag_assoc_model)
 	logging.info('Tag association model loaded')
 
-	thread_local.image_embedding_cache = LruCache(maxsize=1000)
-
-	assert len(thread_local.tag_to_id) == len(thread_local.top_tags) + 3
+	assert len(thread_local.tag_to_id) == len(TOP_TAGS) + 3
 
 	logging.info('Loading VLM model')
 	thread_local.vlm_model = load_vlm_model(Path(args.vlm_model))
+	register_model('vlm', thread_local.vlm_model[1])
 	logging.info('VLM model loaded')
 
 
@@ -445,32 +1108,35 @@ def captioning_worker(job: ImageCaptioningJob):
 	return {'caption': caption}
 
 
+def tag_probabilities_to_dict(probs: torch.Tensor) -> dict[str, float]:
+	return {tag: prob for tag, prob in zip(TOP_TAGS, probs.tolist())}
+
+
 @torch.no_grad()
 def tag_prediction_worker(job: TagPredictionJob) -> dict[str, float] | None:
-	model = thread_local.model
-	image = job.image
-
 	try:
-		image_tensor = prepare_image(image)
-
-		batch = {
-			'image': image_tensor.unsqueeze(0).to('cuda'),
-		}
-
-		with torch.amp.autocast_mode.autocast('cuda', enabled=True):
-			preds = model(batch)
+		probs = CACHES['predict'].peek(job.image_hash.hex())
+		if probs is None:
+			probs, _ = run_image_model(job.image_hash, job.image)
 	except Exception as e:
 		logging.error(f'Tag prediction failed: {e}')
 		return None
 
-	tags = preds['tags'][0].sigmoid().cpu().tolist()
-	result = {tag: prob for tag, prob in zip(thread_local.top_tags, tags)}
+	with stage('postprocess'):
+		result = tag_probabilities_to_dict(probs)
 
 	return result
 
 
 @torch.no_grad()
-def tag_assoc_worker(job: TagAssocJob) -> dict[str, float] | None:
+def prefetch_worker(job: PrefetchJob):
+	key = job.image_hash.hex()
+	if CACHES['predict'].peek(key) is None or CACHES['image_embedding'].peek(key) is None:
+		run_image_model(job.image_hash, job.image)
+
+
+@torch.no_grad()
+def tag_assoc_worker(job: TagAssocJob) -> dict | None:
 	model = thread_local.tag_assoc_model
 	tag_to_id = thread_local.tag_to_id
 	id_to_tag = thread_local.id_to_tag
@@ -482,20 +1148,28 @@ def tag_assoc_worker(job: TagAssocJob) -> dict[str, float] | None:
 	try:
 		input_tags = [1] + input_tags   # Add the BOS token
 
-		batch = {
-			'input_ids': torch.tensor([input_tags]).cuda(),
-			#'attention_mask': torch.tensor([[1]]).cuda(),
-			#'position_ids': torch.tensor([[0]]).cuda(),
-		}
+		with stage('to_device'):
+			batch = {
+				'input_ids': torch.tensor([input_tags], device=DEVICE),
+				#'attention_mask': torch.tensor([[1]]).cuda(),
+				#'position_ids': torch.tensor([[0]]).cuda(),
+			}
+
+		if job.steps > 0:
+			return generate_tags(model, batch, input_tags, job.steps, job.beams)
 
-		with torch.no_grad():
+		METRICS.observe('prediction_batch_size', 1, buckets=BATCH_SIZE_BUCKETS, endpoint='tag_assoc')
+
+		with stage('forward'), torch.no_grad():
 			output = model(**batch)
+			synchronize()
 
-		# Probabilities
-		probs = torch.softmax(output.logits[0, -1, :], dim=-1).cpu()
+		with stage('postprocess'):
+			# Probabilities
+			probs = torch.softmax(output.logits[0, -1, :], dim=-1).cpu()
 
-		# Top tags
-		top20 = torch.topk(probs, 20)
+			# Top tags
+			top20 = torch.topk(probs, 20)
 	except Exception as e:
 		logging.error(f'Prediction failed for {job.tags}: {e}')
 		return None
@@ -508,31 +1182,121 @@ def tag_assoc_worker(job: TagAssocJob) -> dict[str, float] | None:
 
 
 @torch.no_grad()
-def get_image_embedding(image: Image.Image) -> torch.Tensor:
+def generate_tags(model: LlamaMultiModel, batch: dict, input_tags: list[int], steps: int, beams: int) -> dict:
+	"""
+	Extend a tag sequence by `steps` tags with beam search (greedy when beams = 1), reusing the KV cache between steps.
+	Special tokens and tags already in a sequence are never proposed.
+	Sequences are scored by their summed log probability; beams that are re-orderings of the same tag set are dropped.
+	"""
+	id_to_tag = thread_local.id_to_tag
+	vocab_size = model.config.vocab_size
+	prefix_len = len(input_tags)
+	steps = min(steps, vocab_size - len(set(input_tags) | set(SPECIAL_TAG_IDS)), model.config.max_position_embeddings - prefix_len)
+	METRICS.observe('prediction_batch_size', beams, buckets=BATCH_SIZE_BUCKETS, endpoint='tag_assoc')
+
+	with stage('forward'):
+		output = model(**batch, use_cache=True)
+		cache = output.past_key_values
+		logits = output.logits[:, -1, :]
+
+		banned = torch.zeros((1, vocab_size), dtype=torch.bool, device=logits.device)
+		banned[0, SPECIAL_TAG_IDS] = True
+		banned[0, input_tags] = True
+		scores = torch.zeros(1, device=logits.device)
+		sequences: list[list[int]] = [[]]
+		sequence_log_probs: list[list[float]] = [[]]
+
+		for step in range(steps):
+			log_probs = torch.log_softmax(logits.float(), dim=-1).masked_fill(banned, float('-inf'))
+			candidates = (scores[:, None] + log_probs).view(-1)
+			top = torch.topk(candidates, min(beams * beams, candidates.shape[0]))
+
+			# Keep the best candidate for each distinct tag set
+			beam_idx, tokens, seen = [], [], set()
+			for index, score in zip(top.indices.tolist(), top.values.tolist()):
+				if score == float('-inf') or len(beam_idx) == beams:
+					break
+				beam, token = divmod(index, vocab_size)
+				tag_set = frozenset(sequences[beam]) | {token}
+				if tag_set in seen:
+					continue
+				seen.add(tag_set)
+				beam_idx.append(beam)
+				tokens.append(token)
+
+			beam_idx_t = torch.tensor(beam_idx, device=logits.device)
+			tokens_t = torch.tensor(tokens, device=logits.device)
+			token_log_probs = log_probs[beam_idx_t, tokens_t]
+			scores = scores[beam_idx_t] + token_log_probs
+			banned = banned[beam_idx_t]
+			banned[torch.arange(len(tokens), device=logits.device), tokens_t] = True
+			sequences = [sequences[b] + [t] for b, t in zip(beam_idx, tokens)]
+			sequence_log_probs = [sequence_log_probs[b] + [lp] for b, lp in zip(beam_idx, token_log_probs.tolist())]
+
+			if step == steps - 1:
+				break
+
+			cache.reorder_cache(beam_idx_t)
+			output = model(input_ids=tokens_t[:, None], past_key_values=cache, use_cache=True)
+			cache = output.past_key_values
+			logits = output.logits[:, -1, :]
+		
+		synchronize()
+	
+	with stage('postprocess'):
+		result = {
+			'sequences': [
+				{
+					'tags': [id_to_tag[t] for t in sequence],
+					'probs': [math.exp(lp) for lp in log_probs],
+					'score': sum(log_probs),
+				}
+				for sequence, log_probs in zip(sequences, sequence_log_probs)
+			],
+		}
+
+	return result
+
+
+@torch.no_grad()
+def run_image_model(image_hash: bytes, image: Image.Image) -> tuple[torch.Tensor, torch.Tensor]:
+	"""
+	Compute an image's tag probabilities and its tag association embedding.
+	One forward of the image model produces both, so both caches are filled together.
+	"""
 	image_model = thread_local.model
 	model = thread_local.tag_assoc_model
 
-	image_tensor = prepare_image(image)
+	with stage('prepare_image'):
+		image_tensor = prepare_image(image)
 
-	batch = {
-		'image': image_tensor.unsqueeze(0).to('cuda', dtype=torch.float32),
-	}
+	with stage('to_device'):
+		batch = {
+			'image': image_tensor.unsqueeze(0).to(DEVICE, dtype=torch.float32),
+		}
+	METRICS.observe('prediction_batch_size', batch['image'].shape[0], buckets=BATCH_SIZE_BUCKETS, endpoint=thread_local.endpoint)
 
-	with torch.amp.autocast_mode.autocast('cuda', enabled=True):
-		preds = image_model(batch, return_embeddings=True)
+	with stage('forward'):
+		with autocast():
+			preds = image_model(batch, return_embeddings=True)
+	
+		image_embedding = preds['embeddings'][0]
+		image_embedding = model.image_proj(image_embedding)
+		synchronize()
 	
-	image_embedding = preds['embeddings'][0]
-	image_embedding = model.image_proj(image_embedding)
+	with stage('postprocess'):
+		probs = preds['tags'][0].sigmoid().float().cpu()
 
-	return image_embedding
+	CACHES['predict'].put(image_hash.hex(), probs)
+	CACHES['image_embedding'].put(image_hash.hex(), image_embedding)
+
+	return probs, image_embedding
 
 
 @torch.no_grad()
-def tag_image_assoc_worker(job: TagImageAssocJob) -> dict[str, float] | None:
-	image_embedding_cache = thread_local.image_embedding_cache
+def tag_image_assoc_worker(job: TagImageAssocJob) -> dict | None:
 	model = thread_local.tag_assoc_model
 	image_hash = job.image_hash.hex()
-	image = job.image
 	tag_to_id = thread_local.tag_to_id
 	id_to_tag = thread_local.id_to_tag
 
@@ -541,11 +1305,16 @@ def tag_image_assoc_worker(job: TagImageAssocJob) -> dict[str, float] | None:
 	input_tags = [tag_to_id[tag] for tag in job.tags if tag in tag_to_id]
 
 	try:
-		image_embedding = image_embedding_cache.get(image_hash, functools.partial(get_image_embedding, image))
+		image_embedding = CACHES['image_embedding'].peek(image_hash)
+		if image_embedding is None:
+			# The image is only left undecoded if its embedding was cached at submission, but it may have been evicted since
+			image = job.image if job.image is not None else decode_image(job.image_data)
+			_, image_embedding = run_image_model(job.image_hash, image)
 
 		input_tags = [1] + input_tags   # Add the BOS token
 
-		input_ids = torch.tensor([input_tags]).cuda()
+		with stage('to_device'):
+			input_ids = torch.tensor([input_tags], device=DEVICE)
 		input_embeds = model.model.embed_tokens(input_ids)
 		input_embeds[0, 0] = image_embedding
 
@@ -556,14 +1325,21 @@ def tag_image_assoc_worker(job: TagImageAssocJob) -> dict[str, float] | None:
 			'inputs_embeds': input_embeds,
 		}
 
-		with torch.no_grad():
+		if job.steps > 0:
+			return generate_tags(model, batch, input_tags, job.steps, job.beams)
+
+		METRICS.observe('prediction_batch_size', 1, buckets=BATCH_SIZE_BUCKETS, endpoint='tag_assoc')
+
+		with stage('forward'), torch.no_grad():
 			output = model(**batch)
+			synchronize()
 
-		# Probabilities
-		probs = torch.softmax(output.logits[0, -1, :], dim=-1).cpu()
+		with stage('postprocess'):
+			# Probabilities
+			probs = torch.softmax(output.logits[0, -1, :], dim=-1).cpu()
 
-		# Top tags
-		top20 = torch.topk(probs, 20)
+			# Top tags
+			top20 = torch.topk(probs, 20)
 	except Exception as e:
 		logging.error(f'Prediction failed for {job.tags}: {e}')
 		return None
@@ -575,32 +1351,12 @@ def tag_image_assoc_worker(job: TagImageAssocJob) -> dict[str, float] | None:
 	return predictions
 
 
-T = TypeVar('T')
-K = TypeVar('K')
-
-class LruCache(Generic[T, K]):
-	cache: dict[K, T]
-	queue: list[K]
-
-	def __init__(self, maxsize: int):
-		self.maxsize = maxsize
-		self.cache = {}
-		self.queue = []
-	
-	def get(self, key: K, func) -> T:
-		if key in self.cache:
-			self.queue.remove(key)
-			self.queue.append(key)
-			return self.cache[key]
-		
-		if len(self.queue) >= self.maxsize:
-			del self.cache[self.queue.pop(0)]
-		
-		value = func()
-		self.cache[key] = value
-		self.queue.append(key)
-
-		return value
+def serve(server: str, host: str, port: int):
+	if server == 'asgi':
+		import uvicorn
+		uvicorn.run(create_asgi_app(), host=host, port=port)
+	else:
+		app.run(host=host, port=port, debug=False, threaded=True)
 
 
 if __name__ == '__main__':
@@ -609,7 +1365,17 @@ if __name__ == '__main__':
 	args = parser.parse_args()
 	IMAGE_DIR = Path(args.image_dir)
 	IMAGE_SIZE = args.image_size
+	CACHES['predict'].maxsize = args.cache_size
+	CACHES['image_embedding'].maxsize = args.cache_size
+	PREFETCHER.maxsize = args.prefetch_queue
+	RETRY_AFTER = args.retry_after
+	PROFILE_DIR = Path(args.profile_dir)
+	QUEUES['predict'].max_pending = args.max_pending
+	QUEUES['tag_assoc'].max_pending = args.max_pending
+	QUEUES['caption'].max_pending = args.max_pending_caption
+
+	DEVICE = args.device
 
 	executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, initializer=prediction_worker_init, initargs=(Path(args.model), Path(args.tag_assoc_model)))
 
-	app.run(host=args.host, port=args.port, debug=False, threaded=True)
\ No newline at end of file
+	serve(args.server, args.host, args.port)
\ No newline at end of file